@@ -6,6 +6,7 @@ import logging
 from config import *
 from mtj.mud.server import *
 from mtj.mud.runner import *
+from mtj.mud.gateway import *
 
 # XXX - perhaps move this to a local logging class
 logging.basicConfig(level=logging.WARNING)
@@ -4,6 +4,7 @@
 
 import logging
 from config import *
+from telnet import Frame
 
 LOG = logging.getLogger("mtj.mud.actions")
 
@@ -17,6 +18,9 @@ class MudNotify(object):
     do to the message(s) they receive.
     """
 
+    # the command this was typed in as, None if it was not.
+    verb = None
+
     def __init__(
             self, 
             caller,
@@ -89,14 +93,12 @@ class MudNotify(object):
         LOG.debug('clean children (%s, %s)', param.__repr__(), obj.__repr__())
         if param is True:
             if obj:
-                result = obj.children
                 # remove extras.
                 if type(rem) not in (list, set):
                     rem = set([self.caller, self.target, self.second])
-                # XXX smarter way to deal with this nested
-                for r in rem:
-                    if r in result:
-                        result.remove(r)
+                elif type(rem) is list:
+                    rem = set(rem)
+                result = [i for i in obj.children if i not in rem]
         elif type(param) is list:
             result = param
         return result
@@ -162,25 +164,29 @@ class MudNotify(object):
             self.second.send(self.secondMsg)
 
         if self.caller_siblingsMsg:
-            for cs in self.caller_siblings:
-                cs.send(self.caller_siblingsMsg)
+            self._broadcast(self.caller_siblings, self.caller_siblingsMsg)
         if self.caller_childrenMsg:
-            for cs in self.caller_children:
-                cs.send(self.caller_childrenMsg)
+            self._broadcast(self.caller_children, self.caller_childrenMsg)
 
         if self.target_siblingsMsg:
-            for cs in self.target_siblings:
-                cs.send(self.target_siblingsMsg)
+            self._broadcast(self.target_siblings, self.target_siblingsMsg)
         if self.target_childrenMsg:
-            for cs in self.target_children:
-                cs.send(self.target_childrenMsg)
+            self._broadcast(self.target_children, self.target_childrenMsg)
 
         if self.second_siblingsMsg:
-            for cs in self.second_siblings:
-                cs.send(self.second_siblingsMsg)
+            self._broadcast(self.second_siblings, self.second_siblingsMsg)
         if self.second_childrenMsg:
-            for cs in self.second_children:
-                cs.send(self.second_childrenMsg)
+            self._broadcast(self.second_children, self.second_childrenMsg)
+
+    def _broadcast(self, targets, msg):
+        """\
+        Sends msg to every one of targets, framed only once.
+        """
+        if not targets:
+            return
+        msg = Frame(msg)
+        for t in targets:
+            t.send(msg)
 
     def setResponse(self): #, caller, target, others, caller_siblings):
         """\
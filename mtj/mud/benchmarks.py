@@ -0,0 +1,340 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+"""\
+Micro benchmarks of the world objects.
+
+Fills a room with more and more players and times what a player in it
+does: commands that only concern the player should cost the same no
+matter how crowded the room is, while the ones that reach everyone in
+the room (say, look) should cost the same per player reached.  No
+sockets are involved, the players have no souls so what is sent to
+them goes nowhere.
+
+Then many objects of each kind are created to see how much memory each
+of them takes, going by the resident size of the process (read from
+/proc, so only on Linux).
+
+Then the timer wheel of the driver is loaded with more and more
+pending timers, to see that scheduling, cancelling and ticking cost the
+same however many there are.
+
+Last, messages the size of a line and of a tick of output are passed
+through the ring gateways use, and through a (pickling) pipe for
+comparison.
+
+Usage: python -m mtj.mud.benchmarks [options]
+"""
+
+import gc
+import multiprocessing
+import os
+import sys
+import time
+from optparse import OptionParser
+
+from mtj.mud.objects import *
+from mtj.mud.timer import TimerWheel
+from mtj.mud.ring import Ring
+
+DEFAULT_SIZES = '10,100,1000,5000'
+DEFAULT_OBJECTS = 100000
+DEFAULT_TIMERS = '0,1000,100000,300000'
+DEFAULT_MESSAGES = '16,1024,16384'
+
+
+def _time(func, number):
+    """\
+    Returns the microseconds a call to func takes, the best of three
+    runs of number calls.
+    """
+    best = None
+    for i in xrange(3):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        spent = time.time() - start
+        if best is None or spent < best:
+            best = spent
+    return best / number * 1e6
+
+
+class Crowd(object):
+    """\
+    A room with size players and two swords in it, next to an empty
+    room.
+    """
+
+    def __init__(self, size):
+        self.room = MudRoom(shortdesc='Crowded room')
+        self.other = MudRoom(shortdesc='Empty room')
+        MudRoomLink(link=((self.room, 'east'), (self.other, 'west')))
+        self.players = [MudPlayer(name='p%d' % i) for i in xrange(size)]
+        for player in self.players:
+            self.room.add(player)
+        for i in xrange(2):
+            self.room.add(MudObject(shortdesc='sword'))
+        self.player = self.players[size // 2]
+
+    def unknown(self):
+        self.player.process_cmd('xyzzy')
+
+    def dispatch(self):
+        self.player.process_cmd('say hello')
+
+    def say(self):
+        self.player.process_cmd('say hello')()
+
+    def look(self):
+        self.player.process_cmd('look').setResponse()
+
+    def look_at(self):
+        self.player.process_cmd('look 2.sword').setResponse()
+
+    def find(self):
+        self.room.find('p0')
+
+    def walk(self):
+        # out and back in, so the room stays as it was.
+        player = self.player
+        self.room.move_obj_to(player, self.other)
+        self.other.move_obj_to(player, self.room)
+
+
+# name, method, whether it is reported per player reached.
+BENCHMARKS = (
+    ('unknown', 'unknown', False),
+    ('dispatch', 'dispatch', False),
+    ('look at', 'look_at', False),
+    ('find', 'find', False),
+    ('walk', 'walk', False),
+    ('say/pl', 'say', True),
+    ('look/pl', 'look', True),
+)
+
+
+def run(sizes, number=200, out=None):
+    """\
+    Runs every benchmark for every room size, returns the results as
+    a list of (size, {name: microseconds}).
+    """
+    results = []
+    for size in sizes:
+        crowd = Crowd(size)
+        timings = {}
+        for name, method, per_player in BENCHMARKS:
+            spent = _time(getattr(crowd, method), number)
+            if per_player:
+                spent /= size
+            timings[name] = spent
+        results.append((size, timings))
+        if out is not None:
+            report(results[-1:], out, header=len(results) == 1)
+    return results
+
+
+def report(results, out, header=True):
+    if header:
+        out.write('%8s' % 'players')
+        for name, method, per_player in BENCHMARKS:
+            out.write(' %10s' % name)
+        out.write('  (us)\n')
+    for size, timings in results:
+        out.write('%8d' % size)
+        for name, method, per_player in BENCHMARKS:
+            out.write(' %10.2f' % timings[name])
+        out.write('\n')
+    out.flush()
+
+
+def _item_with_id(i):
+    item = MudObject(shortdesc='sword')
+    item.add_id('blade')
+    return item
+
+
+def _shared_item():
+    """\
+    Returns a factory that puts one more of a shared item into the same
+    box each time.
+    """
+    box = MudObject(shortdesc='box')
+    item = MudObject(shortdesc='potion')
+    item.share()
+    def factory(i):
+        box.add(item)
+        return item
+    return factory
+
+
+# name, factory taking the number of the object.
+MEMORY = (
+    ('item', lambda i: MudObject(shortdesc='sword')),
+    ('item+id', _item_with_id),
+    ('shared', _shared_item()),
+    ('player', lambda i: MudPlayer(name='p%d' % i)),
+    ('room', lambda i: MudRoom()),
+)
+
+
+def _rss():
+    f = open('/proc/self/statm')
+    try:
+        pages = int(f.read().split()[1])
+    finally:
+        f.close()
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def memory(count, out=None):
+    """\
+    Creates count objects of every kind, returns the bytes each one
+    took as {name: bytes}.
+    """
+    results = {}
+    # kept until the end, so the memory of one kind is not reused for
+    # the next.
+    kept = []
+    for name, factory in MEMORY:
+        objs = [None] * count
+        gc.collect()
+        before = _rss()
+        for i in xrange(count):
+            objs[i] = factory(i)
+        results[name] = float(_rss() - before) / count
+        kept.append(objs)
+        if out is not None:
+            out.write('%8s %8.0f bytes\n' % (name, results[name]))
+            out.flush()
+    return results
+
+
+def _noop():
+    pass
+
+
+def timers(counts, out=None, ticks=10000):
+    """\
+    Times the timer wheel with count timers pending, spread over the
+    next day, for every count.  Returns a list of (count, {name:
+    microseconds}).
+    """
+    results = []
+    if out is not None:
+        out.write('%8s %10s %10s %10s  (us)\n' % (
+            'timers', 'schedule', 'cancel', 'tick'))
+    for count in counts:
+        wheel = TimerWheel(resolution=0.1, now=0)
+        day = 86400
+        step = float(day) / max(count, 1)
+        for i in xrange(count):
+            wheel.schedule(_noop, 1 + i * step)
+        timings = {}
+        number = 10000
+        # as timeit does, so a collection of everything pending does
+        # not land on one of the timings.
+        gc.disable()
+        try:
+            start = time.time()
+            pending = [wheel.schedule(_noop, 1 + (i * 7919 % day))
+                       for i in xrange(number)]
+            timings['schedule'] = (time.time() - start) / number * 1e6
+            start = time.time()
+            for timer in pending:
+                timer.cancel()
+            timings['cancel'] = (time.time() - start) / number * 1e6
+            # a tick at a time, as the driver does.
+            start = time.time()
+            for i in xrange(ticks):
+                wheel.run(i * 0.1)
+            timings['tick'] = (time.time() - start) / ticks * 1e6
+        finally:
+            gc.enable()
+        results.append((count, timings))
+        if out is not None:
+            out.write('%8d %10.2f %10.2f %10.2f\n' % (count,
+                timings['schedule'], timings['cancel'], timings['tick']))
+            out.flush()
+    return results
+
+
+def rings(sizes, out=None, number=10000):
+    """\
+    Times passing a message of each size through a Ring and through a
+    pipe, in and out again.  Returns a list of (size, {name:
+    microseconds}).
+    """
+    results = []
+    if out is not None:
+        out.write('%8s %10s %10s  (us)\n' % ('bytes', 'ring', 'pipe'))
+    ring = Ring()
+    reader, writer = multiprocessing.Pipe(False)
+    try:
+        for size in sizes:
+            data = 'x' * size
+            timings = {}
+            gc.disable()
+            try:
+                start = time.time()
+                for i in xrange(number):
+                    ring.put(data)
+                    ring.get()
+                timings['ring'] = (time.time() - start) / number * 1e6
+                start = time.time()
+                for i in xrange(number):
+                    writer.send(data)
+                    reader.recv()
+                timings['pipe'] = (time.time() - start) / number * 1e6
+            finally:
+                gc.enable()
+            results.append((size, timings))
+            if out is not None:
+                out.write('%8d %10.2f %10.2f\n' % (size, timings['ring'],
+                                                    timings['pipe']))
+                out.flush()
+    finally:
+        ring.close()
+        reader.close()
+        writer.close()
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]',
+        description='Times commands as the room gets more crowded.')
+    parser.add_option('-s', '--sizes', default=DEFAULT_SIZES,
+        help='comma separated numbers of players in the room [%default]')
+    parser.add_option('-n', '--number', type='int', default=200,
+        help='calls per timing [%default]')
+    parser.add_option('-o', '--objects', type='int', default=DEFAULT_OBJECTS,
+        help='objects of each kind to measure memory with, 0 to skip '
+             '[%default]')
+    parser.add_option('-t', '--timers', default=DEFAULT_TIMERS,
+        help='comma separated numbers of pending timers [%default]')
+    parser.add_option('-m', '--messages', default=DEFAULT_MESSAGES,
+        help='comma separated sizes of messages through the rings '
+             '[%default]')
+    options, args = parser.parse_args(argv)
+    try:
+        sizes = [int(i) for i in options.sizes.split(',')]
+        counts = [int(i) for i in options.timers.split(',') if i]
+        messages = [int(i) for i in options.messages.split(',') if i]
+    except ValueError:
+        parser.error('sizes, timers and messages must be numbers')
+    if [i for i in sizes if i < 1]:
+        parser.error('sizes must be positive')
+    run(sizes, options.number, sys.stdout)
+    if options.objects > 0:
+        sys.stdout.write('\n')
+        memory(options.objects, sys.stdout)
+    if counts:
+        sys.stdout.write('\n')
+        timers(counts, sys.stdout)
+    if messages:
+        sys.stdout.write('\n')
+        rings(messages, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
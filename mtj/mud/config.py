@@ -1,9 +1,61 @@
 HOST = '0.0.0.0'
 PORT = 50000
+# longest the event server waits for activity at a time.
 LISTEN_TIMEOUT = 1  # seconds
+# connections the system may hold pending for each listening socket
+LISTEN_BACKLOG = 1024
+# connections accepted per wakeup of the listening socket
+ACCEPT_BATCH = 64
+# number of listening sockets (bound with SO_REUSEPORT when above 1),
+# each served by its own thread
+LISTENERS = 1
+# 'threaded' for a thread per connection, 'event' for a single event loop
+SERVER_MODE = 'event'
 MAX_DATA_LEN = 512
 MAX_CMD_LEN = 1024
+# times a connection may flood its input (or send lines that are too
+# long) in a row before it gets dropped
 MAX_BAD = 10
+# input limits per connection: commands processed per second, and how
+# many can be processed at once after a quiet period.  Input beyond
+# that is held back and the connection is not read until it is done.
+INPUT_RATE = 5
+INPUT_BURST = 20
+# limits of the per connection output queue, and what to do with clients
+# that cannot keep up: 'drop_oldest', 'summarize' or 'disconnect'
+OUTPUT_MAX_BYTES = 65536
+OUTPUT_MAX_MSGS = 512
+OUTPUT_POLICY = 'drop_oldest'
+# how soon a connection that could not take all of its output is tried
+# again, doubling every time up to the most; unless its server can tell
+# when it is able to take more.
+FLUSH_RETRY = 0.002  # seconds
+FLUSH_RETRY_MAX = 1  # seconds
+# offer MCCP v2 (telnet compression) to clients, and the zlib level used
+MCCP_ENABLED = True
+MCCP_LEVEL = 6
+# how finely the driver keeps time for scheduled actions
+TIMER_RESOLUTION = 0.1  # seconds
+# most commands the driver runs, and longest it spends running them,
+# in a tick before it moves on to timers and output.  The rest is left
+# for the next tick.
+CMD_TICK_LIMIT = 100
+CMD_TICK_TIME = 0.05  # seconds
+# number of gateway processes holding the connections, passing lines to
+# the driver and output back over rings in shared memory.  With none the
+# connections are served by the driver process itself.
+GATEWAYS = 0
+# bytes in each ring, a power of two well above OUTPUT_MAX_BYTES
+GATEWAY_RING_SIZE = 1 << 20
+# longest a gateway or the driver waits before looking at a ring again,
+# in case a wakeup got lost.
+GATEWAY_POLL = 0.1  # seconds
+# lines a gateway holds for the driver while the ring to it is full,
+# beyond which they are dropped.
+GATEWAY_BACKLOG = 4096
+# file the commands the driver runs are appended to, to be replayed with
+# mudreplay.  With none they are not kept.
+JOURNAL = None
 CMD_TERM = ['\r', '\n']
 CHAR_TERM = '\r'
 
@@ -0,0 +1,107 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+# marks the places of removed items until the list is compacted.
+_HOLE = object()
+
+
+class OrderedSet(object):
+    """\
+    Set that keeps the order items were added in.
+
+    Adding, removing and membership tests take constant time.  Items
+    must be hashable, and are compared by what their hash and equality
+    say (which is identity for MudObjects).  Removed items leave holes
+    in the underlying list, which is compacted once they outnumber the
+    items, so the positions from key keep their order.
+    """
+
+    def __init__(self, items=()):
+        self._items = []
+        self._pos = {}
+        self._holes = 0
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, item):
+        return item in self._pos
+
+    def __iter__(self):
+        return (i for i in self._items if i is not _HOLE)
+
+    def __getitem__(self, index):
+        if self._holes:
+            self._compact()
+        return self._items[index]
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, list(self).__repr__())
+
+    def add(self, item):
+        """\
+        Adds item at the end, returns False if it was already there.
+        """
+        if item in self._pos:
+            return False
+        self._pos[item] = len(self._items)
+        self._items.append(item)
+        return True
+
+    def remove(self, item):
+        """\
+        Removes item, raises KeyError if it was not there.
+        """
+        self._items[self._pos.pop(item)] = _HOLE
+        self._holes += 1
+        if self._holes > 8 and self._holes > len(self._pos):
+            self._compact()
+
+    def discard(self, item):
+        if item in self._pos:
+            self.remove(item)
+
+    def key(self, item):
+        """\
+        Sort key that puts items in the order they were added.
+        """
+        return self._pos[item]
+
+    def view(self):
+        return SetView(self)
+
+    def _compact(self):
+        self._items = [i for i in self._items if i is not _HOLE]
+        self._pos = dict([(item, i) for i, item in enumerate(self._items)])
+        self._holes = 0
+
+
+class SetView(object):
+    """\
+    Read only view of an OrderedSet, for iterating over it without a
+    copy.  Like with a dict, the set must not be changed while it is
+    iterated over; iterate over a list of it for that.
+    """
+
+    __slots__ = ('_set',)
+
+    def __init__(self, set_):
+        self._set = set_
+
+    def __len__(self):
+        return len(self._set)
+
+    def __contains__(self, item):
+        return item in self._set
+
+    def __iter__(self):
+        return iter(self._set)
+
+    def __getitem__(self, index):
+        return self._set[index]
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, list(self._set).__repr__())
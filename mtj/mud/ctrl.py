@@ -18,7 +18,10 @@ class mudctrl:
         # XXX - objects by these 3 lines could be constructed as one in a 
         # startup class.
         self.driver = mtj.mud.MudDriver()
-        self.mudserv = mtj.mud.MudServerController(host=HOST, port=PORT)
+        if GATEWAYS:
+            self.mudserv = mtj.mud.MudGatewayController(host=HOST, port=PORT)
+        else:
+            self.mudserv = mtj.mud.MudServerController(host=HOST, port=PORT)
         self.driver.add(self.mudserv)
         self.active = True
         self.eval_mode = False
@@ -35,6 +38,8 @@ class mudctrl:
              'brake': self.brake,
              'level': self.level,
              'port': self.port,
+             'mode': self.mode,
+             'stats': self.stats,
              'debug()': self.debug,
              '': str,  # lolhack
         }
@@ -87,6 +92,34 @@ class mudctrl:
         else:
             print 'Usage: port <num>'
 
+    def mode(self, arg=None):
+        if arg in SERVER_MODES:
+            if self.mudserv.isRunning():
+                print 'mudserv running, mode takes effect on next start.'
+            self.mudserv.mode = arg
+            print 'mudserv.mode = %s' % arg
+        else:
+            print 'Usage: mode <%s>' % '|'.join(sorted(SERVER_MODES))
+
+    def stats(self, arg=None):
+        if not self.mudserv.isRunning():
+            print 'mudserv not started.'
+            return
+        print '%-24s %-12s %7s %8s %9s %8s %6s %6s %6s %4s' % ('address',
+            'name', 'queued', 'bytes', 'overflows', 'dropped', 'mccp',
+            'lines', 'thrtl', 'bad')
+        for soul in self.mudserv.souls:
+            s = soul.output_stats()
+            i = soul.input_stats()
+            mccp = '-'
+            if s['mccp_out']:
+                mccp = '%.1fx' % (float(s['mccp_in']) / s['mccp_out'])
+            print '%-24s %-12s %7d %8d %9d %8d %6s %6d %6d %4d' % (
+                '%s:%d' % soul.handler.client_address,
+                getattr(soul.body, 'name', '')[:12],
+                s['queued'], s['bytes'], s['overflows'], s['dropped'], mccp,
+                i['lines'], i['throttled'], i['bad'])
+
     def level(self, arg=None):
         if arg and arg.isdigit():
             level = int(arg)
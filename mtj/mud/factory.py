@@ -0,0 +1,87 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+import logging
+
+from objects import *
+
+LOG = logging.getLogger("mtj.mud.factory")
+
+
+class Factory(object):
+    """\
+    Registry of prototypes for items that are all alike, such as
+    potions or standard weapons.
+
+    Asking the factory for an item returns its shared prototype, which
+    any number of objects can hold at the cost of a count (see
+    MudObject.share).  When one of them needs an item of its own, to
+    change it or so it has a parent, it promotes its copy, which
+    replaces the shared one with a clone.
+
+    Prototypes are registered under a key, which can be the class of
+    the item itself, in which case the factory creates it when first
+    asked for it.
+    """
+
+    def __init__(self):
+        self._prototypes = {}
+
+    def __contains__(self, key):
+        return key in self._prototypes
+
+    def __len__(self):
+        return len(self._prototypes)
+
+    def __iter__(self):
+        return iter(self._prototypes)
+
+    def __getitem__(self, key):
+        return self._prototypes[key]
+
+    def __call__(self, key):
+        """\
+        Returns the prototype for key, creating it if key is a class
+        not registered yet.
+        """
+        try:
+            return self._prototypes[key]
+        except KeyError:
+            if not isinstance(key, type):
+                raise
+            return self.register(key, key)
+
+    def register(self, key, cls, *args, **kwargs):
+        """\
+        Creates the prototype for key, an instance of cls created with
+        the rest of the arguments.
+        """
+        return self.add(key, cls(*args, **kwargs))
+
+    def add(self, key, obj):
+        """\
+        Makes obj the prototype for key, sharing it.
+        """
+        if key in self._prototypes:
+            raise KeyError('%r is already registered' % (key,))
+        obj.share()
+        self._prototypes[key] = obj
+        LOG.debug('registered %r as %r', obj, key)
+        return obj
+
+    def remove(self, key):
+        """\
+        Forgets the prototype for key.  Whatever holds it keeps it.
+        """
+        del self._prototypes[key]
+
+    def clone(self, key):
+        """\
+        Returns a new item of its own made from the prototype for key.
+        """
+        return self(key).clone()
+
+
+# the factory of the world.
+factory = Factory()
@@ -0,0 +1,299 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+import time
+import heapq
+import logging
+import threading
+from collections import deque
+
+from config import *
+
+LOG = logging.getLogger("mtj.mud.flow")
+
+OUTPUT_POLICIES = ('drop_oldest', 'summarize', 'disconnect')
+
+
+class OutputQueue(object):
+    """\
+    Bounded queue of outgoing data for a single connection.
+
+    Each put is one message.  When either the message or the byte
+    limit would be exceeded, the policy decides what happens:
+
+    drop_oldest - the oldest messages are discarded to make room.
+    summarize - everything queued is discarded and replaced by a
+        single notice saying how much was skipped.
+    disconnect - the message is refused, and put returns False so the
+        owner can drop the connection.
+    """
+
+    def __init__(self, max_bytes=OUTPUT_MAX_BYTES, max_msgs=OUTPUT_MAX_MSGS,
+            policy=OUTPUT_POLICY, notice=None):
+        """\
+        Parameters:
+        max_bytes - the most bytes that can be queued.
+        max_msgs - the most messages that can be queued.
+        policy - one of OUTPUT_POLICIES.
+        notice - callable taking the number of messages and bytes that
+            were skipped, returning the data of the summary notice.
+            Only used by the summarize policy.
+        """
+        if policy not in OUTPUT_POLICIES:
+            raise ValueError('unknown output policy %s' % policy.__repr__())
+        self.max_bytes = max_bytes
+        self.max_msgs = max_msgs
+        self.policy = policy
+        self.notice = notice
+
+        self._q = deque()
+        self.bytes = 0
+        # statistics
+        self.overflows = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        # what the summary notice at the head of the queue accounts for
+        self._skipped = None
+
+    def __len__(self):
+        return len(self._q)
+
+    def _full(self, size):
+        return bool(self._q) and (len(self._q) >= self.max_msgs or
+                                  self.bytes + size > self.max_bytes)
+
+    def _drop(self):
+        data = self._q.popleft()
+        self.bytes -= len(data)
+        if self._skipped is not None:
+            # that was the notice
+            self._skipped = None
+        else:
+            self.dropped += 1
+            self.dropped_bytes += len(data)
+
+    def put(self, data):
+        """\
+        Queues data, returns False if it was refused.
+        """
+        if self._full(len(data)):
+            self.overflows += 1
+            if self.policy == 'disconnect':
+                return False
+            if self.policy == 'drop_oldest':
+                while self._full(len(data)):
+                    self._drop()
+            else:
+                count, size = self._skipped or (0, 0)
+                dropped, dropped_bytes = self.dropped, self.dropped_bytes
+                while self._q:
+                    self._drop()
+                count += self.dropped - dropped
+                size += self.dropped_bytes - dropped_bytes
+                if self.notice:
+                    notice = self.notice(count, size)
+                    self._q.append(notice)
+                    self.bytes += len(notice)
+                    self._skipped = (count, size)
+        self._q.append(data)
+        self.bytes += len(data)
+        return True
+
+    def take(self):
+        """\
+        Removes and returns everything queued as a single string.
+        """
+        data = ''.join(self._q)
+        self._q.clear()
+        self.bytes = 0
+        self._skipped = None
+        return data
+
+    def clear(self):
+        self._q.clear()
+        self.bytes = 0
+        self._skipped = None
+
+
+class TokenBucket(object):
+    """\
+    Token bucket rate limiter.
+
+    Allows rate events per second on average, and up to burst of them
+    at once after a quiet period.
+    """
+
+    def __init__(self, rate=INPUT_RATE, burst=INPUT_BURST):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.time()
+
+    def _refill(self, now):
+        if now is None:
+            now = time.time()
+        if now > self.stamp:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def take(self, now=None):
+        """\
+        Takes a token, returns False if there is none left.
+        """
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self, now=None):
+        """\
+        Seconds until the next token is available.
+        """
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def full(self, now=None):
+        """\
+        Whether a whole burst is available, i.e. nothing was taken for
+        a while.
+        """
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class FairQueue(object):
+    """\
+    Queue of commands kept per sender, taken round robin.
+
+    Each sender with something queued gets a turn in order, one command
+    per turn, so someone queueing a lot of commands only delays the
+    others by one command per round instead of all of theirs.  Commands
+    of the same sender stay in order.
+
+    Can be added to from any thread, but only taken from one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # sender -> deque of commands, only while it has any
+        self._queues = {}
+        # senders with something queued, whose turn is next first
+        self._turns = deque()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def senders(self):
+        return len(self._queues)
+
+    def put(self, item, sender=None):
+        self._lock.acquire()
+        try:
+            q = self._queues.get(sender)
+            if q is None:
+                q = self._queues[sender] = deque()
+                self._turns.append(sender)
+            q.append(item)
+            self._count += 1
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """\
+        Removes and returns the next command, raises IndexError if
+        there is none.
+        """
+        self._lock.acquire()
+        try:
+            sender = self._turns.popleft()
+            q = self._queues[sender]
+            item = q.popleft()
+            if q:
+                # back of the line for the next one
+                self._turns.append(sender)
+            else:
+                del self._queues[sender]
+            self._count -= 1
+            return item
+        finally:
+            self._lock.release()
+
+
+class FlushQueue(object):
+    """\
+    The souls with output to send, flushed once a tick by what drives
+    them (the driver, or a gateway).
+
+    A soul that cannot take all of its output is tried again later,
+    after retry seconds and twice as long every time after that, up to
+    retry_max.  Unless its connection tells its server when it can take
+    more (see MudConnection.want_write): then the server flushes it and
+    it is not tried here at all.
+
+    Can be added to from any thread, but only flushed from one.
+    """
+
+    def __init__(self, retry=FLUSH_RETRY, retry_max=FLUSH_RETRY_MAX):
+        self.retry = retry
+        self.retry_max = retry_max
+        self._q = deque()
+        # souls to try again, as soul -> (when, how long it waited),
+        # with a heap of (when, soul).
+        self._stalled = {}
+        self._due = []
+
+    def __len__(self):
+        return len(self._q)
+
+    def __iter__(self):
+        return iter(self._q)
+
+    @property
+    def stalled(self):
+        return len(self._stalled)
+
+    def append(self, soul):
+        self._q.append(soul)
+
+    def flush(self, now=None):
+        """\
+        Flushes the souls added since the last time, and those due to be
+        tried again.
+        """
+        if now is None:
+            now = time.time()
+        q = self._q
+        while q:
+            self._flush(q.popleft(), now)
+        due = self._due
+        while due and due[0][0] <= now:
+            when, soul = heapq.heappop(due)
+            if self._stalled.get(soul, (None,))[0] == when:
+                self._flush(soul, now)
+
+    def _flush(self, soul, now):
+        if soul.flush() or getattr(soul.handler, 'want_write', None):
+            self._stalled.pop(soul, None)
+            return
+        when, delay = self._stalled.get(soul, (None, self.retry / 2.0))
+        delay = min(delay * 2, self.retry_max)
+        when = now + delay
+        self._stalled[soul] = (when, delay)
+        heapq.heappush(self._due, (when, soul))
+
+    def next_retry(self):
+        """\
+        When the next soul is to be tried again, None if none is.
+        """
+        due = self._due
+        # what is stale goes, so it does not wake anyone up.
+        while due and self._stalled.get(due[0][1], (None,))[0] != due[0][0]:
+            heapq.heappop(due)
+        if due:
+            return due[0][0]
+        return None
@@ -0,0 +1,462 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+"""\
+Gateways: processes of their own that hold the connections.
+
+A gateway does what is done per connection that has nothing to do with
+the world: reading and writing the sockets, telnet, the input limits,
+the output queues and compression.  The complete lines it gets are
+passed on to the driver process, and the output for the connection is
+passed back, over a pair of Rings in shared memory.  So the driver
+process keeps to running the world.
+
+Messages on the rings are a header (the number of the connection, and
+what kind of message it is) followed by the line or output as it is.
+"""
+
+import errno
+import logging
+import math
+import multiprocessing
+import select
+import struct
+import threading
+import time
+import traceback
+from collections import deque
+
+from config import *
+from server import *
+from runner import MudRunner, MudServerController
+from flow import FlushQueue
+from ring import Ring
+from wakeup import Wakeup
+
+LOG = logging.getLogger('mtj.mud.gateway')
+
+_HEADER = struct.Struct('<IB')
+# gateway to driver
+OPEN = 1  # a connection came in, with its address as host:port
+LINE = 2  # a line it sent
+READY = 3  # the gateway is listening, with its port
+# driver to gateway
+DATA = 4  # output for the connection
+STOP = 5  # the gateway is to shut down
+# both ways
+CLOSE = 6  # the connection is gone, or is to be dropped
+
+
+def pack(conn, kind, data=''):
+    return _HEADER.pack(conn, kind) + data
+
+
+def unpack(message):
+    conn, kind = _HEADER.unpack_from(message)
+    return conn, kind, message[_HEADER.size:]
+
+
+def _put(ring, message, timeout):
+    """\
+    Puts message into ring, waiting up to timeout seconds for room.
+    """
+    deadline = time.time() + timeout
+    while not ring.put(message):
+        if time.time() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+# in the gateway
+
+class GatewaySoul(Soul):
+    """\
+    Soul of a connection held by a gateway.  Passes the lines the
+    connection sends on to the driver process, where the RemoteSoul of
+    the connection processes them.
+    """
+
+    def begin(self):
+        if self.online is None:
+            Soul.begin(self)
+            self.driver.opened(self)
+
+    def process_line(self, data):
+        self.driver.line(self, data)
+
+    def closed(self):
+        self.driver.closed(self)
+
+
+class Gateway(MudRunner):
+    """\
+    Runs a gateway, in the process forked for it.
+
+    Stands in for the driver for the souls of the servers it is given.
+    Its thread takes the output for the connections off the ring from
+    the driver process, and sends it out; the servers put what the
+    connections send on the ring to it.
+    """
+
+    def __init__(self, up, down, *args, **kwargs):
+        MudRunner.__init__(self, *args, **kwargs)
+        # to and from the driver process
+        self.up = up
+        self.down = down
+        # conn -> soul
+        self.souls = {}
+        self._next = 1
+        # taken by the servers to put on the ring up, they may have a
+        # thread per connection.
+        self._lock = threading.Lock()
+        # messages for the driver waiting for room on the ring up.
+        self._backlog = deque()
+        self.flushQ = FlushQueue()
+        self._wakeup = Wakeup()
+        self._poller = select.poll()
+        self._poller.register(self._wakeup.fileno(), select.POLLIN)
+        self._poller.register(self.down.fileno(), select.POLLIN)
+
+    def _send(self, conn, kind, data=''):
+        """\
+        Puts a message on the ring to the driver, or behind those held
+        back if the driver is behind; the gateway thread puts them on
+        as there is room.  Never waits.
+        """
+        message = pack(conn, kind, data)
+        self._lock.acquire()
+        try:
+            backlog = self._backlog
+            if not backlog and self.up.put(message):
+                return
+            if kind == LINE and len(backlog) >= GATEWAY_BACKLOG:
+                LOG.warning('%s dropped a line for the driver.', self)
+                return
+            backlog.append(message)
+            self._wakeup.set()
+        finally:
+            self._lock.release()
+
+    def _send_backlog(self):
+        """\
+        Puts the messages held back on the ring to the driver, as far as
+        there is room.  Returns True if none are left.
+        """
+        self._lock.acquire()
+        try:
+            backlog = self._backlog
+            while backlog:
+                if not self.up.put(backlog[0]):
+                    return False
+                backlog.popleft()
+            return True
+        finally:
+            self._lock.release()
+
+    def opened(self, soul):
+        self._lock.acquire()
+        try:
+            soul.conn = self._next
+            self._next += 1
+            self.souls[soul.conn] = soul
+        finally:
+            self._lock.release()
+        self._send(soul.conn, OPEN, '%s:%d' % soul.handler.client_address)
+
+    def line(self, soul, data):
+        self._send(soul.conn, LINE, data)
+
+    def closed(self, soul):
+        if self.souls.pop(getattr(soul, 'conn', None), None) is not None:
+            self._send(soul.conn, CLOSE)
+
+    def ready(self, port):
+        self._send(0, READY, str(port))
+
+    def flush_later(self, soul):
+        self.flushQ.append(soul)
+        self._wakeup.set()
+
+    def _action(self):
+        self._wakeup.clear()
+        self.down.clear()
+        for message in self.down.drain():
+            self._dispatch(*unpack(message))
+            if not self._running:
+                break
+        self.flushQ.flush()
+        timeout = GATEWAY_POLL
+        next_retry = self.flushQ.next_retry()
+        if next_retry is not None:
+            timeout = min(timeout, max(0, next_retry - time.time()))
+        if not self._send_backlog():
+            # the driver is behind, it will not be for long.
+            timeout = min(timeout, FLUSH_RETRY)
+        try:
+            self._poller.poll(int(math.ceil(timeout * 1000)))
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+    def _dispatch(self, conn, kind, data):
+        if kind == STOP:
+            self._running = False
+            return
+        soul = self.souls.get(conn)
+        if soul is None:
+            return
+        if kind == DATA:
+            soul.write(data)
+        elif kind == CLOSE:
+            soul.flush(finish=True)
+            soul.disconnect()
+
+    def _wake(self):
+        self._wakeup.set()
+
+
+def serve(up, down, host, port, mode, reuse_port):
+    """\
+    Runs a gateway until the driver stops it.  This is what the gateway
+    processes run.
+    """
+    gateway = Gateway(up, down)
+    controller = MudServerController(host, port, mode=mode,
+        reuse_port=reuse_port, soul_class=GatewaySoul)
+    gateway.add(controller)
+    controller.start()
+    # wait for the servers
+    while not controller.servers:
+        if not controller.t.isAlive():
+            LOG.error('Gateway could not listen on %s.', controller.listenAddr)
+            return
+        time.sleep(0.01)
+    gateway.ready(controller.server.server_address[1])
+    try:
+        gateway._start()
+    finally:
+        controller.stop()
+
+
+# in the driver process
+
+class _Peer(object):
+    """\
+    Stands in for the request handler of a connection held by a
+    gateway.
+    """
+
+    request = None
+
+    def __init__(self, server, client_address):
+        self.server = server
+        self.client_address = client_address
+
+
+class RemoteSoul(Soul):
+    """\
+    Soul of a connection held by a gateway, in the driver process.
+
+    Processes the lines the gateway passes on as any soul would, and
+    passes its output back, once a tick as usual.  Its telnet and input
+    limits are not used, the gateway has them.
+    """
+
+    def __init__(self, link, conn, client_address, *args, **kwargs):
+        Soul.__init__(self, _Peer(link, client_address), *args, **kwargs)
+        self.link = link
+        self.conn = conn
+        # the gateway is still to be told to drop the connection.
+        self._closing = False
+
+    def begin(self):
+        # the gateway already greeted the other end.
+        if self.online is None:
+            self.online = True
+
+    def flush(self, finish=False):
+        self._outlock.acquire()
+        try:
+            if not self.online and not self._closing:
+                self._unsent = ''
+                self.outq.clear()
+                return True
+            # what was written while a message was held back goes
+            # right behind it, and the close behind all of it.
+            while self._unsent or self.outq:
+                data = self._unsent or self.outq.take()
+                if not self.link.send(self.conn, DATA, data):
+                    # the gateway is behind, try again next tick.
+                    self._unsent = data
+                    return False
+                self._unsent = ''
+            if self._closing:
+                if not self.link.send(self.conn, CLOSE):
+                    return False
+                self._closing = False
+            return True
+        finally:
+            self._outlock.release()
+
+    def disconnect(self):
+        self._outlock.acquire()
+        try:
+            if not self.online:
+                return
+            self.online = False
+            self._closing = True
+        finally:
+            self._outlock.release()
+        if not self.flush():
+            # the gateway is behind, the driver tries again.
+            self.driver.flush_later(self)
+
+
+class GatewayLink(MudRunner):
+    """\
+    The driver end of the rings of a gateway.  Its thread passes the
+    lines from the gateway to the souls, like the connection threads of
+    the threaded server do.
+    """
+
+    def __init__(self, controller, up, down, *args, **kwargs):
+        MudRunner.__init__(self, *args, **kwargs)
+        self.controller = controller
+        self.up = up
+        self.down = down
+        self.port = None
+        # conn -> RemoteSoul
+        self.souls = {}
+        # taken to put on the ring down, as everything the souls send
+        # may.
+        self._lock = threading.Lock()
+
+    def send(self, conn, kind, data='', wait=False):
+        """\
+        Puts a message on the ring to the gateway, returns False if
+        there was no room.  With wait, waits a while for some.
+        """
+        message = pack(conn, kind, data)
+        self._lock.acquire()
+        try:
+            if wait:
+                return _put(self.down, message, GATEWAY_POLL * 10)
+            return self.down.put(message)
+        finally:
+            self._lock.release()
+
+    def _action(self):
+        self.up.clear()
+        self._receive()
+        self.up.wait(GATEWAY_POLL)
+
+    def _receive(self):
+        """\
+        Processes what the gateway sent, returns the number of messages.
+        """
+        messages = self.up.drain()
+        for message in messages:
+            conn, kind, data = unpack(message)
+            try:
+                self._dispatch(conn, kind, data)
+            except:
+                LOG.warning('%s got an exception!', self.__repr__())
+                LOG.warning(traceback.format_exc())
+                soul = self.souls.get(conn)
+                if soul is not None:
+                    soul.send('A serious error has occurred!')
+        return len(messages)
+
+    def _dispatch(self, conn, kind, data):
+        if kind == OPEN:
+            host, port = data.rsplit(':', 1)
+            soul = RemoteSoul(self, conn, (host, int(port)))
+            self.souls[conn] = soul
+            soul.begin()
+        elif kind == LINE:
+            soul = self.souls.get(conn)
+            if soul is not None and soul.online:
+                soul.process_line(data)
+        elif kind == CLOSE:
+            soul = self.souls.pop(conn, None)
+            if soul is not None:
+                soul.online = False
+        elif kind == READY:
+            self.port = int(data)
+
+    def _wake(self):
+        self.up.ring()
+
+
+class MudGatewayController(MudRunner):
+    """\
+    Serves the world through gateway processes, in place of a
+    MudServerController.
+
+    Each gateway listens on host and port (with SO_REUSEPORT, so the
+    connections are spread across them), holds the connections and
+    speaks telnet with them, and runs its own server of the given mode.
+    """
+
+    driver = property(lambda self: self._parent)
+    listenAddr = property(lambda self: (self.host, self.port))
+
+    def __init__(self, host, port, mode=SERVER_MODE, gateways=GATEWAYS,
+            ring_size=GATEWAY_RING_SIZE, *args, **kwargs):
+        MudRunner.__init__(self, *args, **kwargs)
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.gateways = gateways or 1
+        self.ring_size = ring_size
+        self.links = []
+        self.processes = []
+
+    @property
+    def souls(self):
+        result = []
+        for link in self.links:
+            result.extend(link.souls.values())
+        return result
+
+    def start(self):
+        if self._running:
+            LOG.warn('Gateways %s already started.', self.processes)
+            return
+        LOG.info('Starting %d gateway(s)...', self.gateways)
+        for i in xrange(self.gateways):
+            up = Ring(self.ring_size)
+            down = Ring(self.ring_size)
+            process = multiprocessing.Process(target=serve,
+                args=(up, down, self.host, self.port, self.mode,
+                      self.gateways > 1))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+            link = GatewayLink(self, up, down)
+            link.start()
+            self.links.append(link)
+        self._running = True
+
+    def stop(self):
+        msg = Frame('Server shutting down.')
+        for soul in self.souls:
+            if soul.online:
+                soul.send(msg)
+                soul.quit()
+        for link in self.links:
+            link.send(0, STOP, wait=True)
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                LOG.warning('Gateway %s did not stop, terminating.', process)
+                process.terminate()
+        for link in self.links:
+            link.stop()
+            link.up.close()
+            link.down.close()
+        self.links = []
+        self.processes = []
+        self._running = False
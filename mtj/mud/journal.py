@@ -0,0 +1,208 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+"""\
+Journal of the commands run by the driver, and replaying it.
+
+With a journal, the driver records every command it runs that was
+typed in: the tick, who it was for (by handle), the verb and the
+trail.  Replaying rebuilds the world as the driver does
+and runs those commands again in the same order, without any
+connections and as fast as it can, so what happened under real load
+can be reproduced and timed.
+
+Timers and heartbeats are not part of the journal, nor run when
+replaying.
+
+Usage: python -m mtj.mud.journal [options] journal
+"""
+
+import logging
+import struct
+import sys
+import time
+import traceback
+from optparse import OptionParser
+
+from mtj.mud.objects import *
+
+LOG = logging.getLogger('mtj.mud.journal')
+
+MAGIC = 'mtj.mud journal 1\n'
+# tick, handle of the caller, length of the verb and of the trail
+_RECORD = struct.Struct('<IIBH')
+
+
+class JournalError(Exception):
+    """\
+    The file is not a journal, or it got cut short.
+    """
+
+
+class Journal(object):
+    """\
+    Append only file of commands.  Records are buffered and written
+    out by flush, which the driver calls every tick.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+        if not self._file.tell():
+            self._file.write(MAGIC)
+        self._buffer = []
+        self.records = 0
+
+    def record(self, tick, cmd):
+        """\
+        Records cmd if it was typed in, returns whether it was.
+        """
+        verb = getattr(cmd, 'verb', None)
+        caller = getattr(cmd, 'caller', None)
+        if verb is None or not isinstance(caller, MudObject):
+            return False
+        handle = caller.handle
+        trail = cmd.trail or ''
+        self._buffer.append(_RECORD.pack(tick & 0xffffffff, handle,
+                                         len(verb), len(trail)))
+        self._buffer.append(verb)
+        self._buffer.append(trail)
+        self.records += 1
+        return True
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self._file.write(''.join(self._buffer))
+        self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read(path):
+    """\
+    Yields the records of the journal at path, as (tick, handle, verb,
+    trail).
+    """
+    f = open(path, 'rb')
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise JournalError('%s is not a journal' % path)
+        while True:
+            header = f.read(_RECORD.size)
+            if not header:
+                return
+            if len(header) < _RECORD.size:
+                raise JournalError('%s is cut short' % path)
+            tick, handle, verb_len, trail_len = _RECORD.unpack(header)
+            body = f.read(verb_len + trail_len)
+            if len(body) < verb_len + trail_len:
+                raise JournalError('%s is cut short' % path)
+            yield tick, handle, body[:verb_len], body[verb_len:]
+    finally:
+        f.close()
+
+
+class Replay(object):
+    """\
+    Runs the commands of a journal again, in a world of its own.
+    """
+
+    def __init__(self, driver=None, strict=False):
+        """\
+        driver is where the world is built, a new MudDriver by default;
+        it is not started.  With strict, the first command that fails
+        stops the replay with its exception.
+        """
+        if driver is None:
+            # here, as the runner imports everything.
+            from mtj.mud.runner import MudDriver
+            driver = MudDriver()
+        self.driver = driver
+        self.strict = strict
+        # handle in the journal -> body here
+        self.bodies = {}
+        self.commands = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def command(self, handle, verb, trail):
+        """\
+        Builds the command the record stands for, None if it cannot be.
+        """
+        if verb == Login.verb:
+            body = MudPlayer(name=trail)
+            self.bodies[handle] = body
+            return Login(body, self.driver.starting['main'], trail=trail)
+        body = self.bodies.get(handle)
+        if body is None:
+            return None
+        if trail:
+            verb = '%s %s' % (verb, trail)
+        cmd = body.process_cmd(verb)
+        if isinstance(cmd, MudNotify):
+            return cmd
+        return None
+
+    def run(self, records):
+        """\
+        Runs the commands of records, returns the number that ran.
+        """
+        count = 0
+        for tick, handle, verb, trail in records:
+            cmd = self.command(handle, verb, trail)
+            if cmd is None:
+                self.skipped += 1
+                continue
+            count += 1
+            try:
+                cmd()
+            except:
+                self.failed += 1
+                if self.strict:
+                    raise
+                LOG.warning("command '%s %s' of tick %d caused an exception",
+                            verb, trail, tick)
+                LOG.warning(traceback.format_exc())
+        self.commands += count
+        return count
+
+
+def replay(path, strict=False, out=None):
+    """\
+    Replays the journal at path, returns the Replay.
+    """
+    r = Replay(strict=strict)
+    start = time.time()
+    r.run(read(path))
+    elapsed = time.time() - start
+    if out is not None:
+        out.write('%d commands in %.3f s (%.0f/s), %d skipped, %d failed\n' %
+                  (r.commands, elapsed, r.commands / max(elapsed, 1e-6),
+                   r.skipped, r.failed))
+    return r
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] journal',
+        description='Runs the commands of a journal again, as fast as it '
+                    'can.')
+    parser.add_option('-s', '--strict', action='store_true', default=False,
+        help='stop at the first command that fails')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('one journal is needed')
+    try:
+        r = replay(args[0], options.strict, sys.stdout)
+    except (IOError, JournalError), e:
+        parser.error(str(e))
+    if r.failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,511 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+"""\
+Load generator for a running mud.
+
+Opens many telnet connections to a server from a single poll loop, logs
+each of them in through the gatekeeper and then has them play a mix of
+commands, measuring the time from sending each command until its prompt
+comes back.  A summary of latency and throughput is printed every so
+often, along with the CPU and memory used by the server process if its
+pid is given (read from /proc, so only on Linux).
+
+Usage: mudload [options]  (mudload --help for the list)
+"""
+
+import os
+import re
+import sys
+import time
+import zlib
+import errno
+import heapq
+import random
+import select
+import socket
+import logging
+from optparse import OptionParser
+
+from mtj.mud.config import *
+from mtj.mud.telnet import *
+
+LOG = logging.getLogger("mtj.mud.loadgen")
+
+# what the server sends when it is waiting for a command.
+PROMPT = IAC + DO + ECHO + STD_PROMPT
+LOGIN = 'Login: '
+PASSWORD = 'Password: '
+
+DEFAULT_MIX = 'say=4,look=2,go=2,emote=1'
+
+_EXITS = re.compile(r'Obvious exits are ([^.\r\n]*)\.')
+
+_WORDS = ('hello', 'anyone here?', 'nice weather', 'lag check',
+          'brb', 'where is everyone', 'this room is bland')
+
+# bot states
+_CONNECTING, _LOGIN, _PASSWORD, _WAITING, _IDLE, _CLOSED = range(6)
+
+
+def percentile(values, pct):
+    """\
+    The pct percentile of the sorted list values (nearest rank).
+    """
+    if not values:
+        return 0.0
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def parse_mix(spec):
+    """\
+    Turns 'say=4,look=2' into a list of commands to pick from at random,
+    each repeated by its weight.
+    """
+    result = []
+    for item in spec.split(','):
+        name, weight = (item.split('=', 1) + ['1'])[:2]
+        name = name.strip()
+        if name not in Bot.commands:
+            raise ValueError('unknown command %s in mix' % name.__repr__())
+        result.extend([name] * int(weight))
+    if not result:
+        raise ValueError('empty command mix')
+    return result
+
+
+class ProcStat(object):
+    """\
+    Samples the CPU time and resident memory of a process from /proc.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.hz = os.sysconf('SC_CLK_TCK')
+        self.last = self.cpu()
+        self.lasttime = time.time()
+
+    def cpu(self):
+        """\
+        Total CPU seconds (user and system) used by the process.
+        """
+        try:
+            f = open('/proc/%d/stat' % self.pid)
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+        # the command name may contain spaces, skip past it.
+        fields = data[data.rindex(')') + 2:].split()
+        return (int(fields[11]) + int(fields[12])) / float(self.hz)
+
+    def rss(self):
+        """\
+        Resident memory of the process in kilobytes.
+        """
+        try:
+            f = open('/proc/%d/status' % self.pid)
+            try:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+            finally:
+                f.close()
+        except IOError:
+            pass
+        return None
+
+    def sample(self):
+        """\
+        Returns the CPU usage in percent since the last sample, and the
+        current resident memory.
+        """
+        now = time.time()
+        cpu = self.cpu()
+        usage = None
+        if cpu is not None and self.last is not None and now > self.lasttime:
+            usage = 100.0 * (cpu - self.last) / (now - self.lasttime)
+        self.last, self.lasttime = cpu, now
+        return usage, self.rss()
+
+
+class Bot(object):
+    """\
+    A single simulated player.
+
+    Only one command is outstanding at a time; once its prompt arrives
+    the bot thinks for a random time (averaging 1/rate seconds) before
+    sending the next one.
+    """
+
+    commands = ('say', 'look', 'go', 'emote')
+
+    def __init__(self, gen, name):
+        self.gen = gen
+        self.name = name
+        self.state = _CONNECTING
+        self.sock = None
+        self.buf = ''
+        self.exits = []
+        self.sent_at = None
+        self.connected_at = None
+        # MCCP
+        self.inflate = None
+        self.raw = ''
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def connect(self, addr):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        self.connected_at = time.time()
+        err = self.sock.connect_ex(addr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise socket.error(err, os.strerror(err))
+        self.state = _LOGIN
+
+    def close(self):
+        if self.state != _CLOSED:
+            self.state = _CLOSED
+            self.sock.close()
+
+    def write(self, data):
+        try:
+            self.sock.send(data)
+        except socket.error, e:
+            if e.args[0] not in (errno.EAGAIN, errno.EINTR):
+                raise
+
+    def command(self):
+        """\
+        Picks the next command from the mix.
+        """
+        cmd = random.choice(self.gen.mix)
+        if cmd == 'say':
+            return 'say %s' % random.choice(_WORDS)
+        elif cmd == 'emote':
+            return ': waves'
+        elif cmd == 'go' and self.exits:
+            return 'go %s' % random.choice(self.exits)
+        return 'look'
+
+    def act(self, now):
+        """\
+        Sends the next command, called when the think time is over.
+        """
+        if self.state != _IDLE:
+            return
+        self.state = _WAITING
+        self.sent_at = now
+        self.write(self.command() + '\r\n')
+
+    def read(self):
+        """\
+        Reads what is available and acts on it.
+        """
+        data = self.sock.recv(65536)
+        if not data:
+            raise socket.error(errno.ECONNRESET, 'connection closed')
+        self.gen.bytes += len(data)
+        if self.inflate:
+            data = self.inflate.decompress(data)
+        elif self.gen.mccp:
+            data = self._mccp(data)
+        self.buf += data
+        self.feed()
+
+    def _mccp(self, data):
+        """\
+        Looks for the start of compression in the raw data.
+        """
+        data = self.raw + data
+        self.raw = ''
+        offer = IAC + WILL + COMPRESS2
+        if offer in data:
+            data = data.replace(offer, '')
+            self.write(IAC + DO + COMPRESS2)
+        i = data.find(MCCPStream.start)
+        if i >= 0:
+            self.inflate = zlib.decompressobj()
+            return data[:i] + self.inflate.decompress(
+                data[i + len(MCCPStream.start):])
+        for i in xrange(len(MCCPStream.start) - 1, 0, -1):
+            if data.endswith(MCCPStream.start[:i]):
+                # could be the start sequence split by the read.
+                data, self.raw = data[:-i], data[-i:]
+                break
+        return data
+
+    def feed(self):
+        gen = self.gen
+        now = time.time()
+        if self.state == _LOGIN:
+            if LOGIN in self.buf:
+                self.buf = ''
+                self.state = _PASSWORD
+                self.write('%s\r\n' % self.name)
+        elif self.state == _PASSWORD:
+            if PASSWORD in self.buf:
+                self.buf = ''
+                self.state = _WAITING
+                self.sent_at = None
+                self.write('loadgen\r\n')
+        elif self.state == _WAITING:
+            i = self.buf.find(PROMPT)
+            if i < 0:
+                if len(self.buf) > 65536:
+                    self.buf = self.buf[-len(PROMPT):]
+                return
+            m = _EXITS.search(self.buf, 0, i)
+            if m:
+                self.exits = [x.strip() for x in m.group(1).split(',')]
+            self.buf = self.buf[i + len(PROMPT):]
+            if self.sent_at is None:
+                gen.logged_in(self, now - self.connected_at)
+            else:
+                gen.done(self, now - self.sent_at)
+            self.state = _IDLE
+            gen.later(self, now + random.expovariate(gen.rate))
+        else:
+            # broadcasts from others, nothing to wait for.
+            self.buf = ''
+
+
+class LoadGenerator(object):
+    """\
+    Drives a number of bots against a server from one poll loop.
+    """
+
+    def __init__(self, host='127.0.0.1', port=PORT, clients=100, rate=1.0,
+            mix=DEFAULT_MIX, ramp=0, duration=60, interval=5, pid=None,
+            mccp=False, out=sys.stdout):
+        """\
+        Parameters:
+        clients - number of connections.
+        rate - commands per second sent by each client.
+        mix - weighted command mix, like 'say=4,look=2,go=2,emote=1'.
+        ramp - seconds over which the connections are opened.
+        duration - seconds to run for once all connections were opened.
+        interval - seconds between reports.
+        pid - pid of the server process, to report its CPU and memory.
+        mccp - accept MCCP compression from the server.
+        """
+        self.addr = (host, port)
+        self.clients = clients
+        self.rate = rate
+        self.mix = parse_mix(mix)
+        self.ramp = ramp
+        self.duration = duration
+        self.interval = interval
+        self.mccp = mccp
+        self.out = out
+        self.proc = pid and ProcStat(pid) or None
+
+        self.bots = {}
+        self.poller = select.poll()
+        self._timers = []
+        # statistics
+        self.latencies = []
+        self.login_times = []
+        self.bytes = 0
+        self.errors = 0
+        self.cpu = []
+        self.rss = []
+        self._interval_lat = []
+
+    def later(self, bot, when):
+        heapq.heappush(self._timers, (when, bot))
+
+    def logged_in(self, bot, elapsed):
+        self.login_times.append(elapsed)
+
+    def done(self, bot, elapsed):
+        self.latencies.append(elapsed)
+        self._interval_lat.append(elapsed)
+
+    def _connect(self, n):
+        bot = Bot(self, 'bot%d' % n)
+        try:
+            bot.connect(self.addr)
+        except socket.error, e:
+            LOG.warning('%s could not connect: %s', bot.name, e)
+            self.errors += 1
+            return
+        self.bots[bot.fileno()] = bot
+        self.poller.register(bot.fileno(), select.POLLIN)
+
+    def _drop(self, fd, bot, reason):
+        LOG.warning('%s dropped: %s', bot.name, reason)
+        self.errors += 1
+        self.poller.unregister(fd)
+        del self.bots[fd]
+        bot.close()
+
+    def report(self, elapsed, final=False):
+        if final:
+            lat = sorted(self.latencies)
+            span = self._span
+        else:
+            lat = sorted(self._interval_lat)
+            span = self.interval
+            self._interval_lat = []
+        usage, rss = None, None
+        if self.proc and not final:
+            usage, rss = self.proc.sample()
+            if usage is not None:
+                self.cpu.append(usage)
+            if rss is not None:
+                self.rss.append(rss)
+        elif final:
+            usage = self.cpu and sum(self.cpu) / len(self.cpu) or None
+            rss = self.rss and max(self.rss) or None
+        ms = lambda x: '%8.2f' % (x * 1000)
+        fields = [
+            '%7.1f' % elapsed,
+            '%6d' % len(self.bots),
+            '%8.1f' % (len(lat) / max(span, 0.001)),
+            ms(percentile(lat, 50)),
+            ms(percentile(lat, 90)),
+            ms(percentile(lat, 99)),
+            ms(lat and lat[-1] or 0),
+            usage is None and '       -' or '%8.1f' % usage,
+            rss is None and '       -' or '%8.1f' % (rss / 1024.0),
+        ]
+        print >> self.out, ' '.join(fields)
+
+    def run(self):
+        out = self.out
+        print >> out, '%d clients at %.2f cmd/s each on %s:%d, mix %s' % (
+            self.clients, self.rate, self.addr[0], self.addr[1],
+            ','.join(sorted(set(self.mix))))
+        print >> out, '%7s %6s %8s %8s %8s %8s %8s %8s %8s' % (
+            'time', 'conns', 'cmd/s', 'p50 ms', 'p90 ms', 'p99 ms',
+            'max ms', 'cpu %', 'rss MB')
+        start = time.time()
+        try:
+            self._run(start)
+        except KeyboardInterrupt:
+            pass
+        self._span = max(time.time() - start - self.ramp, 0.001)
+        for bot in self.bots.values():
+            bot.close()
+
+        print >> out
+        print >> out, 'total:'
+        self.report(time.time() - start, final=True)
+        login = sorted(self.login_times)
+        print >> out, 'logins %d, p50 %.2f ms, p99 %.2f ms, max %.2f ms' % (
+            len(login), percentile(login, 50) * 1000,
+            percentile(login, 99) * 1000, (login and login[-1] or 0) * 1000)
+        print >> out, 'commands %d, bytes received %d, errors %d' % (
+            len(self.latencies), self.bytes, self.errors)
+
+    def _run(self, start):
+        end = start + self.ramp + self.duration
+        nextreport = start + self.interval
+        opened = 0
+        while True:
+            now = time.time()
+            if now >= end:
+                break
+            # open connections spread over the ramp up time
+            if opened < self.clients:
+                due = self.clients
+                if self.ramp:
+                    due = min(due, int(self.clients * (now - start) /
+                                       self.ramp) + 1)
+                while opened < due:
+                    opened += 1
+                    self._connect(opened)
+            timers = self._timers
+            while timers and timers[0][0] <= now:
+                bot = heapq.heappop(timers)[1]
+                try:
+                    bot.act(now)
+                except socket.error, e:
+                    self._drop(bot.fileno(), bot, e)
+            if now >= nextreport:
+                self.report(now - start)
+                nextreport += self.interval
+            wait = min(end, nextreport)
+            if timers:
+                wait = min(wait, timers[0][0])
+            if opened < self.clients:
+                wait = now + 0.01
+            try:
+                events = self.poller.poll(max(0, int((wait - now) * 1000)))
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            for fd, event in events:
+                bot = self.bots.get(fd)
+                if bot is None:
+                    continue
+                try:
+                    bot.read()
+                except socket.error, e:
+                    if e.args[0] not in (errno.EAGAIN, errno.EINTR):
+                        self._drop(fd, bot, e)
+                except zlib.error, e:
+                    self._drop(fd, bot, e)
+
+
+def _raise_nofile(n):
+    """\
+    Makes sure there are enough descriptors for n connections.
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    want = n + 64
+    if soft != resource.RLIM_INFINITY and soft < want:
+        if hard != resource.RLIM_INFINITY:
+            want = min(want, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]',
+        description='Simulates players connected to a running mud.')
+    parser.add_option('-H', '--host', default='127.0.0.1')
+    parser.add_option('-p', '--port', type='int', default=PORT)
+    parser.add_option('-n', '--clients', type='int', default=100,
+        help='number of connections [%default]')
+    parser.add_option('-r', '--rate', type='float', default=1.0,
+        help='commands per second per connection [%default]')
+    parser.add_option('-m', '--mix', default=DEFAULT_MIX,
+        help='weighted mix of say, look, go and emote [%default]')
+    parser.add_option('--ramp', type='float', default=0,
+        help='seconds to spread the connecting over [%default]')
+    parser.add_option('-d', '--duration', type='float', default=60,
+        help='seconds to run after ramp up [%default]')
+    parser.add_option('-i', '--interval', type='float', default=5,
+        help='seconds between reports [%default]')
+    parser.add_option('--pid', type='int',
+        help='pid of the server, to report its CPU and memory use')
+    parser.add_option('--mccp', action='store_true', default=False,
+        help='accept MCCP compression')
+    options, args = parser.parse_args(argv)
+    if options.rate <= 0:
+        parser.error('rate must be positive')
+    try:
+        parse_mix(options.mix)
+    except ValueError, e:
+        parser.error(str(e))
+    _raise_nofile(options.clients)
+    gen = LoadGenerator(options.host, options.port, options.clients,
+        options.rate, options.mix, options.ramp, options.duration,
+        options.interval, options.pid, options.mccp)
+    gen.run()
+
+
+if __name__ == '__main__':
+    main()
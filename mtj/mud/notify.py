@@ -5,6 +5,7 @@
 import logging
 from mtj.mud.config import *
 from mtj.mud.actions import *
+from mtj.mud.registry import registry
 
 LOG = logging.getLogger("actions")
 
@@ -121,13 +122,10 @@ class Go(MoveObjTo):
                 self.callerMsg = 'Where do you want to go?'
 
     def preparation(self):
-        links = self.caller._parent.get_links(self.trail)
         # rooms with multiple exits will need to implement hooks
         # XXX naive implementation
-        exit_d = dict(links)
-        if self.trail in exit_d:
-            self.target = exit_d[self.trail]
-            return True
+        self.target = self.caller._parent.exit(self.trail)
+        return self.target is not None
 
     # XXX HACK action is done later
     # Need to implement caller_sibling before action happened
@@ -153,7 +151,8 @@ class History(MudNotify):
     """
 
     def setResponse(self): #, caller, target, others, caller_siblings):
-        if hasattr(self.caller, 'soul'):
+        # bodies without a soul (replayed ones, for one) have none.
+        if getattr(self.caller, 'soul', None) is not None:
             self.callerMsg = self.caller.soul.history()
 
 
@@ -176,6 +175,30 @@ class Say(MudNotify):
                 'detrimental to your health.'
 
 
+class Tell(MudNotify):
+    """\
+    Usage: tell <player> <message>
+
+    The tell command sends <message> to <player>, wherever they are in
+    this world.
+    """
+
+    def setResponse(self): #, caller, target, others, caller_siblings):
+        name, sep, msg = (self.trail or '').partition(' ')
+        if not name or not msg:
+            self.callerMsg = 'Tell whom what?'
+            return
+        # only those with souls are listening.
+        found = [i for i in registry.by_name(name)
+                 if getattr(i, 'soul', None) and i is not self.caller]
+        if not found:
+            self.callerMsg = 'There is no one called %s in this world.' % name
+            return
+        self.target = found[0]
+        self.callerMsg = 'You tell %s, "%s"' % (self.target, msg)
+        self.targetMsg = '%s tells you, "%s"' % (self.caller, msg)
+
+
 class Emote(MudNotify):
     """\
     Usage: emote <message>
@@ -227,6 +250,9 @@ class Login(MudAction):
     The Login action will log in a user (caller) into a room (target).
     """
 
+    # journaled as this, with the name of the user as the trail.
+    verb = 'login'
+
     def setResponse(self): #, caller, target, others, caller_siblings):
         # message every siblings
         self._caller_siblings = True
@@ -284,6 +310,17 @@ class Help(MudNotify):
 class _Look():
 
     def _look(self, room, contents):
+        # the description and exits are kept with the room until it
+        # changes, only what is in it is rendered each time.
+        cached = room.render_cache
+        if cached is None or cached[0] != room.version:
+            cached = room.render_cache = (room.version,
+                                          self._render_room(room))
+        x = [cached[1]]
+        self._contents(x, room, contents)
+        return ''.join(x)
+
+    def _render_room(self, room):
         x = []
         x.append('%s\r\n\r\n%s\r\n' % (room.shortdesc, room.longdesc))
         exits = room.roomlinks
@@ -293,17 +330,27 @@ class _Look():
             # XXX implement not obvious exits
             x.append('        Obvious exits are %s.\r\n\r\n' %
                      ', '.join(exits))
-        for c in contents:
-            x.append(' %s\r\n' % c)
         return ''.join(x)
 
     def _lookitem(self, room, contents):
         x = []
-        x.append('%s\r\n\r\n%s\r\n' % (room.shortdesc, room.longdesc))
-        for c in contents:
-            x.append(' %s\r\n' % c)
+        x.append('%s\r\n\r\n%s\r\n' % (room.shortdesc, room.longdesc or ''))
+        self._contents(x, room, contents)
         return ''.join(x)
 
+    def _contents(self, x, holder, contents):
+        shared = holder._shared
+        if not shared:
+            x.extend([' %s\r\n' % c for c in contents])
+            return
+        for c in contents:
+            # one entry for however many of a shared item.
+            count = shared.get(c, 1)
+            if count > 1:
+                x.append(' %s (%d)\r\n' % (c, count))
+            else:
+                x.append(' %s\r\n' % c)
+
 
 class Look(MudNotify, _Look):
     """\
@@ -313,7 +360,9 @@ class Look(MudNotify, _Look):
     allow you to inspect your surroundings and items you specify that
     are in your surroundings or your inventory.
     
-    Status: Under development.  Items do not work.
+    Items are looked for in your inventory first, then around you.
+    Add a number to pick among items with the same name, like 'look
+    2.sword' for the second sword.
     """
 
     # this look is a look from the children wanting to see their
@@ -323,7 +372,15 @@ class Look(MudNotify, _Look):
         # setting this to true to enable building of the sibling list
         self._caller_siblings = True
         room = self.caller._parent
-        if room:
+        if self.trail:
+            item = self.caller.find(self.trail)
+            if item is None and room:
+                item = room.find(self.trail)
+            if item is None:
+                self.callerMsg = 'You do not see %s here.' % self.trail
+            else:
+                self.callerMsg = self._lookitem(item, item.children)
+        elif room:
             template = self._look(room, self.caller_siblings)
             self.callerMsg = template
         else:
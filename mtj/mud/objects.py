@@ -2,17 +2,229 @@
 # Copyright (c) 2007 Tommy Yu
 # This software is released under the GPLv3
 
+import copy
+import errno
 import logging
+import socket
+import time
 import traceback
+import threading
 from socket import error as SocketError
 from collections import deque
 
 from config import *
 from actions import *
 from notify import *
+from telnet import *
+from flow import *
+from trie import Trie
+from container import OrderedSet, SetView
+from registry import registry
 
 LOG = logging.getLogger("mtj.mud.objects")
 
+# sends to the souls must never block the driver.
+SEND_FLAGS = getattr(socket, 'MSG_DONTWAIT', 0)
+SEND_RETRY = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+# guards the indexes objects keep of their children (of commands and of
+# identifiers): they are changed by the thread running the world, but
+# commands are also looked up by the threads serving the connections.
+_index_lock = threading.Lock()
+
+
+class CmdTable(object):
+    """\
+    A table of commands, mapping verbs to MudNotify subclasses.
+
+    Tables are declared on the class and shared by all its instances.
+    An instance only gets a table of its own, layered over the one of
+    its class, when it adds or removes commands (see MudObject.add_cmd)
+    so changes to the class table still reach every instance.
+
+    A table created with a base works like that layer: it offers what
+    it has itself, and everything in base that it did not remove.
+    """
+
+    def __init__(self, cmds=None, base=None):
+        self._cmds = dict(cmds or ())
+        self._trie = Trie(self._cmds)
+        self._removed = set()
+        self.base = base
+        # bumped whenever this table changes, so whatever was built
+        # from it (like the command index of MudObject) can tell it is
+        # out of date.
+        self.version = 0
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        overlays = obj._cmd_overlays
+        if overlays:
+            return overlays.get(self, self)
+        return self
+
+    def __set__(self, obj, value):
+        """\
+        Assigning a dict to the attribute of an instance replaces the
+        table for that instance alone.
+        """
+        obj._writable()
+        obj._cmd_overlay(self, CmdTable(value))
+
+    def __getitem__(self, verb):
+        try:
+            return self._cmds[verb]
+        except KeyError:
+            if self.base is None or verb in self._removed:
+                raise
+            return self.base[verb]
+
+    def __contains__(self, verb):
+        if verb in self._cmds:
+            return True
+        return self.base is not None and verb not in self._removed and \
+            verb in self.base
+
+    def get(self, verb, default=None):
+        action = self._cmds.get(verb)
+        if action is not None:
+            return action
+        if self.base is None or verb in self._removed:
+            return default
+        return self.base.get(verb, default)
+
+    def keys(self):
+        if self.base is None:
+            return self._cmds.keys()
+        result = set(self._cmds)
+        result.update([i for i in self.base.keys() if i not in self._removed])
+        return list(result)
+
+    def items(self):
+        return [(i, self[i]) for i in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __setitem__(self, verb, action):
+        self._cmds[verb] = action
+        self._trie.add(verb)
+        self._removed.discard(verb)
+        self.version += 1
+
+    def __delitem__(self, verb):
+        if verb not in self:
+            raise KeyError(verb)
+        if self._cmds.pop(verb, None) is not None:
+            self._trie.remove(verb)
+        if self.base is not None and verb in self.base:
+            self._removed.add(verb)
+        self.version += 1
+
+    def copy(self):
+        result = CmdTable(self._cmds, self.base)
+        result._removed = set(self._removed)
+        return result
+
+    def words(self, prefix=''):
+        """\
+        Yields the verbs starting with prefix.
+        """
+        for verb in self._trie.words(prefix):
+            yield verb
+        if self.base is not None:
+            for verb in self.base.words(prefix):
+                if verb not in self._removed and verb not in self._cmds:
+                    yield verb
+
+    def complete(self, prefix):
+        """\
+        Returns the verbs prefix could stand for, as Trie.complete.
+        """
+        result = self._trie.complete(prefix)
+        if self.base is None or result[1:]:
+            return result
+        if self._removed:
+            # what was removed could hide what is left in base.
+            found = self.base.words(prefix)
+        else:
+            found = self.base.complete(prefix)
+        for verb in found:
+            if verb not in self._removed and verb not in result:
+                result.append(verb)
+                if result[1:]:
+                    break
+        return result
+
+    def __repr__(self):
+        return '<CmdTable %s>' % dict(self.items()).__repr__()
+
+
+# what the children of an object without any look like.
+_NO_CHILDREN = SetView(OrderedSet())
+
+
+class _FrozenDict(dict):
+    """\
+    The attributes of a shared object.
+    """
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError('the attributes of a shared object cannot be '
+                        'changed, promote a copy of it instead')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _frozen
+
+
+class _FrozenList(list):
+    """\
+    The tags of a shared object.
+    """
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError('the tags of a shared object cannot be changed, '
+                        'promote a copy of it instead')
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = \
+        __imul__ = append = extend = insert = pop = remove = reverse = \
+        sort = _frozen
+
+
+class _Shared(object):
+    """\
+    What a shared object has for a parent, see MudObject.share.
+    """
+
+    def __nonzero__(self):
+        return False
+
+    def __repr__(self):
+        return '<shared>'
+
+SHARED = _Shared()
+
+
+def _lazy(name, factory):
+    """\
+    Property for the slot name, which stays None until the property is
+    first used and gets factory() then.
+    """
+    def fget(self):
+        value = getattr(self, name)
+        if value is None:
+            value = factory()
+            setattr(self, name, value)
+        return value
+    def fset(self, value):
+        self._writable()
+        setattr(self, name, value)
+    return property(fget=fget, fset=fset)
+
 
 class MudObject(object):
     """\
@@ -20,8 +232,50 @@ class MudObject(object):
 
     All objects that exists within the world (or even ones that could
     take advantage from inheriting this class) should inherit this.
+
+    As most objects are items that never use most of what is here, the
+    attributes live in slots and the containers are only created when
+    something is put in them.  Subclasses that do not define __slots__
+    themselves get a __dict__ for their own attributes as usual.
     """
 
+    __slots__ = (
+        '__weakref__',
+        '_parent',
+        '_shortdesc',
+        '_longdesc',
+        '_id',
+        '_attributes',
+        '_tag',
+        '_children',
+        '_cmd_overlays',
+        '_cmd_index',
+        '_cmd_tries',
+        '_cmd_tables',
+        '_cmd_traps',
+        '_id_index',
+        '_id_trie',
+        '_hb',
+        '_meta',
+        '_shared',
+        '_handle',
+    )
+
+    # whether instances are put in the registry of the world when they
+    # are created, so registry.by_type and by_name find them.  Others
+    # (most of them, items) only get there once their handle is asked
+    # for, as that costs more memory than the rest of them.
+    _register = False
+
+    # commands for this object (should only used by self)
+    _cmds = CmdTable()
+    # commands usable by siblings
+    _siblings_cmds = CmdTable()
+    # commands usable by parent
+    _parent_cmds = CmdTable()
+    # commands usable by children
+    _children_cmds = CmdTable()
+
     def __init__(self, shortdesc=None, longdesc=None, *args, **kwargs):
         """\
         Parameters:
@@ -31,46 +285,67 @@ class MudObject(object):
             different meaning in subclasses, but usually this meaning
             will be used.
         """
-        self.shortdesc = shortdesc if shortdesc else type(self).__name__
+        # the tables of this instance that differ from the ones of its
+        # class, as class table -> table.  First, as the command tables
+        # need it.
+        self._cmd_overlays = None
+        self._parent = None  # XXX - can we make this more... dynamic?
+        self._shortdesc = shortdesc if shortdesc else type(self).__name__
         self.longdesc = longdesc
 
-        # XXX make the initiation of these create a singleton for the
-        # class this represents.
-        # commands for this object (should only used by self)
-        self._cmds = {}
-        # commands usable by siblings
-        self._siblings_cmds = {}
-        # commands usable by parent
-        self._parent_cmds = {}
-        # commands usable by children
-        self._children_cmds = {}
-
         # identifiers are hints to others on what else can select this
-        # object.
-        self._id = []
+        # object.  Use add_id and remove_id to change them.
+        self._id = None
 
         # attributes will be used by players (and mobs) to determine
         # their strengths, agility, or basically statistics of them.
         # rooms could have temperature and water level attributes.
         # rooms may have to somehow automatically extend whatever
         # attributes exported by the area they belong to
-        self.attributes = {}
+        self._attributes = None
 
         # tags are what normally gets tacked onto objects, not sure
         # how exactly this will be implemented.
-        self.tag = []
-
-        self._children = []  # XXX - call this better?
-        self._parent = None  # XXX - can we make this more... dynamic?
-        self._hb = None  # heartbeat
+        self._tag = None
+
+        # an OrderedSet once there are any, see the children property.
+        self._children = None
+        # the commands offered by the children, as verb -> children in
+        # the order they were added, both for this object (from their
+        # _parent_cmds) and for each other (from their _siblings_cmds).
+        # Built when first needed, see _cmd_providers, along with a
+        # Trie of the verbs for abbreviations.
+        self._cmd_index = None
+        self._cmd_tries = None
+        # the tables it was built from, as table -> its version then.
+        self._cmd_tables = None
+        # children that override init_cmd, these are always asked.
+        self._cmd_traps = None
+        # the identifiers of the children, as identifier -> children,
+        # with a Trie of them.  Built when first needed, see find.
+        self._id_index = None
+        self._id_trie = None
+        self._hb = None  # heartbeat timer, see MudDriver.start_heartbeat
 
         # these are NOT exactly children
         # XXX since these are probably type dependent, we might want to
         # implement a list/dict hybrid object?
-        self._meta = []  # XXX - meta objects, objects about this object?
+        # XXX - meta objects, objects about this object?  Kept as
+        # type -> objects of exactly that type, see add_meta and meta.
+        self._meta = None
+        # how many of each shared object this one holds, see add.
+        self._shared = None
+        # the number of this object in the registry of the world, see
+        # handle.
+        self._handle = None
+        if self._register:
+            registry.register(self)
+
+    attributes = _lazy('_attributes', dict)
+    tag = _lazy('_tag', list)
 
     def __iter__(self):
-        return self._children.__iter__()
+        return iter(self._children or ())
 
     def __str__(self):
         return self.shortdesc
@@ -78,9 +353,13 @@ class MudObject(object):
     # XXX implement __getitem__ and the like that grabs childrens
 
     def _get_children(self):
-        result = []
-        result.extend(self._children)
-        return result
+        """\
+        Read only view of the children, which follows changes to them.
+        Make a list of it to change them while going through it.
+        """
+        if self._children is None:
+            return _NO_CHILDREN
+        return self._children.view()
 
     children = property(fget=_get_children)
 
@@ -118,42 +397,267 @@ class MudObject(object):
         #if not self.valid_cmd(cmd):
         #    return None
         cmd, arg = self._parse_cmd(input)
-        LOG.debug('%s.process_cmd [%s, %s]',
-                  self.__repr__(), cmd.__repr__(), arg.__repr__())
+        LOG.debug('%r.process_cmd [%r, %r]', self, cmd, arg)
 
         if not cmd:
             return None
 
+        result = self._dispatch_cmd(cmd, arg, sender)
+        if result:
+            return result
+        # aliases are only looked up once, so they cannot loop.
+        resolved = self.resolve_cmd(cmd)
+        if resolved:
+            verb, trail = resolved
+            if trail is None:
+                trail = arg
+            LOG.debug('%r.process_cmd resolved %r as [%r, %r]',
+                      self, cmd, verb, trail)
+            result = self._dispatch_cmd(verb, trail, sender)
+        return result
+
+    def _dispatch_cmd(self, cmd, arg, sender):
         # XXX - Not sure what command model/hierarchy to use
         # This model is search for commands to act on
-        cmd_self = ('self', self)
-        cmd_parent = ('parent', self._parent)
-        cmd_children = ('child', self.children)
-        # XXX this would *include* self, potential side effect that
-        # will allow self pushing self, for instance.  this may need
-        # to be fixed by the method that offers sibling...
-        cmd_siblings = ('sibling', self.siblings)
-
-        valid = (cmd_self, cmd_parent, cmd_children, cmd_siblings)
-
-        # FIXME - kill these breaks.
-        for name, obj in valid:
-            objs = obj
-            if not type(obj) is list:
-                objs = [obj]
-            for target in objs:
-                # this line will always execute because self is not None
-                result = target.init_cmd(self, cmd, arg, sender=sender)
-                if result:
-                    LOG.debug('%s.process_cmd, cmd in %s %s',
-                              self.__repr__(), name, target.__repr__())
-
-                    break
+        result = None
+        for name, target in self._cmd_candidates(cmd):
+            result = target.init_cmd(self, cmd, arg, sender=sender)
             if result:
+                LOG.debug('%r.process_cmd, cmd in %s %r', self, name, target)
                 break
-
         return result
 
+    def resolve_cmd(self, cmd):
+        """\
+        Finds what cmd is short for: an alias offered by the parent
+        (e.g. the name of an exit of a room), or else an abbreviation
+        of exactly one of the commands or aliases available.
+
+        Returns (verb, trail), where trail is None if the rest of the
+        input should be used, or None if there is no such command.
+        """
+        parent = self._parent
+        if parent is not None:
+            alias = parent.alias_cmd(self, cmd)
+            if alias:
+                return alias
+        found = {}
+        for verb in self._cmds.complete(cmd):
+            found[verb] = (verb, None)
+        for verb in self._cmd_completions(cmd, 'parent'):
+            found[verb] = (verb, None)
+        if parent is not None:
+            for verb in parent._children_cmds.complete(cmd):
+                found[verb] = (verb, None)
+            for verb in parent._cmd_completions(cmd, 'siblings'):
+                found[verb] = (verb, None)
+            for word, alias in parent.complete_alias(self, cmd):
+                found[word] = alias
+        if len(found) == 1:
+            return found.values()[0]
+        LOG.debug('%r cannot resolve %r, found %r', self, cmd, found.keys())
+        return None
+
+    def alias_cmd(self, caller, cmd):
+        """\
+        Redefine to offer aliases to the children, by returning the
+        (verb, trail) that cmd stands for.
+        """
+        return None
+
+    def complete_alias(self, caller, prefix):
+        """\
+        Redefine to offer aliases that can be abbreviated, returning a
+        list of (alias, (verb, trail)) for those starting with prefix
+        (as Trie.complete).
+        """
+        return []
+
+    def _cmd_completions(self, prefix, table):
+        """\
+        The verbs offered by the children (as _cmd_providers) that
+        prefix could stand for.
+        """
+        _index_lock.acquire()
+        try:
+            if self._cmd_index_stale():
+                self._reindex_cmds()
+            return self._cmd_tries[table].complete(prefix)
+        finally:
+            _index_lock.release()
+
+    def _cmd_candidates(self, cmd):
+        """\
+        Yields (relationship, object) for the objects that may provide
+        cmd to this one, in the order they should be asked: self, the
+        parent, the children and then the siblings.
+        """
+        yield 'self', self
+        parent = self._parent
+        if parent is not None:
+            yield 'parent', parent
+        for child in self._cmd_providers(cmd, 'parent'):
+            yield 'child', child
+        if parent is not None:
+            for sibling in parent._cmd_providers(cmd, 'siblings'):
+                # self was asked already
+                if sibling is not self:
+                    yield 'sibling', sibling
+
+    def _cmd_providers(self, cmd, table):
+        """\
+        Returns the children that offer cmd through their _parent_cmds
+        or _siblings_cmds (according to table), along with the ones
+        that have to be asked anyway.
+        """
+        _index_lock.acquire()
+        try:
+            if self._cmd_index_stale():
+                self._reindex_cmds()
+            result = self._cmd_index[table].get(cmd, ())
+            if self._cmd_traps:
+                wanted = set(result)
+                wanted.update(self._cmd_traps)
+                return [i for i in self._children if i in wanted]
+            # a copy, the index may change while it is gone through.
+            return tuple(result)
+        finally:
+            _index_lock.release()
+
+    def reindex_cmds(self):
+        """\
+        Rebuilds the index of the commands offered by the children.
+        This happens by itself when any of their tables changed.
+        """
+        _index_lock.acquire()
+        try:
+            self._reindex_cmds()
+        finally:
+            _index_lock.release()
+
+    # what follows on the indexes is done with _index_lock held.
+
+    def _reindex_cmds(self):
+        self._cmd_index = {'parent': {}, 'siblings': {}}
+        self._cmd_tries = {'parent': Trie(), 'siblings': Trie()}
+        self._cmd_tables = {}
+        self._cmd_traps = []
+        for obj in self._children or ():
+            self._index_cmds(obj)
+
+    def _cmd_index_stale(self):
+        tables = self._cmd_tables
+        if tables is None:
+            return True
+        for table, version in tables.iteritems():
+            if table.version != version:
+                return True
+        return False
+
+    def _track_cmds(self, table):
+        """\
+        Has the index rebuilt when table (or what it is layered over)
+        changes.
+        """
+        tables = self._cmd_tables
+        while table is not None and table not in tables:
+            tables[table] = table.version
+            table = table.base
+
+    def _index_cmds(self, obj):
+        if self._cmd_tables is None:
+            # built on first use anyway
+            return
+        if obj._parent is SHARED:
+            # has no parent to offer commands from.
+            return
+        if type(obj).init_cmd.im_func is not _init_cmd:
+            self._cmd_traps.append(obj)
+        for table, cmds in (('parent', obj._parent_cmds),
+                            ('siblings', obj._siblings_cmds)):
+            self._track_cmds(cmds)
+            index = self._cmd_index[table]
+            for cmd in cmds:
+                providers = index.get(cmd)
+                if providers is None:
+                    providers = index[cmd] = []
+                    self._cmd_tries[table].add(cmd)
+                providers.append(obj)
+
+    def _unindex_cmds(self, obj):
+        if self._cmd_tables is None:
+            return
+        if obj in self._cmd_traps:
+            self._cmd_traps.remove(obj)
+        for table, cmds in (('parent', obj._parent_cmds),
+                            ('siblings', obj._siblings_cmds)):
+            if cmds.base is not None:
+                # a table of obj alone.
+                self._cmd_tables.pop(cmds, None)
+            index = self._cmd_index[table]
+            for cmd in cmds:
+                providers = index.get(cmd)
+                if providers and obj in providers:
+                    providers.remove(obj)
+                    if not providers:
+                        del index[cmd]
+                        self._cmd_tries[table].remove(cmd)
+
+    def _cmd_overlay(self, table, overlay=None):
+        """\
+        Returns the table of this instance that is layered over the
+        class table, creating it (or setting it to overlay) as needed.
+        """
+        overlays = self._cmd_overlays
+        if overlay is None and overlays is not None:
+            found = overlays.get(table)
+            if found is not None:
+                return found
+        _index_lock.acquire()
+        try:
+            if overlays is None:
+                self._cmd_overlays = overlays = {}
+            parent = self._parent
+            index = getattr(parent, '_cmd_tables', None)
+            if overlay is None:
+                overlay = overlays[table] = CmdTable(base=table)
+                # the same commands as table so far, the index of the
+                # parent only has to follow it from now on.
+                if index is not None and table in index:
+                    parent._track_cmds(overlay)
+                return overlay
+            overlays[table] = overlay
+            if index is not None and table in index:
+                parent._cmd_tables = None
+            return overlay
+        finally:
+            _index_lock.release()
+
+    def add_cmd(self, verb, action, table='_cmds'):
+        """\
+        Adds the command verb to this instance only.
+
+        Parameters:
+        verb - what the command is called.
+        action - the MudNotify subclass that does it.
+        table - which of the command tables to add it to (_cmds,
+            _siblings_cmds, _parent_cmds or _children_cmds).
+        """
+        self._writable()
+        self._cmd_overlay(getattr(type(self), table))[verb] = action
+
+    def remove_cmd(self, verb, table='_cmds'):
+        """\
+        Removes the command verb from this instance only, returns False
+        if it did not have it.
+        """
+        self._writable()
+        overlay = self._cmd_overlay(getattr(type(self), table))
+        if verb not in overlay:
+            return False
+        del overlay[verb]
+        return True
+
     def init_cmd(self, caller, cmd, arg, sender=None):
         """\
         This method will find the cmd from self._cmds (which must be
@@ -162,18 +666,13 @@ class MudObject(object):
         Ideally this should not be overridden, but objects that needs
         to trap input (for instance, login) have to do so for now.
         """
-        LOG.debug('%s.init_cmd(%s, %s, %s)',
-                  self.__repr__(), 
-                  caller.__repr__(), 
-                  cmd.__repr__(), 
-                  arg.__repr__(),
-                 )
+        LOG.debug('%r.init_cmd(%r, %r, %r)', self, caller, cmd, arg)
         # find relationship of self to caller
         # note: finding it here because calling from caller, the
         # relationship cmds will be reversed 
-        if self == caller:
+        if self is caller:
             cmds = self._cmds
-        elif self == caller._parent:
+        elif self is caller._parent:
             """
             target = self
             if target is the parent of the caller
@@ -184,18 +683,20 @@ class MudObject(object):
             # should look for commands inside the set of commands for
             # its children (e.g room provides look for children)
             cmds = self._children_cmds
-        elif self in caller.children:
+        elif self._parent is caller:
             # if the initializer is inside children, then it should let
             # the parent know whether there are commands for it (e.g.
             # player's get command)
             cmds = self._parent_cmds
-        elif self in caller.siblings:
+        elif self._parent is not None and self._parent is caller._parent:
             cmds = self._siblings_cmds
+        else:
+            return None
 
-        if not cmd in cmds:
+        aC = cmds.get(cmd)
+        if aC is None:
             return None
 
-        aC = cmds[cmd]
         # XXX this a sufficient check for valid class type?
         # XXX this check fails on a reload
         if issubclass(aC, MudNotify):
@@ -203,6 +704,7 @@ class MudObject(object):
               # with proper targets, etc.
             # not self, *caller*
             a = aC(caller, trail=arg, sender=sender)
+            a.verb = cmd
             return a
         else:
             raise TypeError('%s (%s) is not subclass of MudNotify' %\
@@ -211,17 +713,34 @@ class MudObject(object):
     def send(self, msg):
         LOG.debug('%s received %s', self.__repr__(), msg.__repr__())
 
+    def heartbeat(self):
+        """\
+        Called every heartbeat once started, see
+        MudDriver.start_heartbeat.
+        """
+
     # XXX - may not be desirable for default
     #addNotify = ObjAddNotify
     def add(self, obj):
         # assume contents to be list
+        self._writable()
+        if obj._parent is SHARED:
+            return self._add_shared(obj)
         if obj._parent is not None:
             # XXX - uh, how did this happen?
             LOG.warning('%s.add(obj=%s), obj already has parent %s.  Aborted.',
                     self.__repr__(), obj.__repr__(), obj._parent.__repr__())
             return False
         obj._parent = self
-        self._children.append(obj)
+        _index_lock.acquire()
+        try:
+            if self._children is None:
+                self._children = OrderedSet()
+            self._children.add(obj)
+            self._index_cmds(obj)
+            self._index_ids(obj)
+        finally:
+            _index_lock.release()
         #if self.addNotify:
         #    e = self.addNotify(caller=self, target=obj)
         #    e()
@@ -231,7 +750,9 @@ class MudObject(object):
     #removeNotify = ObjRemoveNotify
     def remove(self, obj):
         result = False
-        if obj not in self._children: 
+        if obj._parent is SHARED:
+            return self._remove_shared(obj)
+        if self._children is None or obj not in self._children:
             # invalid
             if obj._parent != self:
                 LOG.debug('%s not in %s; cannot remove', 
@@ -245,7 +766,13 @@ class MudObject(object):
                 # may need to notify obj
                 return True
         else:
-            self._children.remove(obj)
+            _index_lock.acquire()
+            try:
+                self._children.remove(obj)
+                self._unindex_cmds(obj)
+                self._unindex_ids(obj)
+            finally:
+                _index_lock.release()
             if obj._parent == self:
                 # only unset object's parent if this item is the true
                 # parent.
@@ -269,6 +796,117 @@ class MudObject(object):
         #    e()
         return True
 
+    def _add_shared(self, obj):
+        if self._shared is None:
+            self._shared = {}
+        count = self._shared.get(obj, 0)
+        self._shared[obj] = count + 1
+        if not count:
+            _index_lock.acquire()
+            try:
+                if self._children is None:
+                    self._children = OrderedSet()
+                self._children.add(obj)
+                self._index_ids(obj)
+            finally:
+                _index_lock.release()
+        return True
+
+    def _remove_shared(self, obj):
+        count = self._shared and self._shared.get(obj)
+        if not count:
+            LOG.debug('%s not in %s; cannot remove',
+                obj.__repr__(), self.__repr__())
+            return False
+        if count > 1:
+            self._shared[obj] = count - 1
+            return True
+        del self._shared[obj]
+        _index_lock.acquire()
+        try:
+            self._children.remove(obj)
+            self._unindex_ids(obj)
+        finally:
+            _index_lock.release()
+        return True
+
+    def count(self, obj):
+        """\
+        Returns how many of obj this object holds, which can be more
+        than one for a shared object.
+        """
+        if obj._parent is SHARED:
+            return self._shared and self._shared.get(obj, 0) or 0
+        return int(obj._parent is self)
+
+    def share(self):
+        """\
+        Makes this object shared, so any number of others can hold it
+        without it being copied: they only count how many of it they
+        have.  Shared objects cannot be changed and have no parent, so
+        they also cannot offer commands; use promote on the holder to
+        get a copy of its own that can.  See also mtj.mud.factory.
+        """
+        if self._parent is SHARED:
+            return
+        if self._parent is not None or self._children:
+            raise ValueError('%r cannot be shared while it has a parent or '
+                             'children' % self)
+        self._parent = SHARED
+        self._attributes = _FrozenDict(self._attributes or ())
+        self._tag = _FrozenList(self._tag or ())
+
+    shared = property(fget=lambda self: self._parent is SHARED)
+
+    def _writable(self):
+        if self._parent is SHARED:
+            raise TypeError('%r is shared and cannot be changed, promote a '
+                            'copy of it instead' % self)
+
+    def promote(self, obj):
+        """\
+        Replaces one of the shared obj held by this object with a copy
+        of its own, which is returned.  Returns obj itself if it is not
+        shared, or None if it is not held.
+        """
+        if obj._parent is not SHARED:
+            if obj._parent is self:
+                return obj
+            return None
+        if not self._remove_shared(obj):
+            return None
+        result = obj.clone()
+        self.add(result)
+        return result
+
+    def clone(self):
+        """\
+        Returns a copy of this object, with copies of its identifiers,
+        attributes, tags and commands but without its parent, children
+        or meta objects.
+        """
+        result = object.__new__(type(self))
+        for name in _slot_names(type(self)):
+            try:
+                value = getattr(self, name)
+            except AttributeError:
+                continue
+            if name in _CLONE_EMPTY:
+                value = None
+            elif name == '_cmd_overlays' and value:
+                value = dict([(k, v.copy()) for k, v in value.iteritems()])
+            else:
+                value = _copied(value)
+            setattr(result, name, value)
+        state = getattr(self, '__dict__', None)
+        if state:
+            result.__dict__.update([(k, _copied(v))
+                                    for k, v in state.iteritems()])
+        result._parent = None
+        if result._register:
+            registry.register(result)
+        return result
+
     def move_obj_to(self, obj, target):
         """\
         This move takes place at the perspective of the parent.
@@ -281,15 +919,18 @@ class MudObject(object):
 
     def move_to(self, target):
         """\
-        This move takes place at the perspective of self.
+        This move takes place at the perspective of self.  Shared
+        objects do not know which holder to move from, the holder has
+        to use move_obj_to.
         """
+        if self._parent is SHARED:
+            raise TypeError('%r is shared, move it with move_obj_to of '
+                            'its holder' % self)
         # FIXME - this is not atomic operation
         # remove could do partial things...
-        if self._parent:
-            result = self._parent.remove(self)
-        if result:
-            return target.add(self)
-        return False
+        if self._parent is not None and not self._parent.remove(self):
+            return False
+        return target.add(self)
 
     def find_id(self, id_):
         """\
@@ -298,36 +939,249 @@ class MudObject(object):
         Parameters:
         id_ - the string identifier to look for.
         """
-        for i in self._children:
-            if id_ in i.id:
-                return i
-        return None
+        _index_lock.acquire()
+        try:
+            if self._id_index is None:
+                self._build_id_index()
+            found = self._id_index.get(id_)
+            if found:
+                return found[0]
+            return None
+        finally:
+            _index_lock.release()
+
+    def find(self, spec):
+        """\
+        Finds a child by what a player would type to select it: an
+        identifier or the start of one, which can be preceded by an
+        ordinal to pick among several (e.g. '2.sword').  Identifiers
+        that match exactly are preferred over the ones that only start
+        with it.
+        """
+        count = 1
+        if '.' in spec:
+            ordinal, name = spec.split('.', 1)
+            if ordinal.isdigit():
+                count = int(ordinal)
+                spec = name
+        if not spec or count < 1 or not self._children:
+            return None
+        _index_lock.acquire()
+        try:
+            if self._id_index is None:
+                self._build_id_index()
+            found = self._id_index.get(spec)
+            if not found:
+                found = set()
+                for id_ in self._id_trie.words(spec):
+                    found.update(self._id_index[id_])
+                found = sorted(found, key=self._children.key)
+            if len(found) < count:
+                return None
+            return found[count - 1]
+        finally:
+            _index_lock.release()
+
+    def _build_id_index(self):
+        self._id_index = {}
+        self._id_trie = Trie()
+        for obj in self._children or ():
+            self._index_ids(obj)
+
+    def _index_ids(self, obj, ids=None):
+        if self._id_index is None:
+            return
+        if ids is None:
+            ids = obj.id
+        for id_ in set(ids):
+            found = self._id_index.get(id_)
+            if found is None:
+                found = self._id_index[id_] = []
+                self._id_trie.add(id_)
+            if obj not in found:
+                found.append(obj)
+                key = self._children.key
+                if found[-2:-1] and key(found[-2]) > key(obj):
+                    found.sort(key=key)
+
+    def _unindex_ids(self, obj, ids=None):
+        if self._id_index is None:
+            return
+        if ids is None:
+            ids = obj.id
+        for id_ in set(ids):
+            found = self._id_index.get(id_)
+            if found and obj in found:
+                found.remove(obj)
+                if not found:
+                    del self._id_index[id_]
+                    self._id_trie.remove(id_)
+
+    def _reindex_ids(self, obj, old, new):
+        """\
+        Called by a child with the identifiers it had and has now.
+        """
+        old, new = set(old), set(new)
+        _index_lock.acquire()
+        try:
+            self._unindex_ids(obj, old - new)
+            self._index_ids(obj, new - old)
+        finally:
+            _index_lock.release()
 
     def _get_id(self):
         """\
         Returns a list of identifiers.
         """
-        result = []
-        result.append(self.shortdesc)
-        result.extend(self._id)
+        result = [self._shortdesc]
+        if self._id:
+            result.extend(self._id)
         return result
 
     id = property(fget=_get_id)
-    
+
+    def add_id(self, id_):
+        """\
+        Adds an identifier this object can be selected with.
+        """
+        self._writable()
+        if self._id is None:
+            self._id = []
+        elif id_ in self._id:
+            return
+        old = self.id
+        self._id.append(id_)
+        if self._parent is not None:
+            self._parent._reindex_ids(self, old, self.id)
+
+    def remove_id(self, id_):
+        self._writable()
+        if not self._id or id_ not in self._id:
+            return
+        old = self.id
+        self._id.remove(id_)
+        if self._parent is not None:
+            self._parent._reindex_ids(self, old, self.id)
+
+    def _set_shortdesc(self, shortdesc):
+        self._writable()
+        old = self.id
+        self._shortdesc = shortdesc
+        if self._parent is not None:
+            self._parent._reindex_ids(self, old, self.id)
+        if self._handle is not None:
+            registry.rename(self, shortdesc)
+
+    shortdesc = property(fget=lambda self: self._shortdesc,
+                         fset=_set_shortdesc)
+
+    def _set_longdesc(self, longdesc):
+        self._writable()
+        self._longdesc = longdesc
+
+    longdesc = property(fget=lambda self: self._longdesc,
+                        fset=_set_longdesc)
+
     @property
     def parent(self):
-        return self._parent
+        return self._parent or None
+
+    def _get_handle(self):
+        """\
+        The number of this object in the registry of the world, which
+        it is put in now if it was not yet.
+        """
+        if self._handle is None:
+            registry.register(self)
+        return self._handle
+
+    handle = property(fget=_get_handle)
+
+    def add_meta(self, obj):
+        """\
+        Adds obj to the objects about this one, returns False if it was
+        already there.
+        """
+        if self._meta is None:
+            self._meta = {}
+        found = self._meta.get(type(obj))
+        if found is None:
+            found = self._meta[type(obj)] = []
+        elif obj in found:
+            return False
+        found.append(obj)
+        return True
+
+    def remove_meta(self, obj):
+        """\
+        Removes obj from the objects about this one, returns False if it
+        was not there.
+        """
+        found = self._meta and self._meta.get(type(obj))
+        if not found or obj not in found:
+            return False
+        found.remove(obj)
+        if not found:
+            del self._meta[type(obj)]
+        return True
+
+    def meta(self, cls=None):
+        """\
+        Returns the objects about this one, or only the instances of
+        cls, in the order they were added for each type.
+        """
+        if not self._meta:
+            return []
+        result = list(self._meta.get(cls, ()))
+        for type_, objs in self._meta.iteritems():
+            if type_ is not cls and (cls is None or issubclass(type_, cls)):
+                result.extend(objs)
+        return result
+
+
+# to tell which objects override it.
+_init_cmd = MudObject.init_cmd.im_func
+
+# what a clone starts out without.
+_CLONE_EMPTY = set(['_children', '_cmd_index', '_cmd_tries',
+    '_cmd_tables', '_cmd_traps', '_id_index', '_id_trie', '_hb',
+    '_meta', '_shared', '_handle'])
+
+
+def _copied(value):
+    if type(value) in (list, dict, set):
+        return copy.copy(value)
+    # the copy of a shared object can be changed.
+    if type(value) is _FrozenDict:
+        return dict(value)
+    if type(value) is _FrozenList:
+        return list(value)
+    return value
+
+
+def _slot_names(cls):
+    result = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+        result.extend([i for i in slots
+                       if i not in ('__weakref__', '__dict__')])
+    return result
 
 
 class MudSprite(MudObject):
     """Anything that is somewhat smart?"""
+
+    _register = True
+
     def __init__(self, soul=None, *args, **kwargs):
         self._soul = soul
         MudObject.__init__(self, *args, **kwargs)
 
     def send(self, msg):
         # XXX fail here!
-        if self.soul and type(self.soul) is Soul:
+        if self.soul and isinstance(self.soul, Soul):
             self.soul.send(msg)
 
     def _set_soul(self, soul):
@@ -349,7 +1203,18 @@ class MudSprite(MudObject):
 
 class MudPlayer(MudSprite):
     room = property(fget=lambda self: self._parent)
-    inventory = property(fget=lambda self: self._children)
+    inventory = property(fget=lambda self: self.children)
+
+    # dictionary of special commands
+    _cmds = CmdTable({
+        'look': Look,
+        'say': Say,
+        'tell': Tell,
+        ':': Emote,
+        'quit': Quit,
+        'history': History,
+        'help': Help,
+    })
 
     def __init__(self, name='Guest', *args, **kwargs):
         MudSprite.__init__(self, *args, **kwargs)
@@ -359,14 +1224,6 @@ class MudPlayer(MudSprite):
         # titles look like 'Duke %s, the Brave', with %s replaced by
         # player's name
         self.title = ''
-        self._cmds = {
-            'look': Look,
-            'say': Say,
-            ':': Emote,
-            'quit': Quit,
-            'history': History,
-            'help': Help,
-        }  # dictionary of special commands
 
     def _full_name(self):
         if '%s' in self.title:
@@ -386,8 +1243,8 @@ class MudPlayer(MudSprite):
 class MudWizard(MudPlayer):
     # XXX placeholder class?
     def __init__(self, name='Wizard', *args, **kwargs):
-        MudPlayer.__init(self, name, *args, **kwargs)
-        self._cmds['create'] = Create
+        MudPlayer.__init__(self, name, *args, **kwargs)
+        self.add_cmd('create', Create)
 
 
 class MudMeta(MudObject):
@@ -397,6 +1254,8 @@ class MudMeta(MudObject):
 
 
 class MudArea(MudObject):
+    _register = True
+
     def __init__(self, *args, **kwargs):
         # generic mudarea
         MudObject.__init__(self, *args, **kwargs)
@@ -406,39 +1265,125 @@ class MudArea(MudObject):
 
 
 class MudRoom(MudArea):
+    _children_cmds = CmdTable({
+        'go': Go,
+    })
+
+    # short forms of exit names, used if the room has that exit.
+    exit_aliases = {
+        'n': 'north',
+        's': 'south',
+        'e': 'east',
+        'w': 'west',
+        'u': 'up',
+        'd': 'down',
+    }
+
     def __init__(self, shortdesc='Empty Room', *args, **kwargs):
+        # bumped whenever what the room looks like changes, other than
+        # what is in it, so what was rendered from it can be kept.
+        self.version = 0
+        # the Look of this room, as (version, text).
+        self.render_cache = None
         # generic mudroom
         MudObject.__init__(self, shortdesc=shortdesc, *args, **kwargs)
+        # the exits, as name -> [(link, room it leads to)] in the order
+        # the links were made, kept by MudRoomLink.  Also their names,
+        # in that order and in a Trie.
+        self._exits = {}
+        self._exit_list = ()
+        self._exit_trie = Trie()
+
+    def _link_added(self, link):
+        name, room = link.get_link(self)
+        exits = self._exits.get(name)
+        if exits is None:
+            exits = self._exits[name] = []
+            self._exit_trie.add(name)
+        exits.append((link, room))
+        self._exit_list += (name,)
+        self.changed()
+
+    def _link_removed(self, link):
+        name = link.link[self]
+        exits = self._exits.get(name, ())
+        for i, (l, room) in enumerate(exits):
+            if l is link:
+                del exits[i]
+                break
+        else:
+            return
+        if not exits:
+            del self._exits[name]
+            self._exit_trie.remove(name)
+        exit_list = list(self._exit_list)
+        exit_list.remove(name)
+        self._exit_list = tuple(exit_list)
+        self.changed()
+
+    def changed(self):
+        """\
+        Marks what the room looks like as changed.  Done by itself when
+        the descriptions or exits change, but has to be called when
+        anything else that is rendered with it does.
+        """
+        self.version += 1
 
-        self._children_cmds = {
-            'go': Go,
-        }
+    def _set_shortdesc(self, shortdesc):
+        MudObject._set_shortdesc(self, shortdesc)
+        self.changed()
 
-    @property
-    def __meta_link(self):
-        # temporary method that will return just MudRoomLink meta 
-        # objects.  Will be removed when we can easily return meta
-        # objects by type.
-        return [i for i in self._meta if isinstance(i, MudRoomLink)]
+    def _set_longdesc(self, longdesc):
+        MudObject._set_longdesc(self, longdesc)
+        self.changed()
+
+    shortdesc = property(fget=lambda self: self._shortdesc,
+                         fset=_set_shortdesc)
+    longdesc = property(fget=lambda self: self._longdesc,
+                        fset=_set_longdesc)
+
+    def exit(self, name):
+        """\
+        Returns the room the exit name leads to, or None if there is no
+        such exit.  If more than one has that name the newest is used.
+        """
+        exits = self._exits.get(name)
+        if exits:
+            return exits[-1][1]
+        return None
+
+    def alias_cmd(self, caller, cmd):
+        """\
+        The exits of the room can be used as commands, by name or by
+        their short form.
+        """
+        if cmd not in self._exits:
+            cmd = self.exit_aliases.get(cmd)
+            if cmd not in self._exits:
+                return None
+        return ('go', cmd)
+
+    def complete_alias(self, caller, prefix):
+        return [(name, ('go', name))
+                for name in self._exit_trie.complete(prefix)]
 
     @property
     def roomlinks(self):
         """\
-        Returns the complete list of room links.
+        Returns the names of the exits, as a tuple.
 
         Further filtering can be done.
         """
 
-        return [i.link[self] for i in self.__meta_link]
+        return self._exit_list
 
     def get_links(self, link_id):
         """\
         Returns the link through the link_id (i.e. direction).
         """
 
-        all_links = [i.get_link(self) for i in self.__meta_link]
-        links = [i for i in all_links if i[0] == link_id]
-        return links
+        return [(link_id, room) for link, room in
+                self._exits.get(link_id, ())]
 
 
 class MudRoomLink(MudMeta):
@@ -500,8 +1445,9 @@ class MudRoomLink(MudMeta):
         # If this object is created within the event loop, no race
         # condition should be triggered.
         for k, v in self.__link:
-            self._meta.append(k)
-            k._meta.append(self)
+            self.add_meta(k)
+            k.add_meta(self)
+            k._link_added(self)
 
         # Since room can have multiple exits with same name, a handler
         # should be written (like, alternate rooms if certain condition
@@ -533,8 +1479,8 @@ class MudRoomLink(MudMeta):
 
         for k, v in self.__link:
             # we only need to remove the external references to this.
-            if self in k._meta:
-                k._meta.remove(self)
+            if k.remove_meta(self):
+                k._link_removed(self)
 
 
 class SoulGateKeeper(MudObject):
@@ -569,7 +1515,7 @@ class SoulGateKeeper(MudObject):
             if not self.login:
                 self.login = cmd
                 # XXX - lol hacks and raw sends
-                self.soul.request.send(PASSWORD_PROMPT)
+                self.soul.write(PASSWORD_PROMPT)
             elif not self.password:
                 self.password = cmd
         if self.login and self.password:
@@ -584,7 +1530,8 @@ class SoulGateKeeper(MudObject):
             self.soul._parent = body
             # FIXME - um, use the queue to move player into room?
             room = self.soul.driver.starting['main']
-            self.soul.driver.Q(Login(self.soul._parent, room, sender=self.soul))
+            self.soul.driver.Q(Login(self.soul._parent, room,
+                trail=self.login, sender=self.soul))
             # XXX hackish to trick a look
             # disabled here due to prompt...
             #self.soul.driver.Q(Look(self.soul._parent, sender=self.soul))
@@ -608,6 +1555,10 @@ class Soul(MudObject):
     )
     logged_in = property(fget=lambda self: type(self.body) != SoulGateKeeper)
 
+    # no () at the end so not to call it now
+    # This may interfere with creating accounts with these names
+    _cmds = CmdTable()
+
     def __init__(self, handler=None, *args, **kwargs):
         # XXX - may not be too smart about giving a user control object
         # all these references to resources above it?
@@ -629,159 +1580,407 @@ class Soul(MudObject):
           'max_history': 30,
         }
 
-        # keep tracks of incoming rawdata
-        self.rawq = []
+        # incoming data is read into this buffer and parsed by telnet
+        self._rbuf = bytearray(MAX_DATA_LEN)
+        self.telnet = TelnetParser(self)
+        # lines received but not yet processed as the input limit was
+        # reached.
+        self.limiter = TokenBucket()
+        self._held = deque()
+        self._holding = False
+        # statistics
+        self.lines_in = 0
+        self.throttled = 0
+        # outgoing data, sent as one chunk by flush
+        self.outq = OutputQueue(notice=self._skipped_notice)
+        self._outlock = threading.Lock()
+        # data taken from outq that the connection did not accept yet
+        self._unsent = ''
+        self._sent = 0
+        # MCCP: True once the client asked for it, then the stream.
+        self.mccp = None
 
         self.cmd_handler = None
 
         # the bodies
         self._parent = SoulGateKeeper(soul=self)
-        # no () at the end so not to call it now
-        # This may interfere with creating accounts with these names
-        self._cmds = {
-        }
 
     # communication
     def recv(self):
-        # TODO - this can be made more efficient
-        validChar = lambda x: 32 <= ord(x) <= 126
-        ctrlChar = lambda x: ord(x) >= 240 or ord(x) < 32
-        data = ''
-        rawq = self.rawq
-        while self.online and CHAR_TERM not in data:
-            try:
-                data = self.request.recv(MAX_DATA_LEN)
-                LOG.log(0, 'received data (%02d|%s)' % 
-                        (len(data), data.__repr__()))
-                if not data:
-                    self.online = False
-                if data: # and validChar(data):
-                    rawq.append(data)
-            except:
-                # something real bad must have happened, forcing 
-                # offline to be safe
-                self.online = False
-                raise
+        """\
+        Blocks until at least one complete line has been received from
+        the connection, or the connection went offline.
+        """
+        lines = []
+        while self.online and not lines:
+            lines = self.read()
+        return lines
 
-        # do error validation here.
-        # else:
-        #     LOG.debug('Last chunk too long, scanning for next newline')
-        #     self.bad_count += 1
-        # if self.bad_count > MAX_BAD:
-        #     LOG.debug('bad_count maxxed out, dropping connection')
-        #     return
-
-        # fresh queue after we grabbed output
-        raw = ''.join(rawq)
-        LOG.debug('Received raw data: %s', raw.__repr__())
-        rawq = []
-
-        # FIXME - put this in better place
-        # look for telnet nvt codes and handle them.
-        iac = '\xff\xfd\x06'
-        iac_c = 0
-
-        lines = []  # all the good lines
-        line = []   # current line (chars)
-        for c in raw:
-            if validChar(c):
-                line.append(c)
-            if ctrlChar(c):
-                # XXX hack for ctrl-c handling sent from telnet
-                if iac[iac_c] == c:
-                    iac_c += 1
-                else:
-                    iac_c = 0
-
-                if iac_c == 3:
-                    LOG.debug('acting on iac')
-                    iac_c = 0
-                    self.request.send('\xff\xfb\x06')
-            if c in CMD_TERM:
-                # XXX only send prompt on carriage return
-                if line or (not line and c == CHAR_TERM):
-                    lines.append(''.join(line))
-                    line = []
-        if line:
-            # append leftovers for next round...
-            rawq.append(''.join(line))
-        self.rawq = rawq
-        LOG.debug('got lines: %s', str(lines))
+    def read(self):
+        """\
+        Reads once from the connection into the receive buffer and
+        returns the list of complete lines found so far.
+        """
+        try:
+            length = self.request.recv_into(self._rbuf)
+        except:
+            # something real bad must have happened, forcing 
+            # offline to be safe
+            self.online = False
+            raise
+        if LOG.isEnabledFor(0):
+            # only copied out of the buffer if it is going to be logged.
+            LOG.log(0, 'received data (%02d|%r)', length,
+                    str(self._rbuf[:length]))
+        if not length:
+            self.online = False
+            return []
+        overflow = self.telnet.overflow
+        lines = self.feed(self._rbuf, length)
+        for i in xrange(self.telnet.overflow - overflow):
+            self.bad('sent a line that is too long')
+        return lines
 
+    def feed(self, data, length=None):
+        """\
+        Feeds a chunk of raw data received from the connection, returns
+        the list of complete lines found so far.
+        """
+        lines = self.telnet.feed(data, length)
+        LOG.debug('got lines: %s', lines)
         return lines
 
+    def process_input(self, lines=()):
+        """\
+        Processes the lines received as fast as the input limiter
+        allows, holding back the rest.  Returns None when everything
+        got processed, otherwise the number of seconds until more can
+        be, and until then nothing more should be read.
+        """
+        held = self._held
+        limiter = self.limiter
+        if lines:
+            if not held and limiter.full():
+                # behaved for a while.
+                self.bad_count = 0
+            self.lines_in += len(lines)
+            held.extend(lines)
+            # every burst worth of lines that has to wait counts.
+            backlog = len(held) - int(limiter.tokens)
+            for i in xrange(0, backlog, limiter.burst):
+                self.bad('is flooding')
+        while held and self.online:
+            if not limiter.take():
+                if not self._holding:
+                    self._holding = True
+                    self.throttled += 1
+                return limiter.delay()
+            self.process_line(held.popleft())
+        self._holding = False
+        if not self.online:
+            held.clear()
+        return None
+
+    def bad(self, reason):
+        """\
+        Counts misbehaviour of the other end, dropping the connection
+        once there was too much of it.
+        """
+        self.bad_count += 1
+        LOG.debug('%s %s (%d)', self.__repr__(), reason, self.bad_count)
+        if self.bad_count > MAX_BAD and self.online:
+            LOG.info('%s %s too often, disconnecting.', self.__repr__(),
+                     reason)
+            self._held.clear()
+            self.send('Too much input, disconnecting.')
+            self.flush(finish=True)
+            self.disconnect()
+
+    def input_stats(self):
+        """\
+        Returns the state of the input limiting, for monitoring.
+        """
+        return {
+            'lines': self.lines_in,
+            'held': len(self._held),
+            'throttled': self.throttled,
+            'overflow': self.telnet.overflow,
+            'bad': self.bad_count,
+        }
+
+    def _skipped_notice(self, count, size):
+        return '\xff\xfb\x01[%d messages (%d bytes) were skipped as your '\
+            'connection could not keep up.]\r\n\xff\xfc\x01' % (count, size)
+
+    # telnet protocol handlers
+
+    def telnet_negotiate(self, cmd, opt):
+        if cmd == DO and opt == TM:
+            # XXX hack for ctrl-c handling sent from telnet
+            LOG.debug('acting on iac')
+            self.write(IAC + WILL + TM)
+        elif opt == COMPRESS2 and MCCP_ENABLED:
+            if cmd == DO and self.mccp is None:
+                LOG.debug('%s starting compression', self.__repr__())
+                # compression starts with the next flush
+                self.mccp = True
+            elif cmd in (DONT, WONT) and self.mccp:
+                LOG.debug('%s stopping compression', self.__repr__())
+                self._outlock.acquire()
+                try:
+                    if self.mccp is True:
+                        # never started.
+                        self.mccp = None
+                    else:
+                        if not self.outq and not self._unsent:
+                            self.driver.flush_later(self)
+                        self._finish_pending()
+                finally:
+                    self._outlock.release()
+
+    def telnet_command(self, cmd):
+        pass
+
+    def telnet_subneg(self, opt, data):
+        pass
+
     def send(self, msg, newline=True):
+        """\
+        Sends msg, which can also be a Frame (in which case newline is
+        whatever it was framed with).
+        """
         if not self.online:
-            LOG.warning('%s is offline: cannot send %s.',
-                        self.__repr__(),
-                        msg.__repr__(),
-                        )
+            LOG.warning('%s is offline: cannot send %r.', self.__repr__(), msg)
             return False
+        LOG.debug('sending msg: %r', msg)
+        if type(msg) is Frame:
+            self.write(msg.data)
+        else:
+            self.write(frame(msg, newline))
+        return True
+
+    def write(self, data):
+        """\
+        Queues raw data for the connection.
+
+        Nothing is sent until flush is called, which the driver does
+        once at the end of its tick for every soul written to during
+        that tick.  Clients that cannot keep up are dealt with by the
+        policy of the output queue.
+        """
+        self._outlock.acquire()
         try:
-            LOG.debug('sending msg: %s', msg.__repr__())
-            # XXX - maybe abstract these telnet codes away, or use the
-            # telnet class?
-            self.request.send('\xff\xfb\x01%s' % msg)
-            if newline:
-                # don't send dup newlines
-                if msg.__str__()[-2:] != '\r\n':
-                    self.request.send('\r\n')
-            # reset of some sort for a new line
-            self.request.send('\xff\xfc\x01')
-            return True
-        except:
-            LOG.warning('cannot send message to %s', self.__repr__())
-            LOG.warning('message was: %s', msg.__repr__())
+            if not self.online:
+                return False
+            if not self.outq and not self._unsent:
+                # first write since everything got sent.
+                self.driver.flush_later(self)
+            if self.outq.put(data):
+                return True
+        finally:
+            self._outlock.release()
+        LOG.info('%s cannot keep up with its output, disconnecting.',
+                 self.__repr__())
+        self.disconnect()
+        return False
 
-    def loop(self):
+    def flush(self, finish=False):
+        """\
+        Sends as much of the queued data as the connection will take
+        right now, without blocking.  Returns True when nothing is left
+        to be sent.
+
+        If finish is True, the compressed stream (if any) is ended.
+        """
+        self._outlock.acquire()
+        try:
+            # what was written while the previous chunk was pending is
+            # sent as soon as that chunk is, as nothing else would.
+            while True:
+                if not self._unsent:
+                    if not self.outq and not (finish and self.mccp):
+                        return True
+                    self._unsent = self._encode(self.outq.take(), finish)
+                    self._sent = 0
+                elif finish and self.mccp:
+                    # or the stream would never be ended.
+                    self._finish_pending()
+                try:
+                    self._sent += self.request.send(
+                        buffer(self._unsent, self._sent), SEND_FLAGS)
+                except SocketError, e:
+                    if e.args[0] not in SEND_RETRY:
+                        LOG.debug('%s cannot send (%s), going offline.',
+                                  self.__repr__(), e)
+                        # shut down, so the server notices.
+                        self.disconnect()
+                        self._unsent = ''
+                        self.outq.clear()
+                        return True
+                if self._sent < len(self._unsent):
+                    handler_want_write = getattr(self.handler, 'want_write',
+                                                 None)
+                    if handler_want_write:
+                        handler_want_write()
+                    return False
+                self._unsent = ''
+                self._sent = 0
+        finally:
+            self._outlock.release()
+
+    def _finish_pending(self):
+        """\
+        Ends the compressed stream right behind what is still to be
+        sent, with the output lock held.
+        """
+        self._unsent = self._unsent[self._sent:] + \
+            self._encode(self.outq.take(), True)
+        self._sent = 0
+
+    def _encode(self, data, finish=False):
+        """\
+        Turns the coalesced output into what goes down the wire.
+        """
+        mccp = self.mccp
+        if mccp is True:
+            # the start sequence is the last thing sent uncompressed.
+            self.mccp = mccp = MCCPStream()
+            data = mccp.start + mccp.compress(data)
+        elif mccp:
+            data = mccp.compress(data)
+        if finish and mccp:
+            data += mccp.finish()
+            self.mccp = None
+        return data
+
+    def disconnect(self):
+        """\
+        Drops the connection, without saying goodbye.
+        """
+        self.online = False
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except SocketError:
+            pass
+
+    def closed(self):
+        """\
+        Called once the connection is closed.
+        """
+        pass
+
+    def output_stats(self):
+        """\
+        Returns the state of the output queue, for monitoring.
+        """
+        outq = self.outq
+        return {
+            'queued': len(outq),
+            'bytes': outq.bytes + len(self._unsent) - self._sent,
+            'overflows': outq.overflows,
+            'dropped': outq.dropped,
+            'dropped_bytes': outq.dropped_bytes,
+            'mccp_in': getattr(self.mccp, 'bytes_in', 0),
+            'mccp_out': getattr(self.mccp, 'bytes_out', 0),
+        }
+
+    def begin(self):
+        """\
+        Brings this soul online and greets the other end.
+        """
         if self.online == None:
             self.online = True
+            if MCCP_ENABLED:
+                self.write(IAC + WILL + COMPRESS2)
             self.send(self.server.greeting_msg, False)
+            self.flush()
+
+    def process_line(self, data):
+        """\
+        Processes a single line of input received from the connection.
+        """
+        LOG.debug('processing data')
+        # handle command parsing here
+        cmd = data.strip()
+        if cmd:
+            LOG.debug('%s cmd: %r', self.handler.client_address, cmd)
+            self.rec_history(data)
+        # send to queue
+        a = self.body.process_cmd(cmd, sender=self)
+        logging.debug('process_cmd returns: %r', a)
+        if isinstance(a, MudNotify):
+            self.driver.Q(a)
+        elif a == True:
+            # it means this command was handled somewhere.
+            pass
+        elif data:
+            # command not handled; notify user
+            #self.send('%s not a valid command, please try again!' %
+            #    cmd.__repr__())
+            # rough code
+            # XXX this is not really executed because
+            # cmd_handler is None?
+            if self.cmd_handler:
+                # FIXME this is very very very hackish
+                # optimized for Say ONLY
+                self.driver.Q(
+                    self.cmd_handler(self.body, trail=data), 
+                    self,
+                )
+            else:
+                self.send('Please try again!')
+                self.prompt()
+        else:
+            # blank command, send prompt
+            self.prompt()
+
+    def receive(self):
+        """\
+        Reads and processes what is available on the connection once it
+        is known to be readable (i.e. by the event driven server),
+        instead of this soul blocking in its own loop.
+
+        Returns what process_input does; if not None the connection
+        must not be read again before resume returned None.
+        """
+        return self._process(self.read)
+
+    def resume(self):
+        """\
+        Continues processing the input that was held back.
+        """
+        return self._process(tuple)
+
+    def _process(self, read):
+        delay = None
+        try:
+            delay = self.process_input(read())
+        except SocketError:
+            LOG.debug('%s got a socket error, terminating connection.',
+                      self.__repr__())
+            self.online = False
+        except:
+            LOG.warning('%s got an exception!', self.__repr__())
+            LOG.warning(traceback.format_exc())
+            self.send('A serious error has occurred!')
+        self.flush()
+        return delay
+
+    def loop(self):
+        self.begin()
 
         while self.online:
             try:
                 lines = self.recv()
                 LOG.debug('%s command count = (%d)',
                         str(self.handler.client_address), len(lines))
-                for data in lines:
-                    LOG.debug('processing data')
-                    # handle command parsing here
-                    self.bad_count = 0
-                    cmd = data.strip()
-                    if cmd:
-                        LOG.debug('%s cmd: %s',
-                                  str(self.handler.client_address), 
-                                  cmd.__repr__(),
-                                 )
-                        self.rec_history(data)
-                    # send to queue
-                    a = self.body.process_cmd(cmd, sender=self)
-                    logging.debug('process_cmd returns: %s', a.__repr__())
-                    if isinstance(a, MudNotify):
-                        self.driver.Q(a)
-                    elif a == True:
-                        # it means this command was handled somewhere.
-                        pass
-                    elif data:
-                        # command not handled; notify user
-                        #self.send('%s not a valid command, please try again!' %
-                        #    cmd.__repr__())
-                        # rough code
-                        # XXX this is not really executed because
-                        # cmd_handler is None?
-                        if self.cmd_handler:
-                            # FIXME this is very very very hackish
-                            # optimized for Say ONLY
-                            self.driver.Q(
-                                self.cmd_handler(self.body, trail=data), 
-                                self,
-                            )
-                        else:
-                            self.send('Please try again!')
-                            self.prompt()
-                    else:
-                        # blank command, send prompt
-                        self.prompt()
+                delay = self.process_input(lines)
+                self.flush()
+                while delay is not None and self.online:
+                    # over the limit, leave the rest unread for now.
+                    time.sleep(delay)
+                    delay = self.process_input()
+                    self.flush()
 
             except SocketError:
                 # XXX handling different codes may be nice
@@ -792,6 +1991,7 @@ class Soul(MudObject):
                 LOG.warning('%s got an exception!', self.__repr__())
                 LOG.warning(traceback.format_exc())
                 self.send('A serious error has occurred!')
+                self.flush()
         LOG.debug('%s is offline, terminating connection.', str(self))
 
     def handle(self):
@@ -807,6 +2007,7 @@ class Soul(MudObject):
             LOG.error(traceback.format_exc())
             self.send('A critical error has occured!')
             self.send('You have been disconnected!')
+            self.flush()
 
     # support
     def process_cmd(self, *args, **kwargs):
@@ -819,8 +2020,7 @@ class Soul(MudObject):
 
     def prompt(self):
         if self.online:
-            self.request.send('\xff\xfd\x01')
-            self.request.send(STD_PROMPT)
+            self.write('\xff\xfd\x01' + STD_PROMPT)
 
     def greeting(self):
         LOG.debug('created soul %s', self)
@@ -836,7 +2036,9 @@ class Soul(MudObject):
     def quit(self):
         # XXX - the list cmd sending requires cmd param...
         self.send('Goodbye %s, see you soon.' % str(self.body.name))
-        self.online = False
+        self.flush(finish=True)
+        # also lets whatever is waiting on the connection know.
+        self.disconnect()
         return True
 
     def rec_history(self, cmd):
@@ -0,0 +1,208 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+import logging
+import threading
+import weakref
+from collections import deque
+
+LOG = logging.getLogger("mtj.mud.registry")
+
+
+class _Ref(weakref.ref):
+    """\
+    Weak reference that remembers what the object was registered as.
+    """
+
+    __slots__ = ('handle', 'types', 'name')
+
+
+class Registry(object):
+    """\
+    Keeps track of every object in the world.
+
+    Each registered object gets an integer handle, and can be looked up
+    by it, by its class (or any class it inherits from) and by its name
+    (the shortdesc, ignoring case).  Only weak references are kept, so
+    objects go away as if they were never registered; what is left of
+    them is cleaned up the next time the registry is used.
+
+    Objects must have a _handle attribute to hold their handle, and
+    call rename when their shortdesc changes.  MudObject does both; most
+    of them are only registered once their handle is asked for, see
+    MudObject._register.
+
+    As every object would be an instance of root, the objects are not
+    indexed by it (or the classes it inherits from).
+    """
+
+    def __init__(self, root=object):
+        self.root = root
+        self._lock = threading.RLock()
+        self._next = 1
+        # handle -> _Ref
+        self._refs = {}
+        # class -> set of handles, name -> set of handles
+        self._types = {}
+        self._names = {}
+        # handles of the objects that are gone.  These are collected
+        # by the weakref callbacks, which can run at any time, even in
+        # the middle of changing the indexes, so they leave the
+        # cleaning up to the next call.
+        self._dead = deque()
+
+    def __len__(self):
+        self._purge()
+        return len(self._refs)
+
+    def __contains__(self, obj):
+        return self.get(getattr(obj, '_handle', None)) is obj
+
+    def _gone(self, ref):
+        self._dead.append(ref.handle)
+
+    def _purge(self):
+        if not self._dead:
+            return
+        self._lock.acquire()
+        try:
+            while self._dead:
+                self._drop(self._dead.popleft())
+        finally:
+            self._lock.release()
+
+    def _drop(self, handle):
+        ref = self._refs.pop(handle, None)
+        if ref is None:
+            return
+        for cls in ref.types:
+            self._discard(self._types, cls, handle)
+        self._discard(self._names, ref.name, handle)
+
+    def _discard(self, index, key, handle):
+        handles = index.get(key)
+        if handles is not None:
+            handles.discard(handle)
+            if not handles:
+                del index[key]
+
+    def _indexed(self, cls):
+        """\
+        Returns the classes instances of cls are indexed by.
+        """
+        mro = cls.__mro__
+        if self.root in mro:
+            return mro[:mro.index(self.root)]
+        return mro[:-1]
+
+    def _key(self, name):
+        if name is None:
+            return None
+        return str(name).lower()
+
+    def register(self, obj):
+        """\
+        Registers obj, returns its handle.
+        """
+        self._purge()
+        self._lock.acquire()
+        try:
+            handle = getattr(obj, '_handle', None)
+            if handle is not None and handle in self._refs:
+                return handle
+            handle = self._next
+            self._next += 1
+            ref = _Ref(obj, self._gone)
+            ref.handle = handle
+            ref.types = self._indexed(type(obj))
+            ref.name = self._key(getattr(obj, 'shortdesc', None))
+            self._refs[handle] = ref
+            for cls in ref.types:
+                self._types.setdefault(cls, set()).add(handle)
+            self._names.setdefault(ref.name, set()).add(handle)
+            obj._handle = handle
+            return handle
+        finally:
+            self._lock.release()
+
+    def unregister(self, obj):
+        """\
+        Forgets obj, returns False if it was not registered.
+        """
+        self._purge()
+        self._lock.acquire()
+        try:
+            if self.get(obj._handle) is not obj:
+                return False
+            self._drop(obj._handle)
+            obj._handle = None
+            return True
+        finally:
+            self._lock.release()
+
+    def rename(self, obj, name):
+        """\
+        Moves obj to name in the index by name.
+        """
+        self._lock.acquire()
+        try:
+            ref = self._refs.get(getattr(obj, '_handle', None))
+            if ref is None or ref() is not obj:
+                return
+            name = self._key(name)
+            if name == ref.name:
+                return
+            self._discard(self._names, ref.name, ref.handle)
+            ref.name = name
+            self._names.setdefault(name, set()).add(ref.handle)
+        finally:
+            self._lock.release()
+
+    def get(self, handle):
+        """\
+        Returns the object with handle, or None if there is none.
+        """
+        ref = self._refs.get(handle)
+        if ref is None:
+            return None
+        return ref()
+
+    def _lookup(self, index, key):
+        self._purge()
+        self._lock.acquire()
+        try:
+            handles = list(index.get(key, ()))
+        finally:
+            self._lock.release()
+        result = []
+        for handle in handles:
+            obj = self.get(handle)
+            if obj is not None:
+                result.append(obj)
+        return result
+
+    def by_type(self, cls):
+        """\
+        Returns the objects that are instances of cls, as a list in no
+        particular order.
+        """
+        if cls in self.root.__mro__:
+            self._purge()
+            result = [ref() for ref in self._refs.values()]
+            return [i for i in result if i is not None and isinstance(i, cls)]
+        return self._lookup(self._types, cls)
+
+    def by_name(self, name, cls=None):
+        """\
+        Returns the objects called name, optionally only the instances
+        of cls.
+        """
+        result = self._lookup(self._names, self._key(name))
+        if cls is not None:
+            result = [i for i in result if isinstance(i, cls)]
+        return result
+
+
+# the registry of the world.
+registry = Registry()
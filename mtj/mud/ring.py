@@ -0,0 +1,192 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+import os
+import ctypes
+import errno
+import fcntl
+import math
+import mmap
+import select
+import struct
+
+from config import *
+
+# the header: where the producer is, where the consumer is and whether
+# the consumer was rung since it last looked, each on a cache line of
+# its own.
+_HEAD = 0
+_TAIL = 64
+_BELL = 128
+_DATA = 192
+# messages are prefixed by their length; this one means the rest of the
+# buffer is unused and the next message is at the start.
+_LENGTH = struct.Struct('<I')
+_WRAPPED = _LENGTH.pack(0xffffffff)
+
+
+class Ring(object):
+    """\
+    Ring buffer of messages in memory shared with a forked process,
+    with a single producer and a single consumer.
+
+    Messages are strings, copied into the ring as they are, behind
+    their length.  The producer only moves the head and the consumer
+    only the tail, so neither ever waits on a lock.
+
+    The consumer sleeps on fileno, which the producer makes readable
+    when it adds to the ring, though only the first time after the
+    consumer called clear; it has to call clear, then get until there
+    is nothing left, before sleeping again.  A message added just as
+    the consumer clears may not wake it, so it should not sleep without
+    a timeout.
+
+    Either side can be used from several threads if they take turns.
+    """
+
+    def __init__(self, size=GATEWAY_RING_SIZE):
+        if size & (size - 1):
+            raise ValueError('size must be a power of two')
+        self.size = size
+        self._mask = size - 1
+        # anonymous maps are shared with the processes forked after.
+        self._map = mmap.mmap(-1, _DATA + size)
+        # the header is read and written in place, which is a lot
+        # cheaper than going through struct.
+        self._head = ctypes.c_uint64.from_buffer(self._map, _HEAD)
+        self._tail = ctypes.c_uint64.from_buffer(self._map, _TAIL)
+        self._bell = ctypes.c_uint32.from_buffer(self._map, _BELL)
+        self._r, self._w = os.pipe()
+        for fd in (self._r, self._w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._poller = select.poll()
+        self._poller.register(self._r, select.POLLIN)
+
+    def __len__(self):
+        """\
+        The number of bytes in use.
+        """
+        return self._head.value - self._tail.value
+
+    def __nonzero__(self):
+        return self._head.value != self._tail.value
+
+    def fileno(self):
+        return self._r
+
+    def put(self, data):
+        """\
+        Adds data at the end, returns False if there is no room for it
+        right now.  Producer only.
+        """
+        size = self.size
+        need = 4 + len(data)
+        if need > size:
+            raise ValueError('message of %d bytes does not fit' % len(data))
+        head = self._head.value
+        free = size - (head - self._tail.value)
+        start = _DATA + (head & self._mask)
+        left = _DATA + size - start
+        if left < need:
+            # not enough before the end, it goes to the start.
+            if left + need > free:
+                return False
+            if left >= 4:
+                self._map[start:start + 4] = _WRAPPED
+            head += left
+            start = _DATA
+        elif need > free:
+            return False
+        m = self._map
+        m[start:start + 4] = _LENGTH.pack(len(data))
+        m[start + 4:start + need] = data
+        # only now the consumer can see it.
+        self._head.value = head + need
+        if not self._bell.value:
+            self.ring()
+        return True
+
+    def get(self):
+        """\
+        Removes and returns the first message, None if there is none.
+        Consumer only.
+        """
+        messages = self.drain(1)
+        if messages:
+            return messages[0]
+        return None
+
+    def drain(self, limit=None):
+        """\
+        Removes and returns the messages there are (up to limit), as a
+        list.  Consumer only.
+        """
+        m = self._map
+        end = _DATA + self.size
+        mask = self._mask
+        unpack = _LENGTH.unpack
+        head = self._head.value
+        tail = self._tail.value
+        result = []
+        while tail != head:
+            start = _DATA + (tail & mask)
+            prefix = m[start:start + 4]
+            if end - start < 4 or prefix == _WRAPPED:
+                tail += end - start
+                start = _DATA
+                prefix = m[start:start + 4]
+            length = unpack(prefix)[0]
+            result.append(m[start + 4:start + 4 + length])
+            tail += 4 + length
+            if len(result) == limit:
+                break
+        # the space is only given back now.
+        self._tail.value = tail
+        return result
+
+    def ring(self):
+        """\
+        Wakes up the consumer.
+        """
+        self._bell.value = 1
+        try:
+            os.write(self._w, 'x')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def clear(self):
+        """\
+        Resets the bell, before the consumer looks for messages.
+        """
+        self._bell.value = 0
+        try:
+            while os.read(self._r, 512):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def wait(self, timeout=None):
+        """\
+        Waits until rung or for timeout seconds, returns True if there
+        is something to get.
+        """
+        if not self:
+            if timeout is not None:
+                timeout = int(math.ceil(timeout * 1000))
+            try:
+                self._poller.poll(timeout)
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+        return bool(self)
+
+    def close(self):
+        # the views into the map must go first.
+        del self._head, self._tail, self._bell
+        self._map.close()
+        os.close(self._r)
+        os.close(self._w)
@@ -3,7 +3,7 @@
 # This software is released under the GPLv3
 
 import socket
-from collections import deque
+from functools import partial
 import logging
 import traceback
 import threading
@@ -14,6 +14,10 @@ from server import *
 from objects import *
 from actions import *
 from world import *
+from wakeup import Wakeup
+from timer import TimerWheel
+from flow import FairQueue, FlushQueue
+from journal import Journal
 
 LOG = logging.getLogger('mtj.mud.runner')
 
@@ -50,6 +54,13 @@ class MudRunner(MudObject):
         """
         pass
 
+    def _wake(self):
+        """\
+        Redefine to interrupt whatever _action may be waiting on, so a
+        stop does not have to wait for it.
+        """
+        pass
+
     def _run(self):
         while self._running:
             self._action()
@@ -82,6 +93,7 @@ class MudRunner(MudObject):
             raise
         # Join the thread
         self._running = False
+        self._wake()
         self.t.join(5)
         self.t.isAlive()
 
@@ -95,49 +107,126 @@ class MudServerController(MudRunner):
 
     An instance of this class will spawn a server on a separate thread
     that will listen on HOST:PORT once its start method is called.
+
+    With more than one listener, that many servers are bound to the
+    same address with SO_REUSEPORT, each served by its own thread.
     """
 
     listenAddr = property(lambda self: (self.host, self.port))
     driver = property(lambda self: self._parent)
 
-    def __init__(self, host, port, *args, **kwargs):
+    def __init__(self, host, port, mode=SERVER_MODE, listeners=LISTENERS,
+            reuse_port=False, soul_class=Soul, *args, **kwargs):
         """\
         Initializes the controller, set constants from config file, etc.
-        
-        Currently does nothing too important for now.
+
+        mode selects the kind of server to spawn, one of the keys in
+        SERVER_MODES ('event' or 'threaded').
+        listeners is the number of listening sockets.
+        reuse_port binds them with SO_REUSEPORT even if there is only
+        one, as other processes listen on the same address.
+        soul_class is what is created for each connection.
         """
         # parent is the driver
         MudRunner.__init__(self, *args, **kwargs)
         self.server = None
+        self.servers = []
+        self.listeners = listeners
+        self._threads = []
         self.chats = {}
         self.chats['global'] = ChatChannel()
         self.host = host
         self.port = port
+        self.mode = mode
+        self.reuse_port = reuse_port
+        self.soul_class = soul_class
+
+    def _set_mode(self, mode):
+        if mode not in SERVER_MODES:
+            raise ValueError('unknown server mode %s' % mode.__repr__())
+        self._mode = mode
+
+    mode = property(fget=lambda self: self._mode, fset=_set_mode)
+
+    @property
+    def souls(self):
+        """\
+        All souls connected through any of the servers.
+        """
+        result = []
+        for server in self.servers:
+            result.extend(server.souls)
+        return result
 
     def _begin(self):
         if self._running:
             LOG.warn('Server %s already started.' % self.server)
             return
+        server_class, handler_class = SERVER_MODES[self.mode]
+        reuse_port = self.reuse_port or self.listeners > 1
+        self.servers = []
+        self._threads = []
         try:
-            LOG.info('Starting server...')
-            self.server = ThreadingMudServer(
-                    self.listenAddr, MudRequestHandler, self)
-            LOG.info('Started server %s', self.server)
+            LOG.info('Starting %d %s server(s)...', self.listeners, self.mode)
+            for i in xrange(self.listeners):
+                addr = self.listenAddr
+                if self.servers:
+                    # in case the port was picked by the system
+                    addr = self.servers[0].server_address
+                self.servers.append(server_class(addr, handler_class, self,
+                                                 reuse_port=reuse_port))
         except socket.error:
-            LOG.warn('Failed to start server %s', self.server)
+            LOG.warn('Failed to start server on %s', self.listenAddr)
+            for server in self.servers:
+                server.server_close()
+                server.close_remaining()
+            self.servers = []
             raise
+        self.server = self.servers[0]
+        for server in self.servers[1:]:
+            t = threading.Thread(target=self._serve, args=(server,))
+            t.setDaemon(1)
+            t.start()
+            self._threads.append(t)
+        LOG.info('Started server(s) %s', self.servers)
+
+    def _serve(self, server):
+        """\
+        Serves the extra listeners.
+        """
+        while server.active:
+            server.handle_request()
+        server.close_remaining()
+
+    def _run(self):
+        try:
+            MudRunner._run(self)
+        finally:
+            # what a server has open is closed by the thread serving it.
+            self.server.close_remaining()
 
     def _action(self):
         self.server.handle_request()
 
     def _end(self):
-        if self.server and self._running:
+        if self.servers and self._running:
             # XXX - needed here, server_close could toss exception
-            LOG.info('Shutting down server %s.', self.server)
-            self.server.server_close()
+            for server in self.servers:
+                LOG.info('Shutting down server %s.', server)
+                server.server_close()
         else:
             LOG.debug('No running server to stop.')
 
+    def _wake(self):
+        for server in self.servers:
+            server.wakeup.set()
+
+    def stop(self):
+        MudRunner.stop(self)
+        for t in self._threads:
+            t.join(5)
+        self._threads = []
+
 
 class MudDriver(MudRunner):
     """\
@@ -147,20 +236,34 @@ class MudDriver(MudRunner):
     spawned by objects of the world should execute in.
     """
     nexthb = property(fget=lambda self: self.lasthb + self.hbdelay)
-    areas = property(fget=lambda self: self._children)
+    areas = property(fget=lambda self: self.children)
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, journal=JOURNAL, *args, **kwargs):
+        """\
+        journal is the file the commands run are recorded to, if any.
+        """
         # children are servers serving this world
         MudRunner.__init__(self, *args, **kwargs)
         self.starting = {}
-        self.cmdQ = deque()
+        # commands of each sender, see Q.
+        self.cmdQ = FairQueue()
+        # souls with output buffered during this tick
+        self.flushQ = FlushQueue()
         self.counter = 0
         self.time = 0
         self.lasthb = 0  # every timeout
+        # signalled when there is something for the driver to do
+        self._wakeup = Wakeup()
+        # what is scheduled to happen later, see schedule.
+        self.timers = TimerWheel()
+        self.journal = None
+        if journal:
+            self.journal = Journal(journal)
 
-        # XXX magic number here
-        self.timeout = 0.002  # seconds, default 2 millisecond
         self.hbdelay = 2  # seconds
+        # how much of cmdQ is done in a tick, see _commands.
+        self.tick_limit = CMD_TICK_LIMIT
+        self.tick_time = CMD_TICK_TIME
 
         self._build_world()
 
@@ -168,38 +271,105 @@ class MudDriver(MudRunner):
         pass
 
     def _action(self):
-        while self.cmdQ:
-            # nobody else is popping this list, so when this is true
-            # there must be an item to pop.  No false positives either
-            # as append is atomic.
-            cmd = self.cmdQ.popleft()
+        # reset before looking for work, so nothing queued after this
+        # point goes unnoticed.
+        self._wakeup.clear()
+        self._commands()
+        self.time = time.time()
+        self.timers.run(self.time)
+        self._tick()
+        self.counter += 1
+        # all done, sleep until there is something to do.
+        self._wakeup.wait(self._sleep_time())
+
+    def _commands(self):
+        """\
+        Runs the queued commands, only so many per tick so timers and
+        output are not held up by a flood of them; what is left waits
+        for the next tick.
+        """
+        deadline = time.time() + self.tick_time
+        count = 0
+        while self.cmdQ and count < self.tick_limit:
+            # nobody else is taking from the queue, so when this is
+            # true there must be an item to take.
+            cmd = self.cmdQ.get()
             # FIXME
             LOG.debug('cmdQ -> (%s)', cmd.__repr__())
-            try:
-                cmd()
-                # XXX prompt
-                if isinstance(cmd.sender, Soul):
-                    cmd.sender.prompt()
-            except:
-                LOG.warning(
-                    "command '%s' caused an exception", cmd.__repr__())
-                LOG.warning(traceback.format_exc())
-                if cmd.sender:
-                    cmd.sender.send('A serious error has occurred!')
-            # parse cmd
-        self.counter += 1
-        self.time = time.time()
+            self._execute(cmd)
+            count += 1
+            if time.time() >= deadline:
+                break
+
+    def _tick(self):
+        self._flush()
+        if self.journal is not None:
+            self.journal.flush()
         if self.time >= self.nexthb:
             self.lasthb = self.time
             LOG.log(1, 'heartbeat @ %f', self.lasthb)
-            # do checks and heartbeats here.
-        # all done, go sleep for a bit.
-        time.sleep(self.timeout)
+            # objects have their own heartbeats, see start_heartbeat.
+
+    def _execute(self, cmd):
+        if self.journal is not None:
+            self.journal.record(self.counter, cmd)
+        try:
+            cmd()
+            # XXX prompt
+            if isinstance(getattr(cmd, 'sender', None), Soul):
+                cmd.sender.prompt()
+        except:
+            LOG.warning(
+                "command '%s' caused an exception", cmd.__repr__())
+            LOG.warning(traceback.format_exc())
+            if getattr(cmd, 'sender', None):
+                cmd.sender.send('A serious error has occurred!')
+
+    def _sleep_time(self):
+        """\
+        How long the driver can sleep if nothing gets queued.
+        """
+        if self.cmdQ or self.flushQ:
+            # left over from this tick, or written to since.
+            return 0
+        wake = self.nexthb
+        next_run = self.timers.next_run()
+        if next_run is not None and next_run < wake:
+            wake = next_run
+        next_retry = self.flushQ.next_retry()
+        if next_retry is not None and next_retry < wake:
+            wake = next_retry
+        return max(0, wake - time.time())
+
+    def _wake(self):
+        self._wakeup.set()
 
     def _end(self):
         # save the world!
         pass
 
+    def start(self):
+        if self._wakeup.closed:
+            # stopped before.
+            self._wakeup = Wakeup()
+        MudRunner.start(self)
+
+    def stop(self):
+        MudRunner.stop(self)
+        self._wakeup.close()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def _flush(self):
+        """\
+        Sends out everything the souls got during this tick, in one
+        write per soul.  Souls whose connection could not take all of
+        it are tried again later (see FlushQueue), along with those that
+        are offline but still have something to say (see RemoteSoul).
+        """
+        self.flushQ.flush()
+
     def _build_world(self):
         # builds the world
         self.add(Foundation())
@@ -207,13 +377,49 @@ class MudDriver(MudRunner):
             'main': self._children[0]._children[0],
         }
 
+    def schedule(self, cmd, delay, interval=None):
+        """\
+        Runs cmd (a MudNotify or MudAction instance, or any callable)
+        in the driver after delay seconds, and every interval seconds
+        after that if given.  Returns the Timer, cancel it to stop it.
+
+        Must be called from the driver thread, as actions are.
+        """
+        return self.timers.schedule(partial(self._execute, cmd), delay, interval)
+
+    def start_heartbeat(self, obj, interval=None):
+        """\
+        Calls the heartbeat method of obj every interval seconds (the
+        heartbeat delay of the driver by default), until stopped.
+        """
+        self.stop_heartbeat(obj)
+        obj._hb = self.timers.schedule(obj.heartbeat,
+            interval or self.hbdelay, interval or self.hbdelay)
+        return obj._hb
+
+    def stop_heartbeat(self, obj):
+        """\
+        Stops the heartbeat of obj, returns False if it had none.
+        """
+        hb, obj._hb = obj._hb, None
+        return hb is not None and hb.cancel()
+
+    def flush_later(self, soul):
+        """\
+        Have the output buffered by soul sent at the end of this tick.
+        """
+        self.flushQ.append(soul)
+        self._wakeup.set()
+
     def Q(self, cmd, sender=None):
         """\
         Queue a command.  Commands are just strings.
+
+        Commands are queued per sender and taken in turns, so one
+        sender cannot hold up the others by sending a lot of them.
         """
         LOG.debug('cmdQ <- (%s, %s)', sender.__repr__(), cmd.__repr__())
         if sender:
             cmd.sender = sender
-        self.cmdQ.append(cmd)
-        # this is an atomic operation.
-
+        self.cmdQ.put(cmd, getattr(cmd, 'sender', None))
+        self._wakeup.set()
@@ -1,13 +1,24 @@
 import socket
+import select
+import errno
+import heapq
+import time
 from SocketServer import TCPServer, BaseRequestHandler
 import logging
 import threading
+from collections import deque
 
 from config import *
 from objects import *
+from wakeup import Wakeup
 
 LOG = logging.getLogger('mtj.mud.server')
 
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', None)
+# errors from accept that just mean nothing (more) is pending
+ACCEPT_RETRY = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR,
+                errno.ECONNABORTED, errno.EPROTO)
+
 class MudConnThread:
     """Based on ThreadingMixIn of the SocketServer module.
     """
@@ -35,36 +46,118 @@ class MudConnThread:
         t.start()
 
 
-class ThreadingMudServer(MudConnThread, TCPServer):
-    """Standard ThreadingTCPServer, extended to allow customization.
+class MudListener:
+    """\
+    Readiness based accept, for the servers below.
+
+    The listening socket is non-blocking.  Once it is readable, pending
+    connections are accepted in batches of up to accept_batch until
+    the backlog is empty, instead of one per wakeup.  The wakeup is
+    part of what the server waits on so closing it is immediate.
+
+    With reuse_port, the socket is bound with SO_REUSEPORT so several
+    servers can listen on the same address and have the kernel spread
+    the incoming connections across them.
     """
+
     allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+    accept_batch = ACCEPT_BATCH
 
-    def __init__(self, server_address, RequestHandlerClass, controller):
+    def server_bind(self):
+        if self.reuse_port:
+            if SO_REUSEPORT is None:
+                raise socket.error('SO_REUSEPORT not supported')
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        TCPServer.server_bind(self)
+
+    def _accept_ready(self):
+        """\
+        Accepts the pending connections.  Returns the number accepted.
+        """
+        count = 0
+        while count < self.accept_batch:
+            try:
+                request, client_address = self.socket.accept()
+            except socket.error, e:
+                if e.args[0] not in ACCEPT_RETRY:
+                    LOG.warning('%s cannot accept: %s', self, e)
+                break
+            count += 1
+            # accepted sockets are left blocking, sends to souls use
+            # MSG_DONTWAIT anyway.
+            request.setblocking(1)
+            # output is already coalesced into one send per tick, so
+            # Nagle would only hold back the next one behind a delayed
+            # ack.
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if not self.verify_request(request, client_address):
+                self.shutdown_request(request)
+                continue
+            try:
+                self.process_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+                self.shutdown_request(request)
+        if count:
+            LOG.debug('%s accepted %d connection(s)', self, count)
+        return count
+
+
+class ThreadingMudServer(MudConnThread, MudListener, TCPServer):
+    """Standard ThreadingTCPServer, extended to allow customization.
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, controller,
+            reuse_port=False):
         """Constructor.  May be extended, do not override."""
+        self.reuse_port = reuse_port
         TCPServer.__init__(self, server_address, RequestHandlerClass)
         # XXX - controller = MudMaster?
         self.controller = controller
         self.active = True
-        self.souls = []
+        self.souls = set()
         self.greeting_msg = GREETING
+        self.socket.setblocking(0)
+        self.wakeup = Wakeup()
+        self._poller = select.poll()
+        self._poller.register(self.socket.fileno(), select.POLLIN)
+        self._poller.register(self.wakeup.fileno(), select.POLLIN)
 
-    def get_request(self):
-        """Get the request and client address from the socket.
-
-        Don't want to be stuck listening forever.
-
+    def handle_request(self):
+        """\
+        Waits until there are connections to accept, then accepts them.
         """
-
-        self.socket.settimeout(LISTEN_TIMEOUT)
-        return self.socket.accept()
+        if not self.active:
+            return
+        try:
+            events = self._poller.poll()
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        self.wakeup.clear()
+        if self.active and events:
+            self._accept_ready()
 
     def server_close(self):
-        TCPServer.server_close(self)
+        """\
+        Stops serving; the connection threads see their souls quit.
+        """
         self.active = False
-        for soul in self.souls:
-            soul.send('Server shutting down.')
-            soul.quit()
+        self.wakeup.set()
+        msg = Frame('Server shutting down.')
+        for soul in list(self.souls):
+            if soul.online:
+                soul.send(msg)
+                soul.quit()
+
+    def close_remaining(self):
+        """\
+        Closes the listening socket, once nothing waits on it anymore.
+        """
+        TCPServer.server_close(self)
+        self.wakeup.close()
 
 
 class MudRequestHandler(BaseRequestHandler):
@@ -75,18 +168,268 @@ class MudRequestHandler(BaseRequestHandler):
     """
     def setup(self):
         LOG.debug('%s connected', str(self.client_address))
-        soul = Soul(self)
+        soul = self.server.controller.soul_class(self)
         self.soul = soul
-        self.server.souls.append(soul)
+        self.server.souls.add(soul)
 
     def handle(self):
         if self.server.active:
             self.soul.handle()
 
     def finish(self):
-        soul = self.soul
-        if soul in self.server.souls:
-            # bye
-            self.server.souls.remove(soul)
+        # bye
+        self.server.souls.discard(self.soul)
+        self.soul.closed()
+        LOG.debug('%s disconnecting', str(self.client_address))
+
+
+
+class EventMudServer(MudListener, TCPServer):
+    """\
+    Single threaded, event driven server.
+
+    Instead of spawning a thread for every connection, all sockets
+    (including the listening one) are multiplexed with poll, and the
+    data that arrives is fed into the souls as it becomes available.
+    """
+
+    _read_events = select.POLLIN | select.POLLPRI | select.POLLHUP | \
+            select.POLLERR | select.POLLNVAL
+
+    def __init__(self, server_address, RequestHandlerClass, controller,
+            reuse_port=False):
+        """Constructor.  May be extended, do not override."""
+        self.reuse_port = reuse_port
+        TCPServer.__init__(self, server_address, RequestHandlerClass)
+        self.controller = controller
+        self.active = True
+        self.souls = set()
+        self.greeting_msg = GREETING
+        # fileno -> connection, only touched by the thread serving.
+        self.connections = {}
+        # connections waiting to be able to write
+        self._want_write = deque()
+        self._writing = set()
+        # connections not read as they are over their input limit, as
+        # fileno -> when to resume, with a heap of (when, fileno).
+        self._throttled = {}
+        self._resume = []
+        self.socket.setblocking(0)
+        self._listen_fd = self.socket.fileno()
+        self.wakeup = Wakeup()
+        self._poller = select.poll()
+        self._poller.register(self._listen_fd, select.POLLIN)
+        self._poller.register(self.wakeup.fileno(), select.POLLIN)
+
+    def handle_request(self):
+        """\
+        Waits for activity on the listening socket or the connections,
+        then processes it.  Connections of souls that went offline are
+        closed as soon as their socket shows it, see _reap.
+        """
+        if not self.active:
+            return
+        want_write = self._want_write
+        while want_write:
+            fd = want_write.popleft()
+            if fd in self.connections and fd not in self._writing:
+                self._writing.add(fd)
+                self._update(fd)
+        timeout = LISTEN_TIMEOUT
+        if self._resume:
+            timeout = min(timeout, max(0, self._resume[0][0] - time.time()))
+        try:
+            events = self._poller.poll(int(timeout * 1000 + 0.999))
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        self.wakeup.clear()
+        if not self.active:
+            # closed while waiting.
+            return
+        # the connections something happened to.
+        touched = []
+        for fd, event in events:
+            if fd == self._listen_fd:
+                self._accept_ready()
+                continue
+            conn = self.connections.get(fd)
+            if conn is None:
+                continue
+            touched.append(fd)
+            if event & select.POLLOUT and conn.soul.flush():
+                self._writing.discard(fd)
+                self._update(fd)
+            if not event & self._read_events:
+                continue
+            if fd in self._throttled:
+                if event & (select.POLLHUP | select.POLLERR):
+                    # gone while it was not being read.
+                    conn.soul.online = False
+                continue
+            self._handle(fd, conn, conn.handle_read)
+        touched.extend(self._resume_due())
+        self._reap(touched)
+
+    def _handle(self, fd, conn, method):
+        """\
+        Calls the read or resume method of conn, and stops or starts
+        reading from it depending on whether it is over its input limit.
+        """
+        try:
+            delay = method()
+        except:
+            self.handle_error(conn.request, conn.client_address)
+            conn.soul.online = False
+            return
+        if delay is None:
+            if self._throttled.pop(fd, None) is not None:
+                self._update(fd)
+            return
+        when = time.time() + delay
+        if fd not in self._throttled:
+            self._throttled[fd] = when
+            self._update(fd)
+        self._throttled[fd] = when
+        heapq.heappush(self._resume, (when, fd))
+
+    def _resume_due(self):
+        """\
+        Lets the throttled connections that are due process some more,
+        returns their filenos.
+        """
+        resume = self._resume
+        now = time.time()
+        resumed = []
+        while resume and resume[0][0] <= now:
+            when, fd = heapq.heappop(resume)
+            if self._throttled.get(fd) != when:
+                # stale
+                continue
+            conn = self.connections[fd]
+            self._handle(fd, conn, conn.resume)
+            resumed.append(fd)
+        return resumed
+
+    def _update(self, fd):
+        """\
+        Sets what to poll fd for.
+        """
+        mask = 0
+        if fd not in self._throttled:
+            mask |= select.POLLIN
+        if fd in self._writing:
+            mask |= select.POLLOUT
+        self._poller.modify(fd, mask)
+
+    def process_request(self, request, client_address):
+        conn = self.RequestHandlerClass(request, client_address, self)
+        fd = request.fileno()
+        self.connections[fd] = conn
+        self._poller.register(fd, select.POLLIN)
+
+    def _reap(self, fds):
+        """\
+        Closes the connections among fds whose souls went offline.
+
+        A soul goes offline either while its connection is handled
+        here, or through disconnect, which shuts the socket down so the
+        next poll reports it; so only the connections something
+        happened to need looking at.
+        """
+        connections = self.connections
+        for fd in fds:
+            conn = connections.get(fd)
+            if conn is not None and not conn.soul.online:
+                self._close_connection(fd)
+
+    def _close_connection(self, fd):
+        conn = self.connections.pop(fd, None)
+        if conn is None:
+            # already closed.
+            return
+        self._writing.discard(fd)
+        self._throttled.pop(fd, None)
+        try:
+            self._poller.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conn.finish()
+        finally:
+            self.shutdown_request(conn.request)
+
+    def server_close(self):
+        """\
+        Stops serving.  Only the thread serving touches the
+        connections, it closes them with close_remaining once done.
+        """
+        self.active = False
+        self.wakeup.set()
+
+    def close_remaining(self):
+        """\
+        Says goodbye to the souls still online and closes everything
+        the server has open.  Called by the thread that served it, after
+        it stopped.
+        """
+        TCPServer.server_close(self)
+        msg = Frame('Server shutting down.')
+        for soul in list(self.souls):
+            if soul.online:
+                soul.send(msg)
+                soul.quit()
+        for fd in self.connections.keys():
+            self._close_connection(fd)
+        self.wakeup.close()
+
+
+class MudConnection(object):
+    """\
+    Connection handler for the event driven server.
+
+    Offers the same attributes as MudRequestHandler so a soul can be
+    attached to it, but rather than having the soul block in its loop
+    the server feeds it whatever data it has read.
+    """
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def setup(self):
+        LOG.debug('%s connected', str(self.client_address))
+        soul = self.server.controller.soul_class(self)
+        self.soul = soul
+        self.server.souls.add(soul)
+        soul.begin()
+
+    def handle_read(self):
+        # the socket is readable, so this will not block.
+        return self.soul.receive()
+
+    def resume(self):
+        return self.soul.resume()
+
+    def want_write(self):
+        """\
+        The soul has more to send than the socket could take.
+        """
+        self.server._want_write.append(self.request.fileno())
+        self.server.wakeup.set()
+
+    def finish(self):
+        # bye
+        self.server.souls.discard(self.soul)
+        self.soul.closed()
         LOG.debug('%s disconnecting', str(self.client_address))
 
+
+# the available server modes, as (server class, request handler class)
+SERVER_MODES = {
+    'threaded': (ThreadingMudServer, MudRequestHandler),
+    'event': (EventMudServer, MudConnection),
+}
@@ -0,0 +1,247 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+import re
+import zlib
+import logging
+
+from config import *
+
+LOG = logging.getLogger("mtj.mud.telnet")
+
+# telnet commands (RFC 854)
+IAC = '\xff'
+DONT = '\xfe'
+DO = '\xfd'
+WONT = '\xfc'
+WILL = '\xfb'
+SB = '\xfa'
+GA = '\xf9'
+EL = '\xf8'
+EC = '\xf7'
+AYT = '\xf6'
+AO = '\xf5'
+IP = '\xf4'
+BRK = '\xf3'
+DM = '\xf2'
+NOP = '\xf1'
+SE = '\xf0'
+
+# telnet options
+ECHO = '\x01'
+TM = '\x06'  # timing mark
+COMPRESS2 = '\x56'  # MCCP v2
+
+CR = '\r'
+LF = '\n'
+
+# around every message sent, turning echo off and on again.
+_FRAME_START = IAC + WILL + ECHO
+_FRAME_END = IAC + WONT + ECHO
+
+# every byte that is not printable ascii gets dropped from the lines.
+_UNPRINTABLE = ''.join([chr(i) for i in range(256) if not 32 <= i <= 126])
+
+# the bytes the parser has to stop at while in the data state.
+_DATA_STOP = re.compile('[\xff\r\n]')
+
+# parser states
+_DATA, _IAC, _OPT, _SUB, _SUB_IAC = range(5)
+
+
+def frame(msg, newline=True):
+    """\
+    Returns the data that goes down the wire for the message msg.
+    """
+    data = '%s%s' % (_FRAME_START, msg)
+    # don't send dup newlines
+    if newline and data[-2:] != '\r\n':
+        data += '\r\n'
+    return data + _FRAME_END
+
+
+class Frame(object):
+    """\
+    A message that is framed once and can then be sent to any number
+    of connections, which all queue the very same data.  Used when the
+    same message goes to everyone in a room.
+    """
+
+    __slots__ = ('msg', 'data')
+
+    def __init__(self, msg, newline=True):
+        self.msg = msg
+        self.data = frame(msg, newline)
+
+    def __str__(self):
+        return str(self.msg)
+
+    def __repr__(self):
+        return '<Frame %s>' % self.msg.__repr__()
+
+
+class TelnetParser(object):
+    """\
+    Incremental telnet protocol parser.
+
+    Data is fed in chunks as it arrives from the connection; state is
+    carried across chunks so command sequences split between reads are
+    handled correctly.  Plain text is scanned in bulk for the next IAC
+    or line terminator rather than one character at a time.
+
+    Negotiations are reported to the handler, which should provide
+    these methods:
+
+    telnet_negotiate(cmd, opt) - for WILL, WONT, DO and DONT.
+    telnet_command(cmd) - for all other two byte commands.
+    telnet_subneg(opt, data) - for completed SB ... SE sequences.
+    """
+
+    def __init__(self, handler=None, max_line=MAX_CMD_LEN):
+        """\
+        Parameters:
+        handler - the object that gets notified of telnet commands.
+        max_line - lines longer than this are truncated.
+        """
+        self.handler = handler
+        self.max_line = max_line
+        self.state = _DATA
+        # number of lines that got truncated.
+        self.overflow = 0
+        self._line = bytearray()
+        self._truncated = False
+        self._cmd = None
+        self._sub = bytearray()
+
+    def feed(self, data, length=None):
+        """\
+        Parses data (a str or a bytearray), optionally only up to
+        length, and returns the list of lines completed by it.
+        """
+        if length is None:
+            length = len(data)
+        lines = []
+        i = 0
+        while i < length:
+            state = self.state
+            if state == _DATA:
+                m = _DATA_STOP.search(data, i, length)
+                if m is None:
+                    self._append(data[i:length])
+                    break
+                j = m.start()
+                if j > i:
+                    self._append(data[i:j])
+                c = chr(data[j]) if type(data) is bytearray else data[j]
+                if c == IAC:
+                    self.state = _IAC
+                elif c == CR or self._line:
+                    # CR always completes a line, while LF only does so
+                    # if there is something on it so CRLF is one line.
+                    lines.append(str(self._line))
+                    del self._line[:]
+                    self._truncated = False
+                i = j + 1
+                continue
+
+            c = chr(data[i]) if type(data) is bytearray else data[i]
+            i += 1
+            if state == _IAC:
+                self.state = _DATA
+                if c in (WILL, WONT, DO, DONT):
+                    self._cmd = c
+                    self.state = _OPT
+                elif c == SB:
+                    del self._sub[:]
+                    self.state = _SUB
+                elif c == EC:
+                    if self._line:
+                        del self._line[-1]
+                elif c == EL:
+                    del self._line[:]
+                elif c != IAC:
+                    # an escaped IAC would not be printable anyway
+                    self._command(c)
+            elif state == _OPT:
+                self.state = _DATA
+                self._negotiate(self._cmd, c)
+            elif state == _SUB:
+                j = data.find(IAC, i - 1, length)
+                if j == -1:
+                    j = length
+                if len(self._sub) < self.max_line:
+                    self._sub.extend(data[i - 1:j])
+                if j < length:
+                    self.state = _SUB_IAC
+                i = j + 1
+            elif state == _SUB_IAC:
+                if c == IAC:
+                    self._sub.append(IAC)
+                    self.state = _SUB
+                else:
+                    # SE, or a protocol error which also ends it.
+                    self.state = _DATA
+                    self._subneg(str(self._sub))
+        return lines
+
+    def _append(self, chunk):
+        chunk = chunk.translate(None, _UNPRINTABLE)
+        room = self.max_line - len(self._line)
+        if len(chunk) > room:
+            chunk = chunk[:room]
+            if not self._truncated:
+                self._truncated = True
+                self.overflow += 1
+                LOG.debug('line too long, truncated to %d', self.max_line)
+        self._line.extend(chunk)
+
+    def _negotiate(self, cmd, opt):
+        LOG.debug('telnet negotiate %s %s', cmd.__repr__(), opt.__repr__())
+        if self.handler:
+            self.handler.telnet_negotiate(cmd, opt)
+
+    def _command(self, cmd):
+        LOG.debug('telnet command %s', cmd.__repr__())
+        if self.handler:
+            self.handler.telnet_command(cmd)
+
+    def _subneg(self, data):
+        LOG.debug('telnet subnegotiation %s', data.__repr__())
+        if self.handler and data:
+            self.handler.telnet_subneg(data[0], data[1:])
+
+
+class MCCPStream(object):
+    """\
+    The outgoing half of MCCP v2 (option COMPRESS2).
+
+    Once the client agreed with IAC DO COMPRESS2, the start sequence is
+    sent and everything after it goes through one zlib stream that is
+    kept for the life of the connection.
+    """
+
+    start = IAC + SB + COMPRESS2 + IAC + SE
+
+    def __init__(self, level=MCCP_LEVEL):
+        self._z = zlib.compressobj(level)
+        # statistics
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, data):
+        """\
+        Compresses data, flushed so the client can decode all of it.
+        """
+        result = self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_in += len(data)
+        self.bytes_out += len(result)
+        return result
+
+    def finish(self):
+        """\
+        Ends the stream, nothing can be compressed after this.
+        """
+        result = self._z.flush(zlib.Z_FINISH)
+        self.bytes_out += len(result)
+        return result
@@ -0,0 +1,45 @@
+import unittest
+
+from mtj.mud.container import *
+
+
+class OrderedSetTestCase(unittest.TestCase):
+    def test_order(self):
+        s = OrderedSet('abc')
+        self.assertFalse(s.add('a'))
+        self.assertTrue(s.add('d'))
+        self.assertEqual(list(s), ['a', 'b', 'c', 'd'])
+        s.remove('b')
+        s.add('b')
+        self.assertEqual(list(s), ['a', 'c', 'd', 'b'])
+        self.assertEqual(sorted('bda', key=s.key), ['a', 'd', 'b'])
+        self.assertEqual(s[1], 'c')
+        self.assertEqual(len(s), 4)
+
+    def test_remove(self):
+        s = OrderedSet(range(100))
+        self.assertRaises(KeyError, s.remove, 100)
+        s.discard(100)
+        for i in range(0, 100, 3):
+            s.remove(i)
+        self.assertFalse(0 in s)
+        self.assertTrue(1 in s)
+        self.assertEqual(list(s), [i for i in range(100) if i % 3])
+        # removing while going through it is fine
+        for i in s:
+            s.remove(i)
+        self.assertEqual(list(s), [])
+        self.assertEqual(len(s), 0)
+
+    def test_view(self):
+        s = OrderedSet('ab')
+        v = s.view()
+        s.add('c')
+        self.assertEqual(list(v), ['a', 'b', 'c'])
+        self.assertTrue('c' in v)
+        self.assertEqual(len(v), 3)
+        self.assertFalse(hasattr(v, 'add'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+from mtj.mud.factory import *
+
+
+class Potion(MudObject):
+    def __init__(self, *args, **kwargs):
+        MudObject.__init__(self, shortdesc='potion', *args, **kwargs)
+        self.add_id('flask')
+        self.attributes['heal'] = 10
+
+
+class FactoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.factory = Factory()
+        self.room = MudRoom()
+        self.player = MudPlayer(name='tester')
+        self.room.add(self.player)
+
+    def test_registry(self):
+        f = self.factory
+        potion = f(Potion)
+        self.assertTrue(f(Potion) is potion)
+        self.assertTrue(potion.shared)
+        self.assertEqual(potion.parent, None)
+        sword = f.register('sword', MudObject, shortdesc='sword')
+        self.assertTrue(f['sword'] is sword)
+        self.assertRaises(KeyError, f.register, 'sword', MudObject)
+        self.assertRaises(KeyError, f, 'shield')
+        self.assertEqual(len(f), 2)
+
+    def test_counted(self):
+        potion = self.factory(Potion)
+        for i in range(3):
+            self.assertTrue(self.room.add(potion))
+        self.assertEqual(self.room.count(potion), 3)
+        self.assertEqual(len(self.room.children), 2)
+        self.assertTrue(self.room.find('flask') is potion)
+        self.assertTrue(self.room.move_obj_to(potion, self.player))
+        self.assertEqual(self.room.count(potion), 2)
+        self.assertEqual(self.player.count(potion), 1)
+        self.assertTrue(self.player.remove(potion))
+        self.assertFalse(self.player.remove(potion))
+        self.assertEqual(self.player.find('potion'), None)
+        look = self.player.process_cmd('look')
+        look.setResponse()
+        self.assertTrue(' potion (2)\r\n' in look.callerMsg)
+
+    def test_frozen(self):
+        potion = self.factory(Potion)
+        self.assertRaises(TypeError, setattr, potion, 'shortdesc', 'x')
+        self.assertRaises(TypeError, potion.add_id, 'bottle')
+        self.assertRaises(TypeError, potion.add, MudObject())
+        self.assertRaises(ValueError, self.player.share)
+        self.assertRaises(TypeError, setattr, potion, 'longdesc', 'x')
+        self.assertRaises(TypeError, potion.attributes.__setitem__, 'heal', 0)
+        self.assertRaises(TypeError, potion.attributes.update, heal=0)
+        self.assertRaises(TypeError, setattr, potion, 'attributes', {})
+        self.assertRaises(TypeError, potion.tag.append, 'cursed')
+        self.assertRaises(TypeError, setattr, potion, 'tag', [])
+        self.assertRaises(TypeError, setattr, potion, '_cmds', {})
+        self.assertEqual(potion.attributes, {'heal': 10})
+        self.assertEqual(potion.tag, [])
+        self.assertEqual(potion.longdesc, None)
+
+    def test_move(self):
+        potion = self.factory(Potion)
+        self.room.add(potion)
+        self.assertRaises(TypeError, potion.move_to, self.player)
+        self.assertEqual(self.room.count(potion), 1)
+        self.assertTrue(self.room.move_obj_to(potion, self.player))
+        self.assertEqual(self.player.count(potion), 1)
+        # not shared
+        sword = MudObject(shortdesc='sword')
+        self.assertTrue(sword.move_to(self.room))
+        self.assertTrue(sword.move_to(self.player))
+        self.assertTrue(sword.parent is self.player)
+        self.assertFalse(sword in self.room.children)
+
+    def test_promote(self):
+        potion = self.factory(Potion)
+        self.room.add(potion)
+        self.room.add(potion)
+        mine = self.room.promote(potion)
+        self.assertFalse(mine is potion)
+        self.assertFalse(mine.shared)
+        self.assertTrue(mine.parent is self.room)
+        self.assertEqual(self.room.count(potion), 1)
+        mine.shortdesc = 'empty potion'
+        mine.attributes['heal'] = 0
+        mine.tag.append('empty')
+        mine.longdesc = 'It is empty.'
+        mine.add_id('bottle')
+        self.assertEqual(potion.shortdesc, 'potion')
+        self.assertEqual(potion.attributes['heal'], 10)
+        self.assertEqual(potion.id, ['potion', 'flask'])
+        self.assertTrue(self.room.find('2.flask') is mine)
+        self.assertTrue(self.room.promote(mine) is mine)
+        self.assertEqual(self.player.promote(potion), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
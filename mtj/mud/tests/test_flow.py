@@ -0,0 +1,219 @@
+import unittest
+import zlib
+
+from mtj.mud.flow import *
+from mtj.mud.objects import Soul
+from mtj.mud.telnet import *
+
+
+class Connection(object):
+    """\
+    Stands in for the socket, the handler, the server and the driver of
+    a soul.  Takes at most limit bytes per send.
+    """
+
+    def __init__(self):
+        self.request = self
+        self.server = self
+        self.controller = self
+        self.driver = self
+        self.limit = None
+        self.data = ''
+        self.flushQ = []
+
+    def send(self, data, flags=0):
+        data = str(data)[:self.limit]
+        self.data += data
+        return len(data)
+
+    def flush_later(self, soul):
+        self.flushQ.append(soul)
+
+
+class OutputQueueTestCase(unittest.TestCase):
+    def test_take(self):
+        q = OutputQueue(max_bytes=100, max_msgs=10)
+        q.put('abc')
+        q.put('def')
+        self.assertEqual((len(q), q.bytes), (2, 6))
+        self.assertEqual(q.take(), 'abcdef')
+        self.assertEqual((len(q), q.bytes), (0, 0))
+
+    def test_drop_oldest(self):
+        q = OutputQueue(max_bytes=10, max_msgs=3, policy='drop_oldest')
+        for m in ('aaaa', 'bbbb', 'cccc', 'dd'):
+            self.assertTrue(q.put(m))
+        self.assertEqual(q.take(), 'bbbbccccdd')
+        self.assertEqual((q.overflows, q.dropped, q.dropped_bytes), (1, 1, 4))
+        for m in ('a', 'b', 'c', 'd'):
+            q.put(m)
+        self.assertEqual(q.take(), 'bcd')
+
+    def test_oversized(self):
+        q = OutputQueue(max_bytes=4, max_msgs=3, policy='drop_oldest')
+        q.put('ab')
+        q.put('0123456789')
+        self.assertEqual(q.take(), '0123456789')
+
+    def test_summarize(self):
+        notice = lambda count, size: '<%d,%d>' % (count, size)
+        q = OutputQueue(max_bytes=100, max_msgs=3, policy='summarize',
+                        notice=notice)
+        for m in ('a', 'bb', 'c', 'd'):
+            q.put(m)
+        self.assertEqual(q.take(), '<3,4>d')
+        for m in ('a', 'b', 'c', 'd', 'e', 'f'):
+            q.put(m)
+        # the previous notice is folded into the new one
+        self.assertEqual(q.take(), '<5,5>f')
+        self.assertEqual(q.dropped, 8)
+
+    def test_disconnect(self):
+        q = OutputQueue(max_bytes=100, max_msgs=2, policy='disconnect')
+        self.assertTrue(q.put('a'))
+        self.assertTrue(q.put('b'))
+        self.assertFalse(q.put('c'))
+        self.assertEqual(q.take(), 'ab')
+
+    def test_bad_policy(self):
+        self.assertRaises(ValueError, OutputQueue, policy='ignore')
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_burst(self):
+        b = TokenBucket(rate=2, burst=3)
+        now = b.stamp
+        for i in range(3):
+            self.assertTrue(b.take(now))
+        self.assertFalse(b.take(now))
+        self.assertEqual(b.delay(now), 0.5)
+        self.assertTrue(b.take(now + 0.5))
+        self.assertFalse(b.full(now + 1))
+        self.assertTrue(b.full(now + 2))
+        # never more than the burst
+        self.assertTrue(b.full(now + 60))
+        self.assertEqual(b.tokens, 3)
+
+
+class FairQueueTestCase(unittest.TestCase):
+    def test_turns(self):
+        q = FairQueue()
+        for i in range(5):
+            q.put('flood%d' % i, 'flooder')
+        q.put('look', 'player')
+        q.put('say hi', 'player')
+        q.put('tick')
+        self.assertEqual(len(q), 8)
+        self.assertEqual(q.senders, 3)
+        taken = [q.get() for i in range(4)]
+        self.assertEqual(taken, ['flood0', 'look', 'tick', 'flood1'])
+        self.assertEqual(q.get(), 'say hi')
+        self.assertEqual(q.senders, 1)
+        self.assertEqual([q.get() for i in range(3)],
+                         ['flood2', 'flood3', 'flood4'])
+        self.assertFalse(q)
+        self.assertEqual(q.senders, 0)
+        self.assertRaises(IndexError, q.get)
+
+
+class SoulFlushTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = Connection()
+        self.soul = Soul(self.conn)
+        self.soul.online = True
+
+    def test_short_write(self):
+        conn, soul = self.conn, self.soul
+        soul.write('0123456789')
+        self.assertEqual(conn.flushQ, [soul])
+        conn.limit = 4
+        self.assertFalse(soul.flush())
+        soul.write('ABC')
+        conn.limit = None
+        # the rest of the first write, and what came after it.
+        self.assertTrue(soul.flush())
+        self.assertEqual(conn.data, '0123456789ABC')
+        soul.write('DEF')
+        self.assertEqual(conn.flushQ, [soul, soul])
+
+    def test_mccp(self):
+        conn, soul = self.conn, self.soul
+        soul.write('plain ')
+        soul.flush()
+        soul.telnet_negotiate(DO, COMPRESS2)
+        soul.write('x' * 1000)
+        conn.limit = 10
+        self.assertFalse(soul.flush())
+        soul.write('bye')
+        # ended behind what is still pending
+        self.assertFalse(soul.flush(finish=True))
+        conn.limit = None
+        self.assertTrue(soul.flush())
+        self.assertEqual(soul.mccp, None)
+        plain, compressed = conn.data.split(MCCPStream.start)
+        self.assertEqual(plain, 'plain ')
+        self.assertEqual(zlib.decompress(compressed), 'x' * 1000 + 'bye')
+
+    def test_mccp_refused(self):
+        conn, soul = self.conn, self.soul
+        soul.telnet_negotiate(DO, COMPRESS2)
+        soul.telnet_negotiate(DONT, COMPRESS2)
+        self.assertEqual(soul.mccp, None)
+        soul.telnet_negotiate(DO, COMPRESS2)
+        soul.write('packed')
+        soul.flush()
+        del conn.flushQ[:]
+        soul.telnet_negotiate(WONT, COMPRESS2)
+        # the end of the stream has to be sent
+        self.assertEqual(conn.flushQ, [soul])
+        soul.write('plain')
+        self.assertTrue(soul.flush())
+        d = zlib.decompressobj()
+        compressed = conn.data.split(MCCPStream.start)[1]
+        self.assertEqual(d.decompress(compressed), 'packed')
+        self.assertEqual(d.unused_data, 'plain')
+
+
+class FlushQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = Connection()
+        self.soul = Soul(self.conn)
+        self.soul.online = True
+        self.q = FlushQueue(retry=1, retry_max=4)
+
+    def test_backoff(self):
+        conn, soul, q = self.conn, self.soul, self.q
+        conn.limit = 0
+        soul.write('abc')
+        q.append(soul)
+        q.flush(now=0)
+        self.assertEqual((len(q), q.stalled), (0, 1))
+        self.assertEqual(q.next_retry(), 1)
+        q.flush(now=0.5)
+        self.assertEqual(q.next_retry(), 1)
+        # twice as long every time, up to retry_max
+        for now, next_retry in ((1, 3), (3, 7), (7, 11), (11, 15)):
+            q.flush(now=now)
+            self.assertEqual(q.next_retry(), next_retry)
+        # added again in between, tried then and not twice later.
+        q.append(soul)
+        q.flush(now=12)
+        self.assertEqual(q.next_retry(), 16)
+        conn.limit = None
+        q.flush(now=16)
+        self.assertEqual(conn.data, 'abc')
+        self.assertEqual((q.stalled, q.next_retry()), (0, None))
+
+    def test_want_write(self):
+        conn, soul, q = self.conn, self.soul, self.q
+        conn.want_write = lambda: None
+        conn.limit = 0
+        soul.write('abc')
+        q.append(soul)
+        q.flush(now=0)
+        # up to the server.
+        self.assertEqual((q.stalled, q.next_retry()), (0, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
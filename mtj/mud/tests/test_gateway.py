@@ -0,0 +1,193 @@
+import os
+import unittest
+
+from mtj.mud.gateway import *
+from mtj.mud.runner import MudDriver
+
+
+class RingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ring = Ring(64)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_order(self):
+        r = self.ring
+        self.assertEqual(r.get(), None)
+        for data in ('a', '', 'hello', '\x00\xff'):
+            self.assertTrue(r.put(data))
+        self.assertEqual(len(r), 4 * 4 + 8)
+        self.assertEqual([r.get() for i in range(5)],
+                         ['a', '', 'hello', '\x00\xff', None])
+        self.assertFalse(r)
+        for data in ('a', 'b', 'c'):
+            r.put(data)
+        self.assertEqual(r.drain(2), ['a', 'b'])
+        self.assertEqual(r.drain(), ['c'])
+        self.assertEqual(r.drain(), [])
+
+    def test_wrap(self):
+        r = self.ring
+        for i in range(20):
+            data = chr(65 + i) * (i % 13)
+            self.assertTrue(r.put(data))
+            self.assertTrue(r.put('x'))
+            self.assertEqual(r.get(), data)
+            self.assertEqual(r.get(), 'x')
+
+    def test_full(self):
+        r = self.ring
+        self.assertTrue(r.put('x' * 28))
+        self.assertTrue(r.put('y' * 28))
+        self.assertFalse(r.put(''))
+        self.assertEqual(r.get(), 'x' * 28)
+        # would not fit before the end, nor at the start yet
+        self.assertFalse(r.put('z' * 30))
+        self.assertTrue(r.put('z' * 28))
+        self.assertRaises(ValueError, r.put, 'x' * 61)
+
+    def test_bell(self):
+        r = self.ring
+        self.assertFalse(r.wait(0))
+        r.put('a')
+        self.assertTrue(r.wait(0))
+        r.clear()
+        self.assertEqual(r.get(), 'a')
+        self.assertFalse(r.wait(0))
+
+    def test_shared(self):
+        r = self.ring
+        pid = os.fork()
+        if not pid:
+            for i in range(100):
+                while not r.put(str(i)):
+                    pass
+            os._exit(0)
+        received = []
+        while len(received) < 100:
+            r.clear()
+            data = r.get()
+            while data is not None:
+                received.append(data)
+                data = r.get()
+            if len(received) < 100:
+                r.wait(1)
+        os.waitpid(pid, 0)
+        self.assertEqual(received, [str(i) for i in range(100)])
+
+
+class GatewayLinkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.driver = MudDriver()
+        controller = MudGatewayController('127.0.0.1', 0)
+        self.driver.add(controller)
+        self.up = Ring(4096)
+        self.down = Ring(4096)
+        self.link = GatewayLink(controller, self.up, self.down)
+
+    def received(self):
+        result = []
+        message = self.down.get()
+        while message is not None:
+            result.append(unpack(message))
+            message = self.down.get()
+        return result
+
+    def test_session(self):
+        self.up.put(pack(7, OPEN, '10.0.0.1:4000'))
+        self.up.put(pack(7, LINE, 'tester'))
+        self.up.put(pack(7, LINE, 'pw'))
+        self.assertEqual(self.link._receive(), 3)
+        soul = self.link.souls[7]
+        self.assertEqual(soul.handler.client_address, ('10.0.0.1', 4000))
+        self.assertTrue(soul.logged_in)
+        self.driver._commands()
+        self.driver._flush()
+        output = self.received()
+        self.assertEqual(set((conn, kind) for conn, kind, data in output),
+                         set([(7, DATA)]))
+        output = ''.join(data for conn, kind, data in output)
+        self.assertTrue('You logged in as tester.' in output)
+        self.assertTrue('White Expanse' in output)
+
+        self.up.put(pack(7, LINE, 'quit'))
+        self.link._receive()
+        self.driver._commands()
+        output = self.received()
+        self.assertTrue('Goodbye tester' in output[0][2])
+        self.assertEqual(output[-1], (7, CLOSE, ''))
+        self.assertFalse(soul.online)
+
+    def test_full(self):
+        self.up.put(pack(3, OPEN, '10.0.0.1:4000'))
+        self.link._receive()
+        soul = self.link.souls[3]
+        while self.down.put('x' * 1000):
+            pass
+        while self.down.put(''):
+            pass
+        soul.write('first')
+        self.assertFalse(soul.flush())
+        soul.write('second')
+        self.down.drain()
+        self.assertTrue(soul.flush())
+        self.assertEqual(self.received(),
+                         [(3, DATA, 'first'), (3, DATA, 'second')])
+
+    def test_close_full(self):
+        self.up.put(pack(3, OPEN, '10.0.0.1:4000'))
+        self.link._receive()
+        soul = self.link.souls[3]
+        soul.write('bye')
+        while self.down.put(''):
+            pass
+        start = time.time()
+        soul.disconnect()
+        self.assertTrue(time.time() - start < GATEWAY_POLL)
+        self.assertFalse(soul.online)
+        self.assertFalse(soul.write('ignored'))
+        self.assertTrue(soul in self.driver.flushQ)
+        self.down.drain()
+        self.driver._flush()
+        self.assertEqual(self.received(), [(3, DATA, 'bye'), (3, CLOSE, '')])
+        self.assertEqual(list(self.driver.flushQ), [])
+
+    def test_closed(self):
+        self.up.put(pack(1, OPEN, '10.0.0.1:4000'))
+        self.up.put(pack(1, CLOSE))
+        self.up.put(pack(1, LINE, 'ignored'))
+        self.up.put(pack(0, READY, '5000'))
+        self.link._receive()
+        self.assertEqual(self.link.souls, {})
+        self.assertEqual(self.link.port, 5000)
+
+
+class GatewayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.up = Ring(4096)
+        self.down = Ring(4096)
+        self.gateway = Gateway(self.up, self.down)
+
+    def tearDown(self):
+        self.up.close()
+        self.down.close()
+
+    def test_backlog(self):
+        while self.up.put(''):
+            pass
+        start = time.time()
+        self.gateway._send(1, LINE, 'look')
+        self.gateway._send(1, CLOSE)
+        self.assertTrue(time.time() - start < GATEWAY_POLL)
+        self.assertFalse(self.gateway._send_backlog())
+        self.up.drain()
+        self.gateway._send(2, OPEN, '10.0.0.1:4000')
+        self.assertTrue(self.gateway._send_backlog())
+        self.assertEqual([unpack(m) for m in self.up.drain()],
+                         [(1, LINE, 'look'), (1, CLOSE, ''),
+                          (2, OPEN, '10.0.0.1:4000')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mtj.mud.journal import *
+from mtj.mud.runner import MudDriver
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def play(self):
+        driver = MudDriver(journal=self.path)
+        player = MudPlayer(name='tester')
+        driver.Q(Login(player, driver.starting['main'], trail='tester'))
+        driver._commands()
+        for line in ('look', 'say hello there', 'go down', 'l'):
+            driver.Q(player.process_cmd(line))
+            driver._commands()
+        # not typed in, not journaled
+        driver.Q(Look(player))
+        driver._commands()
+        driver._tick()
+        driver.journal.close()
+        return player
+
+    def test_record(self):
+        player = self.play()
+        h = player._handle
+        self.assertEqual([r[1:] for r in read(self.path)], [
+            (h, 'login', 'tester'),
+            (h, 'look', ''),
+            (h, 'say', 'hello there'),
+            (h, 'go', 'down'),
+            (h, 'look', ''),
+        ])
+        # appended to
+        self.play()
+        self.assertEqual(len(list(read(self.path))), 10)
+
+    def test_replay(self):
+        player = self.play()
+        r = Replay()
+        self.assertEqual(r.run(read(self.path)), 5)
+        self.assertEqual((r.skipped, r.failed), (0, 0))
+        replayed = r.bodies[player._handle]
+        self.assertFalse(replayed is player)
+        self.assertEqual(replayed.parent.shortdesc, player.parent.shortdesc)
+        self.assertNotEqual(replayed.parent, r.driver.starting['main'])
+
+    def test_bad(self):
+        self.play()
+        data = open(self.path, 'rb').read()
+        open(self.path, 'wb').write(data[:-3])
+        self.assertRaises(JournalError, list, read(self.path))
+        open(self.path, 'wb').write('garbage')
+        self.assertRaises(JournalError, list, read(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
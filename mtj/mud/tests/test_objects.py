@@ -1,11 +1,368 @@
+import sys
+import threading
 import unittest
+import weakref
+
+from mtj.mud.objects import *
+
+
+class Push(MudNotify):
+    pass
+
+
+class Pull(MudNotify):
+    pass
+
+
+class Button(MudObject):
+    _siblings_cmds = CmdTable({'push': Push})
+    _parent_cmds = CmdTable({'pull': Pull})
+
+
+class Trap(MudObject):
+    def init_cmd(self, caller, cmd, arg, sender=None):
+        return cmd == 'push'
 
-from mtmud.MudObjects import *
 
 class MudObjectsTestCase(unittest.TestCase):
     def test_base(self):
         o = MudObject()
         self.assertEqual(o.__class__, MudObject)
 
+
+class CompactTestCase(unittest.TestCase):
+    def test_lazy(self):
+        o = MudObject(shortdesc='sword')
+        self.assertFalse(hasattr(o, '__dict__'))
+        self.assertEqual(o._children, None)
+        self.assertEqual(list(o.children), [])
+        self.assertEqual(o.id, ['sword'])
+        self.assertEqual(o.find('sword'), None)
+        self.assertEqual(o._attributes, None)
+        o.attributes['weight'] = 3
+        self.assertEqual(o.attributes, {'weight': 3})
+        o.add(MudObject(shortdesc='gem'))
+        self.assertEqual(len(o.children), 1)
+        self.assertTrue(weakref.ref(o)() is o)
+
+    def test_subclass(self):
+        p = MudPlayer(name='tester')
+        p.anything = True
+        self.assertEqual(p.id, ['tester'])
+
+
+class DispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.room = MudRoom()
+        self.player = MudPlayer(name='tester')
+        self.room.add(self.player)
+
+    def test_self_and_parent(self):
+        self.assertTrue(isinstance(self.player.process_cmd('look'), Look))
+        self.assertTrue(isinstance(self.player.process_cmd('go up'), Go))
+        self.assertEqual(self.player.process_cmd('push'), None)
+
+    def test_siblings(self):
+        button = Button()
+        self.room.add(button)
+        a = self.player.process_cmd('push it')
+        self.assertTrue(isinstance(a, Push))
+        self.assertEqual(a.trail, 'it')
+        # the button itself is not its own sibling
+        self.assertEqual(button.process_cmd('push'), None)
+        self.room.remove(button)
+        self.assertEqual(self.player.process_cmd('push'), None)
+
+    def test_children(self):
+        button = Button()
+        self.player.add(button)
+        self.assertTrue(isinstance(self.player.process_cmd('pull'), Pull))
+        self.assertEqual(self.player.process_cmd('push'), None)
+        self.player.remove(button)
+        self.assertEqual(self.player.process_cmd('pull'), None)
+
+    def test_trap_order(self):
+        # children that override init_cmd are asked in their order.
+        trap = Trap()
+        self.room.add(trap)
+        self.room.add(Button())
+        self.assertEqual(self.player.process_cmd('push'), True)
+        self.room.remove(trap)
+        self.room.add(trap)
+        self.assertTrue(isinstance(self.player.process_cmd('push'), Push))
+
+    def test_class_table(self):
+        button = Button()
+        self.room.add(button)
+        self.assertEqual(self.player.process_cmd('poke'), None)
+        Button._siblings_cmds['poke'] = Push
+        try:
+            self.assertTrue(isinstance(self.player.process_cmd('poke'),
+                                       Push))
+        finally:
+            del Button._siblings_cmds['poke']
+        self.assertEqual(self.player.process_cmd('poke'), None)
+
+    def test_instance_table(self):
+        button = Button()
+        self.room.add(button)
+        button.add_cmd('poke', Push, '_siblings_cmds')
+        self.assertTrue(isinstance(self.player.process_cmd('poke'), Push))
+        button.remove_cmd('push', '_siblings_cmds')
+        self.assertEqual(self.player.process_cmd('push'), None)
+        # the class table still has it
+        self.assertTrue('push' in Button._siblings_cmds)
+        button._siblings_cmds = {'press': Push}
+        self.assertEqual(self.player.process_cmd('poke'), None)
+        self.assertTrue(isinstance(self.player.process_cmd('press'), Push))
+
+    def test_index_kept(self):
+        self.room.add(Button())
+        self.player.process_cmd('push')
+        index = self.room._cmd_index
+        # tables of objects elsewhere have nothing to do with it
+        MudPlayer(name='elsewhere').add_cmd('poke', Push)
+        other = Button()
+        other.add_cmd('poke', Push, '_siblings_cmds')
+        self.player.process_cmd('push')
+        self.assertTrue(self.room._cmd_index is index)
+
+
+class ResolveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.room = MudRoom()
+        self.other = MudRoom()
+        self.link = MudRoomLink(link=((self.room, 'down'),
+                                      (self.other, 'up')))
+        self.player = MudPlayer(name='tester')
+        self.room.add(self.player)
+
+    def test_abbreviation(self):
+        p = self.player
+        self.assertTrue(isinstance(p.process_cmd('l'), Look))
+        a = p.process_cmd('hist')
+        self.assertTrue(isinstance(a, History))
+        # help or history
+        self.assertEqual(p.process_cmd('h'), None)
+        a = p.process_cmd('sa hello there')
+        self.assertTrue(isinstance(a, Say))
+        self.assertEqual(a.trail, 'hello there')
+
+    def test_exits(self):
+        p = self.player
+        for cmd in ('down', 'd', 'do'):
+            a = p.process_cmd(cmd)
+            self.assertTrue(isinstance(a, Go))
+            self.assertEqual(a.trail, 'down')
+        self.assertEqual(p.process_cmd('u'), None)
+        self.link.destroy()
+        self.assertEqual(p.process_cmd('d'), None)
+        self.assertEqual(p.process_cmd('down'), None)
+
+    def test_instance_commands(self):
+        p = self.player
+        p.add_cmd('push', Push)
+        self.assertTrue(isinstance(p.process_cmd('pu'), Push))
+        p.remove_cmd('look')
+        self.assertEqual(p.process_cmd('l'), None)
+
+
+class ExitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.room = MudRoom()
+        self.north = MudRoom()
+        self.east = MudRoom()
+        self.links = [
+            MudRoomLink(link=((self.room, 'north'), (self.north, 'south'))),
+            MudRoomLink(link=((self.room, 'east'), (self.east, 'west'))),
+        ]
+
+    def test_exits(self):
+        room = self.room
+        self.assertEqual(room.roomlinks, ('north', 'east'))
+        self.assertTrue(room.exit('north') is self.north)
+        self.assertTrue(self.east.exit('west') is room)
+        self.assertEqual(room.exit('west'), None)
+        self.assertEqual(room.get_links('east'), [('east', self.east)])
+        self.links[0].destroy()
+        self.assertEqual(room.roomlinks, ('east',))
+        self.assertEqual(room.exit('north'), None)
+        self.assertEqual(self.north.roomlinks, ())
+
+    def test_meta(self):
+        room = self.room
+        self.assertEqual(room.meta(MudRoomLink), self.links)
+        self.assertEqual(room.meta(MudMeta), self.links)
+        self.assertEqual(room.meta(MudRoom), [])
+        self.assertEqual(self.links[0].meta(MudRoom),
+                         [self.room, self.north])
+        self.assertEqual(len(room.meta()), 2)
+        self.assertFalse(room.add_meta(self.links[0]))
+        self.assertTrue(room.remove_meta(self.links[0]))
+        self.assertFalse(room.remove_meta(self.links[0]))
+
+    def test_render_cache(self):
+        player = MudPlayer(name='tester')
+        self.room.add(player)
+        self.room.add(MudObject(shortdesc='rock'))
+
+        def look():
+            look = player.process_cmd('look')
+            look.setResponse()
+            return look.callerMsg
+
+        text = look()
+        self.assertTrue('north, east' in text)
+        self.assertTrue(' rock\r\n' in text)
+        self.assertTrue(look() is not text)
+        self.assertEqual(look(), text)
+        self.room.add(MudObject(shortdesc='pebble'))
+        self.assertTrue(' pebble\r\n' in look())
+        self.room.longdesc = 'A bare room.'
+        self.assertTrue('A bare room.' in look())
+        self.room.shortdesc = 'Bare room'
+        self.assertTrue(look().startswith('Bare room'))
+        self.links[1].destroy()
+        self.assertTrue('Obvious exits are north.' in look())
+
+    def test_go(self):
+        player = MudPlayer(name='tester')
+        self.room.add(player)
+        go = player.process_cmd('n')
+        self.assertTrue(go.preparation())
+        self.assertTrue(go.target is self.north)
+        go = player.process_cmd('go west')
+        self.assertFalse(go.preparation())
+
+
+class FindTestCase(unittest.TestCase):
+    def setUp(self):
+        self.room = MudRoom()
+        self.swords = [MudObject(shortdesc='sword') for i in range(3)]
+        self.shield = MudObject(shortdesc='shield')
+        for obj in self.swords[:2] + [self.shield] + self.swords[2:]:
+            self.room.add(obj)
+
+    def test_find_id(self):
+        room = self.room
+        self.assertTrue(room.find_id('sword') is self.swords[0])
+        self.assertEqual(room.find_id('swo'), None)
+        self.assertTrue(room.find_id('shield') is self.shield)
+
+    def test_ordinal(self):
+        room = self.room
+        self.assertTrue(room.find('sword') is self.swords[0])
+        self.assertTrue(room.find('2.sword') is self.swords[1])
+        self.assertTrue(room.find('3.sword') is self.swords[2])
+        self.assertEqual(room.find('4.sword'), None)
+        self.assertEqual(room.find('0.sword'), None)
+
+    def test_prefix(self):
+        room = self.room
+        self.assertTrue(room.find('sh') is self.shield)
+        # in the order they were added
+        self.assertTrue(room.find('s') is self.swords[0])
+        self.assertTrue(room.find('3.s') is self.shield)
+        self.assertEqual(room.find('x'), None)
+
+    def test_changes(self):
+        room = self.room
+        sword = self.swords[0]
+        room.find('sword')
+        sword.shortdesc = 'broken sword'
+        self.assertTrue(room.find('sword') is self.swords[1])
+        self.assertTrue(room.find('broken') is sword)
+        sword.add_id('sword')
+        self.assertTrue(room.find('sword') is sword)
+        sword.remove_id('sword')
+        self.assertTrue(room.find('sword') is self.swords[1])
+        room.remove(self.shield)
+        self.assertEqual(room.find('sh'), None)
+        self.assertEqual(sorted(room._id_index),
+                         ['broken sword', 'sword'])
+
+    def test_look(self):
+        player = MudPlayer(name='tester')
+        self.room.add(player)
+        self.shield.longdesc = 'A round shield.'
+        look = player.process_cmd('look sh')
+        look.setResponse()
+        self.assertTrue('A round shield.' in look.callerMsg)
+        look = player.process_cmd('look 9.sword')
+        look.setResponse()
+        self.assertEqual(look.callerMsg, 'You do not see 9.sword here.')
+
+
+class CmdTableTestCase(unittest.TestCase):
+    def test_instance_override(self):
+        a = MudPlayer(name='a')
+        b = MudPlayer(name='b')
+        self.assertTrue(a._cmds is b._cmds is MudPlayer._cmds)
+        a.add_cmd('push', Push)
+        self.assertTrue(a.remove_cmd('say'))
+        self.assertFalse(a.remove_cmd('say'))
+        self.assertTrue('push' in a._cmds)
+        self.assertFalse('say' in a._cmds)
+        self.assertTrue('look' in a._cmds)
+        self.assertFalse('push' in b._cmds)
+        self.assertTrue('say' in b._cmds)
+        self.assertTrue(b._cmds is MudPlayer._cmds)
+
+    def test_class_change_reaches_overrides(self):
+        a = MudPlayer(name='a')
+        a.add_cmd('push', Push)
+        MudPlayer._cmds['pull'] = Pull
+        try:
+            self.assertEqual(a._cmds['pull'], Pull)
+            self.assertEqual(sorted(a._cmds.keys()),
+                             sorted(MudPlayer._cmds.keys() + ['push']))
+        finally:
+            del MudPlayer._cmds['pull']
+        self.assertFalse('pull' in a._cmds)
+
+    def test_assign(self):
+        a = MudObject()
+        a._cmds = {'push': Push}
+        self.assertEqual(a._cmds['push'], Push)
+        self.assertFalse('push' in MudObject._cmds)
+
+
+class IndexThreadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.interval = sys.getcheckinterval()
+        # switch threads as often as possible.
+        sys.setcheckinterval(1)
+
+    def tearDown(self):
+        sys.setcheckinterval(self.interval)
+
+    def test_lookup(self):
+        # commands are looked up by the threads serving the connections
+        # while the driver changes what is in the room.
+        room = MudRoom()
+        player = MudPlayer(name='p')
+        room.add(player)
+        errors = []
+        def change():
+            for i in xrange(100):
+                buttons = [Button(shortdesc='button%d' % j) for j in xrange(10)]
+                for button in buttons:
+                    button.add_cmd('pull%d' % (i % 3), Pull, '_siblings_cmds')
+                    room.add(button)
+                for button in buttons:
+                    room.remove(button)
+        t = threading.Thread(target=change)
+        t.start()
+        while t.isAlive():
+            try:
+                player.process_cmd('push')
+                player.process_cmd('pull1')
+                room.find('button')
+            except Exception, e:
+                errors.append(e)
+        t.join()
+        self.assertEqual(errors, [])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import gc
+import unittest
+
+from mtj.mud.registry import Registry, registry
+from mtj.mud.objects import *
+
+
+class Thing(object):
+    def __init__(self, shortdesc):
+        self.shortdesc = shortdesc
+        self._handle = None
+
+
+class Gem(Thing):
+    pass
+
+
+class RegistryTestCase(unittest.TestCase):
+    def test_lookup(self):
+        r = Registry()
+        ruby = Gem('Ruby')
+        rock = Thing('rock')
+        handle = r.register(ruby)
+        self.assertEqual(r.register(ruby), handle)
+        r.register(rock)
+        self.assertTrue(r.get(handle) is ruby)
+        self.assertEqual(r.by_name('ruby'), [ruby])
+        self.assertEqual(r.by_type(Gem), [ruby])
+        self.assertEqual(len(r.by_type(Thing)), 2)
+        self.assertEqual(r.by_name('rock', Gem), [])
+        r.rename(ruby, 'Gem')
+        self.assertEqual(r.by_name('ruby'), [])
+        self.assertEqual(r.by_name('GEM'), [ruby])
+        self.assertTrue(r.unregister(ruby))
+        self.assertFalse(r.unregister(ruby))
+        self.assertEqual(r.get(handle), None)
+        self.assertEqual(r.by_type(Gem), [])
+
+    def test_weak(self):
+        r = Registry()
+        handle = r.register(Gem('ruby'))
+        gc.collect()
+        self.assertEqual(r.get(handle), None)
+        self.assertEqual(r.by_name('ruby'), [])
+        self.assertEqual(len(r), 0)
+        self.assertEqual(r._types, {})
+
+    def test_objects(self):
+        player = MudPlayer(name='Registered')
+        self.assertTrue(registry.get(player.handle) is player)
+        self.assertEqual(registry.by_name('registered', MudPlayer), [player])
+        self.assertTrue(player in registry.by_type(MudSprite))
+        self.assertTrue(player in registry.by_type(MudObject))
+        self.assertTrue(player in registry.by_type(MudPlayer))
+        item = MudObject(shortdesc='registered')
+        # not until its handle is needed
+        self.assertEqual(registry.by_name('registered'), [player])
+        self.assertTrue(registry.get(item.handle) is item)
+        self.assertFalse(item in registry.by_type(MudPlayer))
+        self.assertTrue(item in registry.by_type(MudObject))
+        self.assertEqual(len(registry.by_name('registered')), 2)
+        # these are registered right away
+        room = MudRoom()
+        self.assertTrue(room._handle is not None)
+        self.assertTrue(room in registry.by_type(MudRoom))
+
+
+if __name__ == '__main__':
+    unittest.main()
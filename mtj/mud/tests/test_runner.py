@@ -0,0 +1,20 @@
+import unittest
+
+from mtj.mud.runner import *
+
+
+class DriverTestCase(unittest.TestCase):
+    def test_commands(self):
+        driver = MudDriver()
+        start = driver.starting['main']
+        player = MudPlayer(name='walker')
+        start.add(player)
+        driver.Q(player.process_cmd('go down'))
+        self.assertEqual(len(driver.cmdQ), 1)
+        driver._commands()
+        self.assertEqual(len(driver.cmdQ), 0)
+        self.assertFalse(player.parent is start)
+
+
+if __name__ == '__main__':
+    unittest.main()
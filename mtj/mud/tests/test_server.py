@@ -0,0 +1,73 @@
+import socket
+import unittest
+
+from mtj.mud.server import *
+
+
+class Controller(object):
+    """\
+    Stands in for the controller and the driver of a server.
+    """
+
+    soul_class = Soul
+
+    def __init__(self):
+        self.driver = self
+
+    def flush_later(self, soul):
+        pass
+
+
+class EventMudServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = EventMudServer(('127.0.0.1', 0), MudConnection,
+                                     Controller())
+        self.clients = []
+
+    def tearDown(self):
+        self.server.server_close()
+        self.server.close_remaining()
+        for client in self.clients:
+            client.close()
+
+    def connect(self):
+        client = socket.create_connection(self.server.server_address)
+        self.clients.append(client)
+        while len(self.server.souls) < len(self.clients):
+            self.server.handle_request()
+        return client
+
+    def test_reap(self):
+        self.connect()
+        self.connect()
+        fd, conn = self.server.connections.items()[0]
+        # as the driver would
+        conn.soul.disconnect()
+        self.server.handle_request()
+        self.assertFalse(fd in self.server.connections)
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(len(self.server.souls), 1)
+        # closing again does nothing
+        self.server._close_connection(fd)
+
+    def test_close(self):
+        client = self.connect()
+        self.server.server_close()
+        # nothing closed until whoever serves is done.
+        self.assertEqual(len(self.server.connections), 1)
+        self.server.handle_request()
+        self.server.close_remaining()
+        self.assertEqual(self.server.connections, {})
+        self.assertEqual(self.server.souls, set())
+        client.settimeout(1)
+        data = ''
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        self.assertTrue('Server shutting down.' in data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+from mtj.mud.telnet import *
+
+
+class Handler(object):
+    def __init__(self):
+        self.log = []
+
+    def telnet_negotiate(self, cmd, opt):
+        self.log.append((cmd, opt))
+
+    def telnet_command(self, cmd):
+        self.log.append((cmd,))
+
+    def telnet_subneg(self, opt, data):
+        self.log.append((SB, opt, data))
+
+
+class TelnetParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.handler = Handler()
+        self.parser = TelnetParser(self.handler, max_line=16)
+
+    def test_lines(self):
+        p = self.parser
+        self.assertEqual(p.feed('look\r\nsay hi\r\n'), ['look', 'say hi'])
+        self.assertEqual(p.feed('\r\n'), [''])
+        self.assertEqual(p.feed('\n'), [])
+        self.assertEqual(p.feed('go do'), [])
+        self.assertEqual(p.feed('wn\n'), ['go down'])
+
+    def test_unprintable(self):
+        self.assertEqual(self.parser.feed('lo\x00\x07ok\x80\r'), ['look'])
+
+    def test_negotiate_split(self):
+        p = self.parser
+        self.assertEqual(p.feed('lo' + IAC), [])
+        self.assertEqual(p.feed(DO), [])
+        self.assertEqual(self.handler.log, [])
+        self.assertEqual(p.feed(TM + 'ok\r\n'), ['look'])
+        self.assertEqual(self.handler.log, [(DO, TM)])
+
+    def test_subneg(self):
+        p = self.parser
+        data = 'a' + IAC + SB + '\x18\x00ab' + IAC + IAC + 'c' + IAC
+        self.assertEqual(p.feed(data), [])
+        self.assertEqual(p.feed(SE + 'b\r'), ['ab'])
+        self.assertEqual(self.handler.log,
+                         [(SB, '\x18', '\x00ab' + IAC + 'c')])
+
+    def test_commands(self):
+        p = self.parser
+        self.assertEqual(p.feed('lookx' + IAC + EC + IAC + NOP + '\r'),
+                         ['look'])
+        self.assertEqual(p.feed('junk' + IAC + EL + 'say\r'), ['say'])
+        self.assertEqual(self.handler.log, [(NOP,)])
+
+    def test_bytearray(self):
+        buf = bytearray('look\r\n' + IAC + WILL + ECHO + 'leftover')
+        self.assertEqual(self.parser.feed(buf, 9), ['look'])
+        self.assertEqual(self.handler.log, [(WILL, ECHO)])
+
+    def test_truncate(self):
+        p = self.parser
+        self.assertEqual(p.feed('x' * 20), [])
+        self.assertEqual(p.feed('y\r'), ['x' * 16])
+        self.assertEqual(p.overflow, 1)
+
+
+class FrameTestCase(unittest.TestCase):
+    def test_frame(self):
+        self.assertEqual(frame('hi'), IAC + WILL + ECHO + 'hi\r\n' +
+                         IAC + WONT + ECHO)
+        self.assertEqual(frame('hi\r\n'), frame('hi'))
+        self.assertEqual(frame('> ', False), IAC + WILL + ECHO + '> ' +
+                         IAC + WONT + ECHO)
+
+    def test_shared(self):
+        f = Frame('hi')
+        self.assertEqual(f.data, frame('hi'))
+        self.assertEqual(str(f), 'hi')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+from mtj.mud.timer import *
+
+
+class TimerWheelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(resolution=1, now=0)
+        self.ran = []
+
+    def action(self, name):
+        return lambda: self.ran.append(name)
+
+    def test_order(self):
+        w = self.wheel
+        for delay in (300, 5, 70000, 20000, 0):
+            w.schedule(self.action(delay), delay, now=0)
+        self.assertEqual(len(w), 5)
+        w.run(0)
+        self.assertEqual(self.ran, [0])
+        w.run(4)
+        self.assertEqual(self.ran, [0])
+        w.run(5)
+        self.assertEqual(self.ran, [0, 5])
+        w.run(299)
+        self.assertEqual(self.ran, [0, 5])
+        w.run(300)
+        self.assertEqual(self.ran, [0, 5, 300])
+        w.run(19999)
+        w.run(20000)
+        self.assertEqual(self.ran, [0, 5, 300, 20000])
+        w.run(80000)
+        self.assertEqual(self.ran, [0, 5, 300, 20000, 70000])
+        self.assertEqual(len(w), 0)
+        self.assertEqual(w.next_run(), None)
+
+    def test_far(self):
+        w = self.wheel
+        # beyond what the wheels reach
+        far = (1 << 26) + 1000
+        w.schedule(self.action('far'), far, now=0)
+        w.run(far - 1)
+        self.assertEqual(self.ran, [])
+        w.run(far)
+        self.assertEqual(self.ran, ['far'])
+
+    def test_cancel(self):
+        w = self.wheel
+        t = w.schedule(self.action('a'), 10, now=0)
+        w.schedule(self.action('b'), 10, now=0)
+        self.assertTrue(t.cancel())
+        self.assertFalse(t.cancel())
+        self.assertFalse(t.active)
+        w.run(10)
+        self.assertEqual(self.ran, ['b'])
+
+    def test_cancel_while_running(self):
+        w = self.wheel
+        timers = []
+        def cancel_all():
+            self.ran.append('x')
+            for t in timers:
+                t.cancel()
+        for i in range(5):
+            timers.append(w.schedule(cancel_all, 3, now=0))
+        w.run(3)
+        self.assertEqual(self.ran, ['x'])
+        self.assertEqual(len(w), 0)
+
+    def test_interval(self):
+        w = self.wheel
+        t = w.schedule(self.action('hb'), 2, 3, now=0)
+        w.run(1)
+        self.assertEqual(w.next_run(), 2)
+        w.run(2)
+        w.run(5)
+        w.run(8)
+        self.assertEqual(self.ran, ['hb'] * 3)
+        t.cancel()
+        w.run(20)
+        self.assertEqual(self.ran, ['hb'] * 3)
+
+    def test_idle(self):
+        w = TimerWheel(resolution=0.1, now=100.0)
+        w.run(100.0)
+        # made a while after the last run, it counts from then.
+        w.schedule(self.action('late'), 1.0, now=101.9)
+        w.run(101.9)
+        w.run(102.8)
+        self.assertEqual(self.ran, [])
+        w.run(102.9)
+        self.assertEqual(self.ran, ['late'])
+        # never before the next tick to run
+        w.schedule(self.action('past'), 0, now=50.0)
+        w.run(103.0)
+        self.assertEqual(self.ran, ['late', 'past'])
+
+    def test_errors(self):
+        w = self.wheel
+        w.schedule(lambda: 1 / 0, 1, now=0)
+        w.schedule(self.action('after'), 1, now=0)
+        w.run(1)
+        self.assertEqual(self.ran, ['after'])
+
+
+if __name__ == '__main__':
+    unittest.main()
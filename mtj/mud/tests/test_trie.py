@@ -0,0 +1,37 @@
+import unittest
+
+from mtj.mud.trie import *
+
+
+class TrieTestCase(unittest.TestCase):
+    def setUp(self):
+        self.trie = Trie(['look', 'history', 'help', 'go', 'gold'])
+
+    def test_complete(self):
+        t = self.trie
+        self.assertEqual(t.complete('l'), ['look'])
+        self.assertEqual(t.complete('hist'), ['history'])
+        self.assertEqual(sorted(t.complete('h')), ['help', 'history'])
+        # exact words win over longer ones
+        self.assertEqual(t.complete('go'), ['go'])
+        self.assertEqual(t.complete('gol'), ['gold'])
+        self.assertEqual(t.complete('x'), [])
+        self.assertEqual(t.complete(''), [])
+
+    def test_add_remove(self):
+        t = self.trie
+        self.assertEqual(len(t), 5)
+        self.assertFalse(t.add('look'))
+        self.assertTrue(t.remove('help'))
+        self.assertFalse(t.remove('help'))
+        self.assertFalse('help' in t)
+        self.assertEqual(t.complete('h'), ['history'])
+        self.assertTrue(t.remove('go'))
+        self.assertEqual(t.complete('g'), ['gold'])
+        self.assertTrue('gold' in t)
+        self.assertEqual(len(t), 3)
+        self.assertEqual(sorted(t), ['gold', 'history', 'look'])
+
+
+if __name__ == '__main__':
+    unittest.main()
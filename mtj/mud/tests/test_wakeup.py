@@ -0,0 +1,37 @@
+import time
+import unittest
+
+from mtj.mud.wakeup import *
+
+
+class WakeupTestCase(unittest.TestCase):
+    def test_set(self):
+        w = Wakeup()
+        self.assertFalse(w.wait(0))
+        w.set()
+        self.assertTrue(w.wait(0))
+        w.clear()
+        self.assertFalse(w.isSet())
+        w.close()
+
+    def test_short_wait(self):
+        w = Wakeup()
+        start = time.time()
+        w.wait(0.0002)
+        # not rounded down to not waiting at all
+        self.assertTrue(time.time() - start >= 0.0002)
+        w.close()
+
+    def test_close(self):
+        w = Wakeup()
+        w.close()
+        self.assertTrue(w.closed)
+        # harmless from then on
+        w.set()
+        w.clear()
+        self.assertTrue(w.wait(1))
+        w.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
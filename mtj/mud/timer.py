@@ -0,0 +1,229 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+import time
+import logging
+
+from config import *
+
+LOG = logging.getLogger("mtj.mud.timer")
+
+# the first wheel has a slot for each tick, each of the next ones a
+# slot for a full turn of the one below it.
+_ROOT_BITS = 8
+_WHEEL_BITS = 6
+_WHEELS = 4
+_ROOT_SIZE = 1 << _ROOT_BITS
+_ROOT_MASK = _ROOT_SIZE - 1
+_WHEEL_MASK = (1 << _WHEEL_BITS) - 1
+# as far ahead as the wheels reach, in ticks.
+_SPAN = 1 << (_ROOT_BITS + (_WHEELS - 1) * _WHEEL_BITS)
+
+
+class Timer(object):
+    """\
+    Something scheduled on a TimerWheel, returned by schedule.
+    """
+
+    __slots__ = ('action', 'expires', 'interval', '_wheel', '_slot')
+
+    def __init__(self, action, expires, interval=None):
+        self.action = action
+        # in ticks of the wheel
+        self.expires = expires
+        self.interval = interval
+        self._wheel = None
+        self._slot = None
+
+    @property
+    def active(self):
+        return self._slot is not None
+
+    def cancel(self):
+        """\
+        Stops the timer, returns False if it was not pending.
+        """
+        if self._slot is None:
+            return False
+        self._wheel._remove(self)
+        return True
+
+    def __repr__(self):
+        return '<Timer %r at tick %d>' % (self.action, self.expires)
+
+
+class TimerWheel(object):
+    """\
+    Hierarchical timer wheel, runs actions after a delay or every so
+    often.
+
+    Time is counted in ticks of resolution seconds.  Timers due within
+    a turn of the first wheel sit in the slot of their tick; ones
+    further away sit in a slot of a coarser wheel covering many ticks,
+    and are moved down to a finer one whenever the wheel below it comes
+    round.  So adding and cancelling a timer take constant time, and a
+    tick only looks at the timers due in it plus its share of the ones
+    being moved down, however many are pending.
+
+    Not thread safe, it belongs to the thread that calls run.
+    """
+
+    def __init__(self, resolution=TIMER_RESOLUTION, now=None):
+        if now is None:
+            now = time.time()
+        self.resolution = resolution
+        # the next tick to run
+        self._tick = self._ticks(now)
+        self._wheels = [[set() for i in xrange(_ROOT_SIZE)]]
+        for i in xrange(_WHEELS - 1):
+            self._wheels.append([set() for i in xrange(_WHEEL_MASK + 1)])
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _ticks(self, t):
+        return int(t / self.resolution)
+
+    def schedule(self, action, delay, interval=None, now=None):
+        """\
+        Runs action (any callable, usually a MudNotify or MudAction
+        instance) delay seconds after now, and then again every
+        interval seconds if given, until cancelled.  Returns the Timer.
+        """
+        if now is None:
+            now = time.time()
+        ticks = None
+        if interval is not None:
+            # at least a tick, or it would never stop running.
+            ticks = max(1, int(round(interval / self.resolution)))
+        # from now, not from the last run, which may be a while ago;
+        # but nothing before the next tick to run.
+        expires = max(self._ticks(now) + int(round(delay / self.resolution)),
+                      self._tick)
+        timer = Timer(action, expires, ticks)
+        timer._wheel = self
+        self._add(timer)
+        self._count += 1
+        return timer
+
+    def _add(self, timer):
+        expires = timer.expires
+        delta = expires - self._tick
+        if delta < 0:
+            # overdue, run on the next tick.
+            slot = self._wheels[0][self._tick & _ROOT_MASK]
+        elif delta < _ROOT_SIZE:
+            slot = self._wheels[0][expires & _ROOT_MASK]
+        else:
+            if delta >= _SPAN:
+                # further than the wheels reach, park it in the last
+                # slot it can get to; it is placed again from there.
+                expires = self._tick + _SPAN - 1
+                delta = _SPAN - 1
+            level = 1
+            shift = _ROOT_BITS
+            while delta >= 1 << (shift + _WHEEL_BITS):
+                level += 1
+                shift += _WHEEL_BITS
+            slot = self._wheels[level][(expires >> shift) & _WHEEL_MASK]
+        slot.add(timer)
+        timer._slot = slot
+
+    def _remove(self, timer):
+        timer._slot.discard(timer)
+        timer._slot = None
+        self._count -= 1
+
+    def _cascade(self, level):
+        """\
+        Moves the timers of the current slot of wheel level down to the
+        finer wheels, returns the index of that slot.
+        """
+        index = (self._tick >> (_ROOT_BITS + (level - 1) * _WHEEL_BITS)) & \
+            _WHEEL_MASK
+        wheel = self._wheels[level]
+        timers = wheel[index]
+        wheel[index] = set()
+        for timer in timers:
+            self._add(timer)
+        return index
+
+    def run(self, now=None):
+        """\
+        Runs everything that is due at now, returns the number of
+        timers that ran.
+        """
+        if now is None:
+            now = time.time()
+        target = self._ticks(now)
+        ran = 0
+        while self._tick <= target:
+            if target - self._tick >= _ROOT_SIZE:
+                # far behind, skip what is known to be empty.
+                self._tick = min(self._skip(), target + 1)
+                if self._tick > target:
+                    break
+            index = self._tick & _ROOT_MASK
+            if not index:
+                level = 1
+                while level < _WHEELS and not self._cascade(level):
+                    level += 1
+            due = self._wheels[0][index]
+            self._wheels[0][index] = set()
+            # what gets scheduled by the actions for now goes to the
+            # next tick.
+            self._tick += 1
+            # one at a time, as the actions may cancel the others.
+            while due:
+                timer = due.pop()
+                timer._slot = None
+                self._count -= 1
+                self._fire(timer)
+                ran += 1
+        return ran
+
+    def _skip(self):
+        """\
+        Returns the first tick from now on where something can happen:
+        the start of the next slot of the finest wheel with any timers.
+        """
+        if not self._count:
+            return self._tick + _SPAN
+        step = 1
+        for level, wheel in enumerate(self._wheels):
+            if any(wheel):
+                break
+            step = 1 << (_ROOT_BITS + level * _WHEEL_BITS)
+        return (self._tick + step - 1) & ~(step - 1)
+
+    def _fire(self, timer):
+        if timer.interval is not None:
+            # scheduled again before running, so the action can cancel
+            # it.
+            timer.expires = max(timer.expires + timer.interval, self._tick)
+            self._add(timer)
+            self._count += 1
+        try:
+            timer.action()
+        except:
+            LOG.exception('timer %r caused an exception', timer)
+
+    def next_run(self):
+        """\
+        Returns the time (in seconds, like time.time) of the next tick
+        that has something to run, or None if nothing is pending.
+        Timers on the coarser wheels count as due when they are moved
+        down, which may be earlier than they really are.
+        """
+        if not self._count:
+            return None
+        root = self._wheels[0]
+        tick = self._tick
+        end = (tick | _ROOT_MASK) + 1
+        while tick < end:
+            if root[tick & _ROOT_MASK]:
+                break
+            tick += 1
+        return tick * self.resolution
@@ -0,0 +1,112 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+# node layout
+_CHILDREN, _COUNT, _WORD = range(3)
+
+
+class Trie(object):
+    """\
+    Prefix tree of words, for finding what an abbreviation stands for.
+
+    Every node counts the words below it, so whether a prefix is
+    unique is known as soon as the prefix is walked.
+    """
+
+    def __init__(self, words=()):
+        self._root = [{}, 0, None]
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return self._root[_COUNT]
+
+    def __contains__(self, word):
+        node = self._find(word)
+        return node is not None and node[_WORD] is not None
+
+    def __iter__(self):
+        return self.words()
+
+    def _find(self, prefix):
+        node = self._root
+        for c in prefix:
+            node = node[_CHILDREN].get(c)
+            if node is None:
+                return None
+        return node
+
+    def add(self, word):
+        """\
+        Adds word, returns False if it was already there.
+        """
+        if word in self:
+            return False
+        node = self._root
+        node[_COUNT] += 1
+        for c in word:
+            children = node[_CHILDREN]
+            node = children.get(c)
+            if node is None:
+                node = children[c] = [{}, 0, None]
+            node[_COUNT] += 1
+        node[_WORD] = word
+        return True
+
+    def remove(self, word):
+        """\
+        Removes word, returns False if it was not there.
+        """
+        if word not in self:
+            return False
+        node = self._root
+        node[_COUNT] -= 1
+        for c in word:
+            children = node[_CHILDREN]
+            node = children[c]
+            node[_COUNT] -= 1
+            if not node[_COUNT]:
+                # nothing else goes through here
+                del children[c]
+                return True
+        node[_WORD] = None
+        return True
+
+    def words(self, prefix=''):
+        """\
+        Yields every word starting with prefix.
+        """
+        node = self._find(prefix)
+        if node is None:
+            return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node[_WORD] is not None:
+                yield node[_WORD]
+            stack.extend(node[_CHILDREN].values())
+
+    def complete(self, prefix):
+        """\
+        Returns a list of what prefix could stand for: the word itself
+        if it is one, else the only word starting with it.  Otherwise
+        the list is empty if there is none, or has the first two found
+        if there are more.
+        """
+        node = self._find(prefix)
+        if node is None or not prefix:
+            return []
+        if node[_WORD] is not None:
+            return [node[_WORD]]
+        if node[_COUNT] > 1:
+            result = []
+            for word in self.words(prefix):
+                result.append(word)
+                if len(result) > 1:
+                    break
+            return result
+        # only one way down from here.
+        while node[_WORD] is None:
+            node = node[_CHILDREN].values()[0]
+        return [node[_WORD]]
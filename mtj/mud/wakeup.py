@@ -0,0 +1,108 @@
+# mtj.mud - A Basic Mud library in Python
+# Copyright (c) 2007 Tommy Yu
+# This software is released under the GPLv3
+
+import os
+import errno
+import fcntl
+import math
+import select
+import threading
+
+
+class Wakeup(object):
+    """\
+    Lets other threads wake up a thread that waits on it.
+
+    This is a pipe rather than a threading.Event, as waiting on an
+    Event with a timeout is done by polling.  As it has a fileno it can
+    also be waited on along with sockets in select or poll.
+    """
+
+    def __init__(self):
+        self._r, self._w = os.pipe()
+        for fd in (self._r, self._w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._set = False
+        # so the pipe is not closed while it is used.
+        self._lock = threading.Lock()
+        # poll, as the descriptor may be beyond what select can take.
+        self._poller = select.poll()
+        self._poller.register(self._r, select.POLLIN)
+
+    closed = property(lambda self: self._r is None)
+
+    def fileno(self):
+        return self._r
+
+    def isSet(self):
+        return self._set
+
+    def set(self):
+        """\
+        Wakes up the waiting thread.  Cheap to call repeatedly, only the
+        first call after a clear touches the pipe.
+        """
+        if self._set:
+            return
+        self._set = True
+        self._lock.acquire()
+        try:
+            if self._w is not None:
+                os.write(self._w, 'x')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """\
+        Resets the wakeup.  Must be called by the waiting thread before
+        it looks for work, so a set that comes after is not lost.
+        """
+        self._lock.acquire()
+        try:
+            if self._r is None:
+                return
+            self._set = False
+            while os.read(self._r, 512):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        finally:
+            self._lock.release()
+
+    def wait(self, timeout=None):
+        """\
+        Waits until set or for timeout seconds, returns True if set.
+        """
+        if self._set:
+            return True
+        if timeout is not None:
+            # rounded up, or short waits would not wait at all.
+            timeout = int(math.ceil(timeout * 1000))
+        try:
+            self._poller.poll(timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+        return self._set
+
+    def close(self):
+        """\
+        Closes the pipe.  The wakeup then stays set, so whatever still
+        waits on it or sets it does not touch the pipe.
+        """
+        self._lock.acquire()
+        try:
+            if self._r is None:
+                return
+            self._set = True
+            os.close(self._r)
+            os.close(self._w)
+            self._r = self._w = None
+        finally:
+            self._lock.release()
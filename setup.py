@@ -13,7 +13,7 @@ setup(name='mtj.mud',
       author_email='y@metatoaster.com',
       url='https://github.com/metatoaster/mtj.mud',
       license='GPL',
-      scripts=['mudctrl'],
+      scripts=['mudctrl', 'mudload', 'mudreplay'],
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
       include_package_data=True,
       zip_safe=False,